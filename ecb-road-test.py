@@ -4,33 +4,1674 @@
 from Phidget22.Phidget import *
 from Phidget22.Devices.VoltageInput import *
 from Phidget22.Devices.DigitalOutput import *
+from Phidget22.Devices.Manager import *
 import time
 from datetime import datetime, timedelta
 import logging
 import traceback
 import sys
+from array import array
+import threading
+import queue
+import csv
+import os
+import argparse
+import random
+import math
+import itertools
+import json
+import platform
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+import bisect
+import http.server
+import socket
+import struct
+import mmap
+import glob
+import signal
+import tempfile
+from collections import deque
+try:
+    import numpy as np  # Only needed for the high rate filtered acquisition (--filter)
+except ImportError:
+    np = None
+try:
+    import tomllib  # Only needed to read TOML config profiles (--config), it is part of Python 3.11 and later
+except ImportError:
+    tomllib = None
 # endregion End Imports ------------------------------------------------------
 
+# region Classes -------------------------------------------------------------
+class Clock:
+    '''
+    The source of time used by the control logic. The simulator replaces the
+    global clock with a VirtualClock so hours of control can be run in
+    secounds.
+    '''
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    '''A clock that only moves forward when it is advanced by the simulator or the replay'''
+    def __init__(self, startTime: float = None):
+        self.startTime = time.time() if startTime is None else startTime
+        self.startDateTime = datetime.fromtimestamp(self.startTime)
+        self.elapsed = 0.0  # Secounds of simulated time since the clock was created
+
+    def now(self) -> datetime:
+        return self.startDateTime + timedelta(seconds=self.elapsed)
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def time(self) -> float:
+        return self.startTime + self.elapsed
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+
+    def advance(self, seconds: float):
+        self.elapsed += seconds
+
+    def setTime(self, timestamp: float):
+        # Move the clock to a time.time() style timestamp
+        self.elapsed = timestamp - self.startTime
+
+
+class PressureHistory:
+    '''
+    Fixed size ring buffer of [time, pressure] samples used to find how fast
+    the tank pressure is changing. Times come from clock.monotonic() so the
+    window is not effected by changes to the system clock. Samples older than
+    the window are expired as new ones are added, so adding a sample and
+    reading the rate are both constant time no matter how fast the sensors
+    are sampled. If the buffer fills before the window has passed the oldest
+    sample is overwritten.
+    '''
+    def __init__(self, size: int, window: float):
+        self.size = size
+        self.window = window
+        self.times = array('d', bytes(8 * size))
+        self.pressures = array('d', bytes(8 * size))
+        self.oldest = 0  # Index of the oldest sample
+        self.count = 0  # Number of samples currently held
+
+    def append(self, sampleTime: float, pressure: float):
+        # Write the new sample over the slot after the newest one
+        newest = (self.oldest + self.count) % self.size
+        self.times[newest] = sampleTime
+        self.pressures[newest] = pressure
+        if self.count < self.size:
+            self.count += 1
+        else:
+            self.oldest = (self.oldest + 1) % self.size
+        # Expire everything that is older then the window, always keeping the newest sample
+        while self.count > 1 and sampleTime - self.times[self.oldest] > self.window:
+            self.oldest = (self.oldest + 1) % self.size
+            self.count -= 1
+
+    def getRate(self) -> float:
+        # This returns the change in pressure per secound between the oldest and newest samples in the window
+        if self.count < 2:
+            return 0.0
+        newest = (self.oldest + self.count - 1) % self.size
+        elapsed = self.times[newest] - self.times[self.oldest]
+        if elapsed <= 0.0:
+            return 0.0
+        return (self.pressures[newest] - self.pressures[self.oldest]) / elapsed
+
+    def clear(self):
+        self.oldest = 0
+        self.count = 0
+
+
+class ChannelInfo:
+    '''
+    The role of a channel and the calibration used to turn its voltage into
+    pressure. This is worked out once when the channel attaches so the event
+    handlers never have to ask the Phidget library which channel they are.
+    '''
+    OUTPUT_NAMES = ('Inflation', 'Deflation', 'LED', 'Upstream Output', 'Downstream Output')
+
+    def __init__(self, name: str, slope: float, offset: float):
+        self.name = name
+        self.slope = slope
+        self.offset = offset
+        self.isOutput = name in self.OUTPUT_NAMES  # True for the relays and the analog debug outputs
+
+
+class ConfigProfile:
+    '''
+    The set pressure, deflation pressures, transducer calibration and tank
+    pressure correction constants of a rig, with the thresholds that the
+    decision functions compare against worked out once when it is made. A
+    profile is never changed, a new one is made and swapped in whole, so the
+    control logic never sees half of one profile and half of another. A
+    ValueError listing every problem is raised if the values are not safe to
+    control with.
+    '''
+    CALIBRATED_CHANNELS = ('Upstream', 'Downstream', 'Actual Tank')
+
+    def __init__(self, name: str, setPressure: float, deflationOpenPressure: float, deflationClosePressure: float, calibration: dict, correction: tuple):
+        def isNumber(value) -> bool:
+            return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+        problems = list()
+        if not all(isNumber(value) for value in (setPressure, deflationOpenPressure, deflationClosePressure)):
+            problems.append('the set and deflation pressures must be numbers')
+        else:
+            # These are the limits given with DEF_OPEN_PRESSURE and DEF_CLOSE_PRESSURE
+            if not 0.0 < setPressure < CONFIG_MAX_PRESSURE:
+                problems.append(f'setPressure {setPressure} must be between 0 and {CONFIG_MAX_PRESSURE:g}PSI')
+            if not setPressure + 4.0 <= deflationOpenPressure <= CONFIG_MAX_PRESSURE:
+                problems.append(f'deflationOpenPressure {deflationOpenPressure} must be at least setPressure + 4 and at most {CONFIG_MAX_PRESSURE:g}PSI')
+            if not setPressure + 1.0 <= deflationClosePressure <= deflationOpenPressure - 1.0:
+                problems.append(f'deflationClosePressure {deflationClosePressure} must be at least setPressure + 1 and at most deflationOpenPressure - 1')
+        for channelName, value in calibration.items():
+            if channelName not in self.CALIBRATED_CHANNELS:
+                problems.append(f'there is no {channelName} channel to calibrate, only {", ".join(self.CALIBRATED_CHANNELS)}')
+            elif not (isinstance(value, (list, tuple)) and len(value) == 2 and all(isNumber(number) for number in value) and value[0] > 0.0):
+                problems.append(f'the {channelName} calibration must be a positive slope and an offset')
+        if not (isinstance(correction, (list, tuple)) and len(correction) == 3 and all(isNumber(number) for number in correction)):
+            problems.append('correction must be the three correction constants')
+        if problems:
+            raise ValueError(f'profile {name}: ' + '; '.join(problems))
+
+        self.name = name
+        self.setPressure = setPressure
+        self.deflationOpenPressure = deflationOpenPressure
+        self.deflationClosePressure = deflationClosePressure
+        self.inflationStartPressure = setPressure - 1.0  # A fill starts below this, see shouldInflate
+        self.warningPressure = setPressure * 0.9  # The warning light comes on below this, see shouldWarn
+        self.calibration = {channelName: tuple(value) for channelName, value in calibration.items()}
+        self.correction = tuple(correction)
+
+    def getCalibration(self, name: str) -> tuple:
+        # This returns the (slope, offset) used to convert the voltage of the named channel into pressure
+        calibration = self.calibration.get(name)
+        if calibration is not None:
+            return calibration
+        # Any other channel uses the average of the upstream and downstream transducers
+        (upstreamSlope, upstreamOffset), (downstreamSlope, downstreamOffset) = self.calibration['Upstream'], self.calibration['Downstream']
+        return (upstreamSlope + downstreamSlope) / 2.0, (upstreamOffset + downstreamOffset) / 2.0
+
+    def describe(self) -> str:
+        c1, c2, c3 = self.correction
+        return f'{self.name}: set pressure = {self.setPressure:g}PSI, deflation = {self.deflationOpenPressure:g}/{self.deflationClosePressure:g}PSI, ' + \
+            ', '.join(f'{channelName} = {slope:g}*V{offset:+g}' for channelName, (slope, offset) in self.calibration.items()) + f', P_t = {c1:g}*P_d {c2:+g}*P_u {c3:+g}'
+
+
+class NativeCallCounter:
+    '''
+    Counts calls made into the Phidget22 library so the number of native
+    calls made by each voltage change event can be reported. The control
+    cycles are counted on their own, since with --control-period they do not
+    run once per voltage change event.
+    '''
+    def __init__(self):
+        self.calls = 0  # Total native calls
+        self.events = 0  # Number of voltage change events counted
+        self.eventCalls = 0  # Total native calls made during voltage change events
+        self.lastEventCalls = 0  # Native calls made by the most recent voltage change event
+        self.eventStart = 0
+        self.cycles = 0  # Number of control cycles counted
+        self.cycleCalls = 0  # Total native calls made during control cycles
+        self.lastCycleCalls = 0  # Native calls made by the most recent control cycle
+        self.cycleStart = 0
+
+    def add(self, n: int = 1):
+        self.calls += n
+
+    def startEvent(self):
+        self.eventStart = self.calls
+
+    def endEvent(self):
+        self.lastEventCalls = self.calls - self.eventStart
+        self.eventCalls += self.lastEventCalls
+        self.events += 1
+
+    def startCycle(self):
+        self.cycleStart = self.calls
+
+    def endCycle(self):
+        self.lastCycleCalls = self.calls - self.cycleStart
+        self.cycleCalls += self.lastCycleCalls
+        self.cycles += 1
+
+    def getAveragePerEvent(self) -> float:
+        if self.events == 0:
+            return 0.0
+        return self.eventCalls / self.events
+
+    def getAveragePerCycle(self) -> float:
+        if self.cycles == 0:
+            return 0.0
+        return self.cycleCalls / self.cycles
+
+
+class OutputManager:
+    '''
+    Keeps a local copy of the state of every relay and the duty cycle of every
+    analog output so the control loop can read them without a round trip to
+    the device. Writes are only sent when they would change the output, and
+    duty cycle writes can also be held back until they have changed by a
+    minimum amount or a minimum time has passed since the last write. A duty
+    cycle held back by the minimum time is kept and sent by the next write to
+    that output or by flushDutyCycles once the time has passed, so the last
+    value is never lost. The copies are refreshed from the device when a
+    channel attaches and dropped when it detaches.
+    '''
+    def __init__(self, minDutyCycleChange: float = 0.0, minDutyCycleInterval: float = 0.0):
+        self.minDutyCycleChange = minDutyCycleChange
+        self.minDutyCycleInterval = minDutyCycleInterval
+        self.states = dict()  # Maps each DigitalOutput to its last known state
+        self.dutyCycles = dict()  # Maps each DigitalOutput to its last written duty cycle
+        self.dutyCycleTimes = dict()  # Maps each DigitalOutput to the clock.monotonic() of the last duty cycle write
+        self.pendingDutyCycles = dict()  # Maps each DigitalOutput to the newest duty cycle held back by minDutyCycleInterval
+        self.writes = 0  # Number of writes sent to the device
+        self.skippedWrites = 0  # Number of writes that were not needed
+
+    def refresh(self, do: DigitalOutput):
+        # Read the actual state of the output, this is called when the channel attaches
+        nativeCalls.add(2)
+        self.states[do] = do.getState()
+        self.dutyCycles[do] = do.getDutyCycle()
+        self.dutyCycleTimes[do] = clock.monotonic()
+
+    def forget(self, do: DigitalOutput):
+        # The output is no longer known, so the next write will always be sent
+        self.states.pop(do, None)
+        self.dutyCycles.pop(do, None)
+        self.dutyCycleTimes.pop(do, None)
+        self.pendingDutyCycles.pop(do, None)
+
+    def getState(self, do: DigitalOutput) -> bool:
+        state = self.states.get(do)
+        if state is None:
+            nativeCalls.add()
+            state = do.getState()
+            self.states[do] = state
+        return state
+
+    def peekState(self, do: DigitalOutput) -> bool:
+        # This returns the last known state without reading the device, False if it is not known
+        return self.states.get(do) or False
+
+    def setState(self, do: DigitalOutput, state: bool) -> bool:
+        # This returns true if a write was sent to the device
+        if self.states.get(do) == state:
+            self.skippedWrites += 1
+            return False
+        nativeCalls.add()
+        do.setState(state)
+        self.states[do] = state
+        self.writes += 1
+        return True
+
+    def setDutyCycle(self, do: DigitalOutput, dutyCycle: float) -> bool:
+        # This returns true if a write was sent to the device
+        lastDutyCycle = self.dutyCycles.get(do)
+        now = clock.monotonic()
+        if lastDutyCycle is not None:
+            if dutyCycle == lastDutyCycle or abs(dutyCycle - lastDutyCycle) < self.minDutyCycleChange:
+                # The output is already close enough, so an older held back value is not needed
+                self.pendingDutyCycles.pop(do, None)
+                self.skippedWrites += 1
+                return False
+            if now - self.dutyCycleTimes[do] < self.minDutyCycleInterval:
+                self.pendingDutyCycles[do] = dutyCycle
+                self.skippedWrites += 1
+                return False
+        nativeCalls.add()
+        do.setDutyCycle(dutyCycle)
+        self.dutyCycles[do] = dutyCycle
+        self.dutyCycleTimes[do] = now
+        self.pendingDutyCycles.pop(do, None)
+        self.writes += 1
+        return True
+
+    def flushDutyCycles(self, outputs: list) -> int:
+        # This sends the held back duty cycles of outputs whose minimum interval has passed and returns the number sent
+        sent = 0
+        now = clock.monotonic()
+        for do in outputs:
+            dutyCycle = self.pendingDutyCycles.get(do)
+            if dutyCycle is not None and now - self.dutyCycleTimes[do] >= self.minDutyCycleInterval:
+                sent += self.setDutyCycle(do, dutyCycle)
+        return sent
+
+
+class TelemetryWriter(threading.Thread):
+    '''
+    Writes telemetry and log messages from a background thread so the Phidget
+    event handlers never wait on the disk or console. The handlers only put a
+    small tuple on a bounded queue, the formatting and writing all happen on
+    this thread. Samples are written in batches to a CSV file that is rotated
+    once it reaches maxBytes. If the queue is full the new item is dropped and
+    counted, the control loop is never blocked. The simulator sets blocking so
+    nothing is dropped, since it does not run in real time. When several rigs
+    share one writer the rig column holds the hub serial number of each sample.
+    A FlightRecorder dump is queued as a (recorder, reason, time, entries)
+    tuple so it is also written here. If a TelemetryStream is set as stream
+    every sample is also packed into a
+    frame and sent to its subscribers from this thread, and if a
+    TelemetryStore is set as store every sample is also appended to it.
+    '''
+    HEADER = ['time', 'upstreamVoltage', 'downstreamVoltage', 'upstreamPressure', 'downstreamPressure', 'tankPressure', 'actualTankPressure', 'inflation', 'deflation', 'light', 'rig']
+
+    def __init__(self, fileName: str, maxBytes: int, backupCount: int, queueSize: int, batchSize: int, printInterval: float):
+        super().__init__(name='TelemetryWriter', daemon=True)
+        self.fileName = fileName
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.batchSize = batchSize
+        self.printInterval = printInterval  # The latest sample is printed to the console at most once per this many secounds
+        self.queue = queue.Queue(queueSize)
+        self.running = True
+        self.enabled = True  # If false nothing is queued, this is used by the replay
+        self.blocking = False  # If true put waits for room in the queue instead of dropping
+        self.written = 0  # Number of samples written to file
+        self.dropped = 0  # Number of samples and messages dropped because the queue was full
+        self.file = None
+        self.writer = None
+        self.lastPrintTime = 0.0
+        self.stream = None  # The TelemetryStream samples and state changes are published to, if any
+        self.store = None  # The TelemetryStore samples are appended to, if any, it is closed by this thread
+
+    # These are called from the event handlers ---------------------------
+    def record(self, upstreamVoltage: float, downstreamVoltage: float, upstreamPressure: float, downstreamPressure: float, tankPressure: float, actualTankPressure: float, inflation: bool, deflation: bool, light: bool, serialNumber: int = None):
+        self.put((clock.time(), upstreamVoltage, downstreamVoltage, upstreamPressure, downstreamPressure, tankPressure, actualTankPressure, inflation, deflation, light, serialNumber, clock.monotonic()))
+
+    def log(self, level: int, message: str, *args):
+        # The message is only formatted with args once it reaches the writer thread
+        self.put((level, message, args))
+
+    def put(self, item: tuple):
+        if not self.enabled:
+            return
+        try:
+            self.queue.put(item, self.blocking and self.is_alive())
+        except queue.Full:
+            self.dropped += 1
+
+    def getBacklog(self) -> int:
+        return self.queue.qsize()
+
+    def flush(self):
+        # Wait until everything queued so far has been written
+        if self.is_alive():
+            self.queue.join()
+
+    # These run on the writer thread --------------------------------------
+    def run(self):
+        self.openFile()
+        while self.running or not self.queue.empty():
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.writeBatch(batch)
+            for _ in batch:
+                self.queue.task_done()
+        self.file.close()
+        if self.store is not None:
+            self.store.close()
+
+    def writeBatch(self, batch: list):
+        samples = list()
+        frames = list()  # Stream frames in the order they were queued
+        stream = self.stream
+        for item in batch:
+            if item is None:
+                continue
+            elif isinstance(item, bytes):
+                # A state change frame that was packed by the rig
+                frames.append(item)
+            elif len(item) == 4:
+                recorder, reason, dumpTime, entries = item
+                recorder.write(reason, dumpTime, entries)
+            elif len(item) == 3:
+                level, message, args = item
+                if args:
+                    message = message.format(*args)
+                showMessage(message)
+                logging.log(level, message)
+            else:
+                samples.append(item)
+                if stream is not None:
+                    frames.append(stream.packSample(item))
+        if frames and stream is not None:
+            stream.publish(b''.join(frames))
+        if samples:
+            if self.store is not None:
+                self.store.append(samples)
+            # The last field is the clock.monotonic() of the sample, it is only used by the stream
+            self.writer.writerows(sample[:-1] for sample in samples)
+            self.file.flush()
+            self.written += len(samples)
+            now = time.monotonic()
+            if dashboard is None and now - self.lastPrintTime >= self.printInterval:
+                self.lastPrintTime = now
+                sample = samples[-1]
+                rig = '' if sample[10] is None else f'[{sample[10]}] '
+                print(f'{rig}Upstream {sample[3]:.2f}, Downstream = {sample[4]:.2f}, Tank = {sample[5]:.2f}, Backlog = {self.getBacklog()}, Dropped = {self.dropped}')
+            if self.file.tell() >= self.maxBytes:
+                self.rotate()
+
+    def openFile(self):
+        newFile = not os.path.exists(self.fileName) or os.path.getsize(self.fileName) == 0
+        self.file = open(self.fileName, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if newFile:
+            self.writer.writerow(self.HEADER)
+
+    def rotate(self):
+        # Rename telemetry.csv to telemetry.csv.1, telemetry.csv.1 to telemetry.csv.2 and so on
+        self.file.close()
+        for n in range(self.backupCount - 1, 0, -1):
+            source = f'{self.fileName}.{n}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.fileName}.{n + 1}')
+        if self.backupCount > 0:
+            os.replace(self.fileName, f'{self.fileName}.1')
+        else:
+            os.remove(self.fileName)
+        self.openFile()
+
+    def stop(self):
+        # Write everything left in the queue and wait for the thread to finish
+        self.running = False
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+
+class TelemetryStream(threading.Thread):
+    '''
+    Publishes every telemetry sample and every relay or attach state change
+    as fixed size binary frames to any number of subscribers on a local TCP
+    port or Unix socket. This thread only accepts subscribers, the frames are
+    sent from the TelemetryWriter thread so the control logic never waits on
+    a subscriber. The sockets are non-blocking and each subscriber has a
+    bounded backlog, a subscriber that falls further behind than that is
+    dropped. Each connection starts with a HEADER holding MAGIC, VERSION and
+    the frame size, followed by frames laid out as FRAME. ecb-stream-client.py
+    decodes the stream.
+    '''
+    MAGIC = b'ECBT'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBH')
+    # kind, relay bits (1 = inflation, 2 = deflation, 4 = light), rig serial number (0 if not set), clock.monotonic(),
+    # upstream voltage, downstream voltage, upstream pressure, downstream pressure, tank pressure, actual tank pressure
+    FRAME = struct.Struct('<BBxxIddddddd')
+    SAMPLE = 0  # Frame kinds
+    RELAY = 1
+    DETACHED = 2
+    RESUMED = 3
+
+    def __init__(self, address: str, host: str, maxBacklog: int):
+        super().__init__(name='TelemetryStream', daemon=True)
+        self.maxBacklog = maxBacklog  # Bytes a subscriber can fall behind before it is dropped
+        self.running = True
+        self.lock = threading.Lock()
+        self.subscribers = list()  # The [socket, backlog, name] of every subscriber
+        self.subscribed = 0  # Number of subscribers that have connected
+        self.slowDropped = 0  # Number of subscribers dropped for falling behind
+        self.framesSent = 0
+        self.path = None
+        if address.isdigit():
+            self.server = socket.create_server((host, int(address)))
+            self.description = f'{host}:{address}'
+        else:
+            # Unix socket, a socket file left by an earlier run is replaced
+            self.path = address
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(address)
+            self.server.listen()
+            self.description = address
+        self.server.settimeout(0.5)
+
+    @staticmethod
+    def getRelayBits(inflation: bool, deflation: bool, light: bool) -> int:
+        return (1 if inflation else 0) | (2 if deflation else 0) | (4 if light else 0)
+
+    def packSample(self, sample: tuple) -> bytes:
+        # This packs a TelemetryWriter sample tuple into a frame
+        return self.FRAME.pack(self.SAMPLE, self.getRelayBits(sample[7], sample[8], sample[9]), sample[10] or 0, sample[11], \
+                               sample[1], sample[2], sample[3], sample[4], sample[5], sample[6])
+
+    def run(self):
+        while self.running:
+            try:
+                connection, address = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            connection.setblocking(False)
+            name = str(address) if address else 'local'
+            with self.lock:
+                self.subscribers.append([connection, bytearray(self.HEADER.pack(self.MAGIC, self.VERSION, self.FRAME.size)), name])
+                self.subscribed += 1
+            logging.info(f'Telemetry stream subscriber {name} connected')
+
+    def publish(self, data: bytes):
+        # This is called from the TelemetryWriter thread with one or more frames
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            connection, backlog, name = subscriber
+            backlog += data
+            try:
+                sent = connection.send(backlog)
+                del backlog[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.drop(subscriber, 'disconnected')
+                continue
+            if len(backlog) > self.maxBacklog:
+                self.slowDropped += 1
+                self.drop(subscriber, 'dropped for falling behind')
+        self.framesSent += len(data) // self.FRAME.size
+
+    def drop(self, subscriber: list, reason: str):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+        subscriber[0].close()
+        logging.info(f'Telemetry stream subscriber {subscriber[2]} {reason}')
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join()
+        self.server.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            self.drop(subscriber, 'closed')
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class TelemetryStore:
+    '''
+    A columnar on-disk store for long road tests. Samples are appended to
+    pre-allocated chunk files through a memory map, each chunk holds one
+    contiguous column per field for up to chunkRows samples, and a new chunk
+    is started once it is full. The header of every chunk holds the number
+    of samples written and the first and last sample time, which is the time
+    index used to find the chunks of a time range. The header count is only
+    updated after the columns are written, so a store can be read while a
+    test is still running. Appending only needs the standard library,
+    loading needs NumPy, see loadTelemetryStore. A store that already has
+    chunks is continued in a new chunk.
+    '''
+    MAGIC = b'ECBC'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBxxxIIdd')  # magic, version, chunk rows, samples written, first time, last time
+    HEADER_SIZE = 64  # The columns start after this many bytes
+    # Name and array type code of each column, the relays are bits of 1 = inflation, 2 = deflation, 4 = light
+    COLUMNS = (('time', 'd'), ('upstreamVoltage', 'd'), ('downstreamVoltage', 'd'), ('upstreamPressure', 'd'), ('downstreamPressure', 'd'), \
+               ('tankPressure', 'd'), ('actualTankPressure', 'd'), ('rig', 'I'), ('relays', 'B'))
+    CHUNK_PATTERN = 'chunk-{:06d}.ecb'
+
+    def __init__(self, directory: str, chunkRows: int):
+        self.directory = directory
+        self.chunkRows = chunkRows
+        self.written = 0  # Number of samples appended
+        self.chunks = 0  # Number of chunks started
+        self.file = None
+        self.map = None
+        self.columns = list()  # A memoryview of each column of the open chunk, in the order of COLUMNS
+        self.count = 0  # Samples in the open chunk
+        self.firstTime = 0.0
+        self.lastTime = 0.0
+        os.makedirs(directory, exist_ok=True)
+        # Chunks may have been deleted, so numbering goes on after the highest one instead of counting them
+        chunks = getStoreChunks(directory)
+        numberStart = self.CHUNK_PATTERN.index('{')
+        self.nextChunk = int(os.path.basename(chunks[-1])[numberStart:numberStart + 6]) + 1 if chunks else 0
+        self.openChunk()
+
+    @staticmethod
+    def getChunkSize(chunkRows: int) -> int:
+        return TelemetryStore.HEADER_SIZE + sum(array(typeCode).itemsize for _, typeCode in TelemetryStore.COLUMNS) * chunkRows
+
+    @staticmethod
+    def getColumnOffsets(chunkRows: int) -> list:
+        # This returns the byte offset of each column in a chunk
+        offsets = list()
+        offset = TelemetryStore.HEADER_SIZE
+        for _, typeCode in TelemetryStore.COLUMNS:
+            offsets.append(offset)
+            offset += array(typeCode).itemsize * chunkRows
+        return offsets
+
+    def openChunk(self):
+        fileName = os.path.join(self.directory, self.CHUNK_PATTERN.format(self.nextChunk))
+        self.nextChunk += 1
+        self.chunks += 1
+        self.file = open(fileName, 'w+b')
+        # The file is sparse until it is written, so pre-allocating it is cheap
+        self.file.truncate(self.getChunkSize(self.chunkRows))
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.columns = [memoryview(self.map)[offset:offset + array(typeCode).itemsize * self.chunkRows].cast(typeCode) \
+                        for (_, typeCode), offset in zip(self.COLUMNS, self.getColumnOffsets(self.chunkRows))]
+        self.count = 0
+        self.firstTime = 0.0
+        self.lastTime = 0.0
+        self.writeHeader()
+
+    def closeChunk(self):
+        self.writeHeader()
+        for column in self.columns:
+            column.release()
+        self.columns = list()
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+        self.map = None
+
+    def writeHeader(self):
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, self.chunkRows, self.count, self.firstTime, self.lastTime)
+
+    def append(self, samples: list):
+        # The samples are TelemetryWriter sample tuples, this is called from the writer thread
+        times, upstreamVoltage, downstreamVoltage, upstreamPressure, downstreamPressure, tankPressure, actualTankPressure, rig, relays = self.columns
+        for sample in samples:
+            if self.count == self.chunkRows:
+                self.closeChunk()
+                self.openChunk()
+                times, upstreamVoltage, downstreamVoltage, upstreamPressure, downstreamPressure, tankPressure, actualTankPressure, rig, relays = self.columns
+            n = self.count
+            times[n] = sample[0]
+            upstreamVoltage[n] = sample[1]
+            downstreamVoltage[n] = sample[2]
+            upstreamPressure[n] = sample[3]
+            downstreamPressure[n] = sample[4]
+            tankPressure[n] = sample[5]
+            actualTankPressure[n] = sample[6]
+            relays[n] = (1 if sample[7] else 0) | (2 if sample[8] else 0) | (4 if sample[9] else 0)
+            rig[n] = sample[10] or 0
+            if n == 0:
+                self.firstTime = sample[0]
+            self.lastTime = sample[0]
+            self.count = n + 1
+        self.written += len(samples)
+        self.writeHeader()
+
+    def close(self):
+        if self.map is not None:
+            self.closeChunk()
+
+
+class BlockFilter:
+    '''
+    Collects the raw voltages of one transducer into a fixed size NumPy
+    block. When the block is full the whole block is calibrated and filtered
+    at once and one filtered pressure is returned, so the control logic only
+    sees one value per block. The filter is either the average or the median
+    of the block, or a first order IIR filter whose state carries over from
+    block to block. The IIR is applied to a whole block with one dot product
+    of precomputed weights.
+    '''
+    METHODS = ('average', 'median', 'iir')
+
+    def __init__(self, size: int, method: str, alpha: float, slope: float, offset: float):
+        self.size = size
+        self.method = method
+        self.calibration = (slope, offset)  # Replaced whole when a new ConfigProfile is swapped in, so a block never mixes two calibrations
+        self.block = np.zeros(size)
+        self.count = 0
+        # y[n] = y[n-1] + alpha * (x[n] - y[n-1]) applied to a whole block is decay * y + weights . x
+        self.weights = alpha * (1.0 - alpha) ** np.arange(size - 1, -1, -1)
+        self.decay = (1.0 - alpha) ** size
+        self.state = None
+
+    def add(self, voltage: float) -> bool:
+        # This returns true when the block is full and filter should be called
+        self.block[self.count] = voltage
+        self.count += 1
+        return self.count == self.size
+
+    def filter(self) -> tuple:
+        # This returns the filtered (voltage, pressure) of the block and starts a new one
+        slope, offset = self.calibration
+        pressures = slope * self.block + offset
+        if self.method == 'median':
+            pressure = float(np.median(pressures))
+        elif self.method == 'iir':
+            if self.state is None:
+                self.state = float(pressures[0])
+            self.state = self.decay * self.state + float(self.weights @ pressures)
+            pressure = self.state
+        else:
+            pressure = float(pressures.mean())
+        self.count = 0
+        return (pressure - offset) / slope, pressure
+
+
+class RigMetrics:
+    '''
+    Counters and a callback latency histogram for one rig. The rig updates
+    them in place with a few additions per event, everything else (rates,
+    time since the last sample, duty cycles) is only worked out when a
+    snapshot is asked for. Times come from clock.monotonic() except the
+    callback latency, which is measured with time.perf_counter().
+    '''
+    def __init__(self, latencyBuckets: tuple, bandWidth: float):
+        self.startTime = clock.monotonic()
+        self.latencyBuckets = latencyBuckets  # Upper bound of each latency bucket [sec]
+        self.latencyCounts = [0] * (len(latencyBuckets) + 1)  # The last count is for latencies above every bucket
+        self.latencySum = 0.0
+        self.bandWidth = bandWidth  # The tank pressure is in band when it is within this many PSI of the set pressure
+        self.events = dict()  # Maps each transducer name to the number of voltage change events it has sent
+        self.lastSampleTimes = dict()  # Maps each transducer name to the time of its last voltage change event
+        self.solenoidOpens = {'Inflation': 0, 'Deflation': 0, 'LED': 0}  # Number of times each relay has been turned on
+        self.solenoidOpenTimes = {'Inflation': 0.0, 'Deflation': 0.0, 'LED': 0.0}  # Secounds each relay has been on, not counting the current on time
+        self.solenoidOpenSince = {'Inflation': None, 'Deflation': None, 'LED': None}  # When each relay was turned on, None while it is off
+        self.warningActivations = 0
+        self.inBand = False
+        self.inBandTime = 0.0  # Secounds the tank pressure has spent in band
+        self.lastBandTime = None
+        self.outages = 0  # Number of times control stopped because a channel detached
+        self.outageSeconds = 0.0  # Total secounds from a channel detaching until every channel had reattached
+        self.maxOutageSeconds = 0.0
+        self.recoverySeconds = 0.0  # Secounds from the last reattach until control resumed
+        self.maxRecoverySeconds = 0.0
+        self.fills = 0  # Number of times the tire was filled back up to the set pressure
+        self.fillSeconds = 0.0  # Total secounds from the first inflation of each fill until the inflation that reached the set pressure closed
+        self.fillCycles = 0  # Total number of times the inflation solenoid opened during those fills
+        self.lastFillSeconds = 0.0
+
+    # These are called by the rig ------------------------------------------
+    def countSample(self, name: str, sampleTime: float):
+        self.events[name] = self.events.get(name, 0) + 1
+        self.lastSampleTimes[name] = sampleTime
+
+    def observeLatency(self, seconds: float):
+        self.latencyCounts[bisect.bisect_left(self.latencyBuckets, seconds)] += 1
+        self.latencySum += seconds
+
+    def updateBand(self, tankPressure: float, setPressure: float, now: float):
+        # The time since the last update is counted as in band if the pressure was in band at the last update
+        if self.inBand:
+            self.inBandTime += now - self.lastBandTime
+        self.inBand = abs(tankPressure - setPressure) <= self.bandWidth
+        self.lastBandTime = now
+
+    def recordOutage(self, outage: float, recovery: float):
+        self.outages += 1
+        self.outageSeconds += outage
+        self.maxOutageSeconds = max(self.maxOutageSeconds, outage)
+        self.recoverySeconds = recovery
+        self.maxRecoverySeconds = max(self.maxRecoverySeconds, recovery)
+
+    def recordFill(self, seconds: float, cycles: int):
+        self.fills += 1
+        self.fillSeconds += seconds
+        self.fillCycles += cycles
+        self.lastFillSeconds = seconds
+
+    def setSolenoid(self, name: str, state: bool, now: float):
+        # This is called each time a relay changes state
+        if name not in self.solenoidOpens:
+            return
+        if state:
+            self.solenoidOpens[name] += 1
+            self.solenoidOpenSince[name] = now
+            if name == 'LED':
+                self.warningActivations += 1
+        elif self.solenoidOpenSince[name] is not None:
+            self.solenoidOpenTimes[name] += now - self.solenoidOpenSince[name]
+            self.solenoidOpenSince[name] = None
+
+    # This is called by the MetricsServer ----------------------------------
+    def getSnapshot(self) -> dict:
+        now = clock.monotonic()
+        uptime = now - self.startTime
+        channels = dict()
+        for name, events in list(self.events.items()):
+            channels[name] = {
+                'events': events,
+                'eventRate': events / uptime if uptime > 0.0 else 0.0,
+                'secondsSinceLastSample': now - self.lastSampleTimes.get(name, now),
+            }
+        solenoids = dict()
+        for name, opens in self.solenoidOpens.items():
+            openSince = self.solenoidOpenSince[name]
+            openTime = self.solenoidOpenTimes[name] + (now - openSince if openSince is not None else 0.0)
+            solenoids[name] = {
+                'opens': opens,
+                'open': openSince is not None,
+                'openSeconds': openTime,
+                'dutyCycle': openTime / uptime if uptime > 0.0 else 0.0,
+            }
+        inBandTime = self.inBandTime + (now - self.lastBandTime if self.inBand else 0.0)
+        counts = list(self.latencyCounts)
+        return {
+            'uptimeSeconds': uptime,
+            'channels': channels,
+            'callbackLatency': {
+                'buckets': [[bound, sum(counts[:n + 1])] for n, bound in enumerate(self.latencyBuckets)],
+                'count': sum(counts),
+                'sumSeconds': self.latencySum,
+            },
+            'solenoids': solenoids,
+            'inBandSeconds': inBandTime,
+            'inBandRatio': inBandTime / uptime if uptime > 0.0 else 0.0,
+            'warningActivations': self.warningActivations,
+            'outages': {
+                'count': self.outages,
+                'seconds': self.outageSeconds,
+                'maxSeconds': self.maxOutageSeconds,
+                'recoverySeconds': self.recoverySeconds,
+                'maxRecoverySeconds': self.maxRecoverySeconds,
+            },
+            'fills': {
+                'count': self.fills,
+                'seconds': self.fillSeconds,
+                'cycles': self.fillCycles,
+                'lastSeconds': self.lastFillSeconds,
+            },
+        }
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''Answers /metrics in the Prometheus text format and /metrics.json with the JSON snapshot'''
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = self.server.metrics.formatPrometheus(self.server.metrics.getSnapshot()).encode()
+            contentType = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(self.server.metrics.getSnapshot(), indent=2).encode()
+            contentType = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not written to the console
+        pass
+
+
+class MetricsServer(threading.Thread):
+    '''
+    Serves the RigMetrics of every rig on a local HTTP port and, if a
+    snapshot file is given, writes them to it as JSON every snapshotInterval
+    secounds. The metrics are only read when they are scraped or written, so
+    the rigs do no extra work for either. A port of 0 turns the endpoint off.
+    '''
+    def __init__(self, rigs: list, host: str, port: int, snapshotFile: str, snapshotInterval: float):
+        super().__init__(name='MetricsServer', daemon=True)
+        self.rigs = rigs
+        self.snapshotFile = snapshotFile
+        self.snapshotInterval = snapshotInterval
+        self.stopEvent = threading.Event()
+        self.httpServer = None
+        if port > 0:
+            self.httpServer = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+            self.httpServer.daemon_threads = True
+            self.httpServer.metrics = self
+
+    def getSnapshot(self) -> dict:
+        rigs = list()
+        for rig in self.rigs:
+            snapshot = {'rig': rig.serialNumber, 'state': rig.state, 'tankPressure': rig.tankPressure, 'evaluations': rig.evaluations, 'skippedEvaluations': rig.evaluationGate.skipped}
+            snapshot.update(rig.metrics.getSnapshot())
+            rigs.append(snapshot)
+        return {'time': clock.time(), 'telemetryDropped': telemetry.dropped, 'rigs': rigs}
+
+    def formatPrometheus(self, snapshot: dict) -> str:
+        lines = list()
+        def add(name: str, kind: str, help: str, samples: list):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                labelText = ','.join(f'{key}="{text}"' for key, text in labels)
+                lines.append(f'{name}{{{labelText}}} {value}' if labelText else f'{name} {value}')
+
+        rigs = [(('rig', '' if rig['rig'] is None else rig['rig']),) for rig in snapshot['rigs']]
+        add('ecb_voltage_events_total', 'counter', 'Voltage change events received from each transducer',
+            [(labels + (('channel', name),), channel['events']) for labels, rig in zip(rigs, snapshot['rigs']) for name, channel in rig['channels'].items()])
+        add('ecb_seconds_since_last_sample', 'gauge', 'Secounds since the last voltage change event of each transducer',
+            [(labels + (('channel', name),), channel['secondsSinceLastSample']) for labels, rig in zip(rigs, snapshot['rigs']) for name, channel in rig['channels'].items()])
+        lines.append('# HELP ecb_callback_latency_seconds Time spent in the voltage change handler')
+        lines.append('# TYPE ecb_callback_latency_seconds histogram')
+        for labels, rig in zip(rigs, snapshot['rigs']):
+            latency = rig['callbackLatency']
+            rigLabel = f'rig="{labels[0][1]}"'
+            for bound, count in latency['buckets']:
+                lines.append(f'ecb_callback_latency_seconds_bucket{{{rigLabel},le="{bound}"}} {count}')
+            lines.append(f'ecb_callback_latency_seconds_bucket{{{rigLabel},le="+Inf"}} {latency["count"]}')
+            lines.append(f'ecb_callback_latency_seconds_sum{{{rigLabel}}} {latency["sumSeconds"]}')
+            lines.append(f'ecb_callback_latency_seconds_count{{{rigLabel}}} {latency["count"]}')
+        add('ecb_solenoid_opens_total', 'counter', 'Number of times each relay has been turned on',
+            [(labels + (('solenoid', name),), solenoid['opens']) for labels, rig in zip(rigs, snapshot['rigs']) for name, solenoid in rig['solenoids'].items()])
+        add('ecb_solenoid_open_seconds_total', 'counter', 'Secounds each relay has been on',
+            [(labels + (('solenoid', name),), solenoid['openSeconds']) for labels, rig in zip(rigs, snapshot['rigs']) for name, solenoid in rig['solenoids'].items()])
+        add('ecb_solenoid_duty_cycle', 'gauge', 'Fraction of the run time each relay has been on',
+            [(labels + (('solenoid', name),), solenoid['dutyCycle']) for labels, rig in zip(rigs, snapshot['rigs']) for name, solenoid in rig['solenoids'].items()])
+        add('ecb_in_band_seconds_total', 'counter', 'Secounds the tank pressure has been within the band around the set pressure',
+            [(labels, rig['inBandSeconds']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_warning_activations_total', 'counter', 'Number of times the warning light has been turned on',
+            [(labels, rig['warningActivations']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_control_evaluations_total', 'counter', 'Number of times the decision functions have run',
+            [(labels, rig['evaluations']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_control_evaluations_skipped_total', 'counter', 'Number of times the decision functions were skipped because no decision could change',
+            [(labels, rig['skippedEvaluations']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_controlling', 'gauge', 'One while the rig is controlling, zero while it is starting or waiting for a detached channel',
+            [(labels, int(rig['state'] == 'running')) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_outages_total', 'counter', 'Number of times control stopped because a channel detached',
+            [(labels, rig['outages']['count']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_outage_seconds_total', 'counter', 'Secounds from a channel detaching until every channel had reattached',
+            [(labels, rig['outages']['seconds']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_recovery_latency_seconds', 'gauge', 'Secounds from the last reattach until control resumed',
+            [(labels, rig['outages']['recoverySeconds']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_fills_total', 'counter', 'Number of times the tire was filled back up to the set pressure',
+            [(labels, rig['fills']['count']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_fill_seconds_total', 'counter', 'Secounds from the first inflation of each fill until the set pressure was reached',
+            [(labels, rig['fills']['seconds']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_fill_cycles_total', 'counter', 'Number of times the inflation solenoid opened during the fills',
+            [(labels, rig['fills']['cycles']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_tank_pressure_psi', 'gauge', 'Estimated tank pressure',
+            [(labels, rig['tankPressure']) for labels, rig in zip(rigs, snapshot['rigs'])])
+        add('ecb_telemetry_dropped_total', 'counter', 'Telemetry samples and messages dropped because the queue was full',
+            [((), snapshot['telemetryDropped'])])
+        return '\n'.join(lines) + '\n'
+
+    def writeSnapshot(self):
+        # The snapshot is written to a temporary file first so a reader never sees half of it
+        temporaryFile = self.snapshotFile + '.tmp'
+        with open(temporaryFile, 'w') as file:
+            json.dump(self.getSnapshot(), file, indent=2)
+        os.replace(temporaryFile, self.snapshotFile)
+
+    def run(self):
+        if self.httpServer is not None:
+            threading.Thread(target=self.httpServer.serve_forever, name='MetricsHTTP', daemon=True).start()
+        if self.snapshotFile is not None:
+            while not self.stopEvent.wait(self.snapshotInterval):
+                self.writeSnapshot()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
+        if self.httpServer is not None:
+            self.httpServer.shutdown()
+            self.httpServer.server_close()
+        if self.snapshotFile is not None:
+            self.writeSnapshot()
+
+
+class TankEstimator:
+    '''
+    Fits the coefficients of the tank pressure correction equation
+    P_t = c1*P_d + c2*P_u + c3 online with recursive least squares. It
+    starts from the fixed CORRECTION_CONST values and learns from pairs of
+    the transducer pressures during a fill and the tank pressure they should
+    have given, either the settled downstream pressure after the inflation
+    solenoid closes or the Actual Tank pressure when viTank is connected.
+    Older pairs are forgotten at the given rate so the fit follows changes
+    in the supply and the tire. The pressures are scaled by SCALE so the
+    covariance is not dominated by the constant term, the covariance stops
+    growing once its trace reaches maxCovariance so it can not wind up
+    while the fills all look alike, and a pair whose error is more than
+    maxResidual [PSI] is not learned from since it is most likely a glitch.
+    '''
+    SCALE = 100.0
+
+    def __init__(self, coefficients: tuple, initialCovariance: float, maxCovariance: float, maxResidual: float):
+        self.theta = [coefficients[0] * self.SCALE, coefficients[1] * self.SCALE, coefficients[2]]
+        self.covariance = [[initialCovariance if row == column else 0.0 for column in range(3)] for row in range(3)]
+        self.maxCovariance = maxCovariance
+        self.maxResidual = maxResidual
+        self.updates = 0  # Number of pairs learned from
+        self.rejected = 0  # Number of pairs ignored for being more than maxResidual off
+        self.lastResidual = 0.0
+
+    def getCoefficients(self) -> tuple:
+        return self.theta[0] / self.SCALE, self.theta[1] / self.SCALE, self.theta[2]
+
+    def estimate(self, downstreamPressure: float, upstreamPressure: float) -> float:
+        # While air is flowing into the tire it can not be above the downstream pressure
+        theta = self.theta
+        value = theta[0] * downstreamPressure / self.SCALE + theta[1] * upstreamPressure / self.SCALE + theta[2]
+        return min(max(value, 0.0), downstreamPressure)
+
+    def update(self, downstreamPressure: float, upstreamPressure: float, tankPressure: float, forgetting: float) -> bool:
+        # This returns false if the pair was rejected
+        x = (downstreamPressure / self.SCALE, upstreamPressure / self.SCALE, 1.0)
+        theta = self.theta
+        residual = tankPressure - (theta[0] * x[0] + theta[1] * x[1] + theta[2] * x[2])
+        self.lastResidual = residual
+        if abs(residual) > self.maxResidual:
+            self.rejected += 1
+            return False
+        P = self.covariance
+        Px = [P[row][0] * x[0] + P[row][1] * x[1] + P[row][2] * x[2] for row in range(3)]
+        denominator = forgetting + x[0] * Px[0] + x[1] * Px[1] + x[2] * Px[2]
+        gain = [value / denominator for value in Px]
+        for row in range(3):
+            theta[row] += gain[row] * residual
+        # Only forget while the covariance is small enough, otherwise it grows without bound between informative pairs
+        scale = 1.0 / forgetting if P[0][0] + P[1][1] + P[2][2] < self.maxCovariance else 1.0
+        for row in range(3):
+            for column in range(3):
+                P[row][column] = (P[row][column] - gain[row] * Px[column]) * scale
+        self.updates += 1
+        return True
+
+
+class EvaluationGate:
+    '''
+    Decides if the decision functions need to run for a sample. They only
+    depend on the pressures, the relay states, their hold off timers and the
+    tank pressure drop rate, so while the pressures stay within deadband
+    [PSI] of the last evaluation, the relays have not changed and no timer
+    deadline has passed, they would give the same result and are skipped.
+    The drop rate can still change while the pressures hold still, since
+    older samples leave its window, so the gate also opens once a window
+    after the pressures last moved and stays open while the rate is near
+    PRESSURE_DROP_RATE.
+    '''
+    def __init__(self, deadband: float, window: float):
+        self.deadband = deadband
+        self.window = window  # The PRESSURE_DROP_WINDOW of the drop rate
+        self.reference = None  # The (upstream, downstream, tank) pressures of the last evaluation
+        self.states = None  # The relay states after the last evaluation
+        self.deadline = 0.0  # The clock.monotonic() when a timer could next change a decision
+        self.moveTime = 0.0  # The clock.monotonic() of the last evaluation where the pressures moved more than deadband
+        self.moved = False
+        self.skipped = 0  # Number of evaluations skipped
+
+    def check(self, upstream: float, downstream: float, tank: float, states: tuple, now: float) -> bool:
+        # This returns true if the decision functions must run
+        reference = self.reference
+        deadband = self.deadband
+        self.moved = reference is None or abs(upstream - reference[0]) > deadband or abs(downstream - reference[1]) > deadband or abs(tank - reference[2]) > deadband
+        if self.moved or states != self.states or now >= self.deadline:
+            return True
+        self.skipped += 1
+        return False
+
+    def update(self, upstream: float, downstream: float, tank: float, states: tuple, deadline: float, rateActive: bool, now: float):
+        # This is called after the decision functions have run with the next timer deadline and the relay states they left
+        self.reference = (upstream, downstream, tank)
+        self.states = states
+        if self.moved:
+            self.moveTime = now
+        if rateActive:
+            deadline = now
+        elif self.moveTime + self.window > now:
+            deadline = min(deadline, self.moveTime + self.window)
+        self.deadline = deadline
+
+
+class FlightRecorder:
+    '''
+    Keeps the last size control evaluations of a rig in memory, with the
+    inputs and the condition values of every decision function, so app.log
+    only needs the relay changes. Recording an entry is one tuple appended
+    to a bounded deque, nothing is formatted. The entries are written to
+    fileName only when dump is called, after a fault, a detach, a
+    PhidgetException or when the operator asks. The dump is handed to the
+    telemetry thread so the caller never waits on the disk, and the ring is
+    emptied so the next dump only holds what came after.
+    '''
+    def __init__(self, size: int, fileName: str, logPrefix: str):
+        self.entries = deque(maxlen=size)  # The (clock.time(), message, args) of each entry, the message is only formatted when dumped
+        self.fileName = fileName
+        self.logPrefix = logPrefix
+        self.last = None  # The latest entry, used as the reason for a relay change
+        self.dumps = 0
+
+    def record(self, message: str, *args):
+        self.last = (clock.time(), message, args)
+        self.entries.append(self.last)
+
+    @staticmethod
+    def formatEntry(entry: tuple) -> str:
+        _, message, args = entry
+        return message.format(*args) if args else message
+
+    def dump(self, reason: str, limit: int = None):
+        # Only the last limit entries are written if limit is given, the rest are dropped with them
+        entries = list(self.entries)
+        if limit is not None:
+            entries = entries[-limit:]
+        self.entries.clear()
+        self.dumps += 1
+        telemetry.put((self, reason, clock.time(), entries))
+
+    def write(self, reason: str, dumpTime: float, entries: list):
+        # This runs on the telemetry thread
+        with open(self.fileName, 'a') as file:
+            file.write(f'--- {self.logPrefix}Flight recorder dump at {datetime.fromtimestamp(dumpTime)} because {reason}, {len(entries)} entries ---\n')
+            for entry in entries:
+                file.write(f'{datetime.fromtimestamp(entry[0]).isoformat(sep=" ", timespec="milliseconds")} {self.logPrefix}{self.formatEntry(entry)}\n')
+        message = f'{self.logPrefix}Flight recorder: {len(entries)} entries written to {self.fileName} because {reason}'
+        showMessage(message)
+        logging.warning(message)
+
+
+class SensorSnapshot:
+    '''
+    The latest (time, voltage, pressure) of each transducer. Each voltage
+    change handler replaces its own tuple in a single assignment, so the
+    control loop always reads a voltage and pressure that belong together
+    without needing a lock.
+    '''
+    def __init__(self):
+        self.upstream = (0.0, 0.0, 0.0)
+        self.downstream = (0.0, 0.0, 0.0)
+
+
+class ControlLoop(threading.Thread):
+    '''
+    Runs the control logic at a fixed period on its own thread instead of on
+    every sensor event. The jitter (how late each cycle started) and the
+    number of overruns (cycles that were skipped because the previous one ran
+    late) are kept so the timing of the loop can be checked. Missed cycles are
+    skipped rather than run back to back.
+    '''
+    def __init__(self, period: float, control):
+        super().__init__(name='ControlLoop', daemon=True)
+        self.period = period
+        self.control = control  # The function called every cycle
+        self.stopEvent = threading.Event()
+        self.cycles = 0
+        self.overruns = 0
+        self.totalJitter = 0.0
+        self.maxJitter = 0.0
+        self.maxRunTime = 0.0
+
+    def run(self):
+        nextTime = time.monotonic()
+        while not self.stopEvent.is_set():
+            delay = nextTime - time.monotonic()
+            if delay > 0.0 and self.stopEvent.wait(delay):
+                break
+            start = time.monotonic()
+            try:
+                self.control()
+            except Exception:
+                # Keep controlling even if one cycle fails
+                traceback.print_exc()
+                logging.exception('Control loop cycle failed')
+            end = time.monotonic()
+            # Record the timing of this cycle
+            jitter = start - nextTime
+            self.cycles += 1
+            self.totalJitter += jitter
+            self.maxJitter = max(self.maxJitter, jitter)
+            self.maxRunTime = max(self.maxRunTime, end - start)
+            nextTime += self.period
+            if end > nextTime:
+                missed = int((end - nextTime) / self.period) + 1
+                self.overruns += missed
+                nextTime += missed * self.period
+
+    def getStats(self) -> str:
+        meanJitter = self.totalJitter / self.cycles if self.cycles else 0.0
+        return f'Control loop: period = {self.period * 1000.0:.1f}ms, cycles = {self.cycles}, overruns = {self.overruns}, mean jitter = {meanJitter * 1000.0:.3f}ms, max jitter = {self.maxJitter * 1000.0:.3f}ms, max run time = {self.maxRunTime * 1000.0:.3f}ms'
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
+
+
+class Dashboard(threading.Thread):
+    '''
+    Redraws a live view of every rig in the terminal refreshInterval secounds
+    apart, no matter how fast the samples come in, with plain ANSI escape
+    codes. Each redraw reads a snapshot of the rig attributes and the last
+    known relay states, so it never waits on the rigs or reads a device.
+    While it runs the console prints of the control path and the telemetry
+    thread are sent to showMessage, which only appends them to a bounded
+    deque that is drawn under the rigs, so the console never adds to the
+    control latency. The view is drawn on the alternate screen and the
+    normal screen is put back by stop.
+    '''
+    ENTER = '\x1b[?1049h\x1b[?25l'  # Switch to the alternate screen and hide the cursor
+    LEAVE = '\x1b[?25h\x1b[?1049l'  # Show the cursor and switch back to the normal screen
+    HOME = '\x1b[H'
+    CLEAR_LINE = '\x1b[K'
+    CLEAR_BELOW = '\x1b[J'
+    BOLD = '\x1b[1m'
+    RED = '\x1b[1;31m'
+    GREEN = '\x1b[32m'
+    RESET = '\x1b[0m'
+
+    def __init__(self, rigs: list, refreshInterval: float, messageCount: int, prompt: str):
+        super().__init__(name='Dashboard', daemon=True)
+        self.rigs = rigs
+        self.refreshInterval = refreshInterval
+        self.messages = deque(maxlen=messageCount)  # The latest messages, appending to a deque is safe from any thread
+        self.prompt = prompt  # Shown at the bottom, since input is called without a prompt while the dashboard is drawn
+        self.stopEvent = threading.Event()
+        self.startTime = time.monotonic()
+        self.redraws = 0
+
+    def addMessage(self, message: str):
+        self.messages.append(f'{datetime.fromtimestamp(clock.time()):%H:%M:%S} {message}')
+
+    def formatRelay(self, name: str, state: bool, onText: str, offText: str) -> str:
+        if state:
+            return f'{name} {self.GREEN}{onText}{self.RESET}'
+        return f'{name} {offText}'
+
+    def formatRig(self, rig) -> list:
+        inflation, deflation, light = (outputManager.peekState(do) for do in rig.digitalOutputs[:3]) if len(rig.digitalOutputs) >= 3 else (False, False, False)
+        trend = rig.tankPressureLastThreeSecounds.getRate() * 60.0
+        arrow = '^' if trend > 0.05 else 'v' if trend < -0.05 else '-'
+        lines = [f'{self.BOLD}{rig.name:<12}{self.RESET} {rig.state:<9} tank {rig.tankPressure:7.2f}PSI {arrow} {trend:+6.2f}PSI/min   ' + \
+                 f'upstream {rig.upstreamPressure:7.2f}PSI   downstream {rig.downstreamPressure:7.2f}PSI' + \
+                 (f'   actual tank {rig.actualTankPressure:7.2f}PSI' if writeVoltageToOutputs else '')]
+        lines.append('  ' + '   '.join((self.formatRelay('Inflation', inflation, 'OPEN', 'closed'), self.formatRelay('Deflation', deflation, 'OPEN', 'closed'), self.formatRelay('Light', light, 'ON', 'off'))) + \
+                     f'   evaluations {rig.evaluations}, skipped {rig.evaluationGate.skipped}, inflations {rig.inflations}')
+        holdOffs = ', '.join(f'{name} {remaining:.0f}s' for name, remaining in rig.getHoldOffs(inflation, deflation, light))
+        lines.append(f'  Hold off: {holdOffs if holdOffs else "none"}   set pressure {rig.profile.setPressure:g}PSI from {rig.profile.name}')
+        alarms = list()
+        if light:
+            alarms.append('WARNING LIGHT ON')
+        if rig.state in ('detached', 'resuming'):
+            alarms.append(f'{rig.state.upper()} for {clock.monotonic() - rig.detachTime:.0f}s, missing {", ".join(sorted(set(rig.getChannelAddresses()) - rig.attachedChannels)) or "nothing"}')
+        if rig.error is not None:
+            alarms.append(f'FAILED: {rig.error}')
+        if alarms:
+            lines.append(f'  {self.RED}Alarm: {"; ".join(alarms)}{self.RESET}')
+        return lines
+
+    def render(self) -> str:
+        lines = [f'{self.BOLD}ECB road test{self.RESET}   {datetime.fromtimestamp(clock.time()):%Y-%m-%d %H:%M:%S}   up {timedelta(seconds=int(time.monotonic() - self.startTime))}   ' + \
+                 f'telemetry backlog {telemetry.getBacklog()}, dropped {telemetry.dropped}', '']
+        for rig in self.rigs:
+            lines.extend(self.formatRig(rig))
+            lines.append('')
+        lines.append(f'{self.BOLD}Messages{self.RESET}')
+        lines.extend(list(self.messages))
+        lines.append('')
+        lines.append(self.prompt)
+        return self.HOME + ''.join(line + self.CLEAR_LINE + '\n' for line in lines) + self.CLEAR_BELOW
+
+    def run(self):
+        sys.stdout.write(self.ENTER)
+        while not self.stopEvent.wait(self.refreshInterval):
+            # The whole frame is written at once so it does not flicker
+            sys.stdout.write(self.render())
+            sys.stdout.flush()
+            self.redraws += 1
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
+        sys.stdout.write(self.LEAVE)
+        sys.stdout.flush()
+
+
+class ConfigWatcher(threading.Thread):
+    '''
+    Checks the --config file every pollInterval secounds and once it has
+    changed reads a new ConfigProfile for every rig. Only if the profiles of
+    all the rigs are valid are they handed over, each rig swaps its new
+    profile in at its next evaluation. A file that can not be read or is not
+    valid is reported and every rig keeps the profile it has, so a half saved
+    or mistyped file never reaches the control logic.
+    '''
+    def __init__(self, fileName: str, rigs: list, pollInterval: float):
+        super().__init__(name='ConfigWatcher', daemon=True)
+        self.fileName = fileName
+        self.rigs = rigs
+        self.pollInterval = pollInterval
+        self.stopEvent = threading.Event()
+        self.lastModified = self.getModified()
+        self.reloads = 0  # Number of times new profiles were handed to the rigs
+        self.failures = 0  # Number of times the file changed but could not be used
+
+    def getModified(self) -> tuple:
+        # This returns None if the file can not be found, it may be part way through being replaced
+        try:
+            stat = os.stat(self.fileName)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self) -> bool:
+        # This returns true if every rig was given a new profile
+        try:
+            profiles = [(rig, readConfigProfile(self.fileName, rig.serialNumber)) for rig in self.rigs]
+        except (OSError, ValueError) as ex:
+            self.failures += 1
+            message = f'The config in {self.fileName} was not loaded, the rigs keep their profiles: {ex}'
+            showMessage(message)
+            logging.error(message)
+            return False
+        except Exception as ex:
+            # Anything else is a bug in reading the file, it must not stop the watcher or the operator prompt
+            self.failures += 1
+            message = f'The config in {self.fileName} was not loaded, the rigs keep their profiles: {type(ex).__name__}: {ex}'
+            showMessage(message)
+            logging.exception(message)
+            return False
+        for rig, profile in profiles:
+            rig.pendingProfile = profile
+        self.reloads += 1
+        return True
+
+    def run(self):
+        while not self.stopEvent.wait(self.pollInterval):
+            modified = self.getModified()
+            if modified is not None and modified != self.lastModified:
+                self.lastModified = modified
+                self.reload()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
+# endregion Classes ----------------------------------------------------------
+
+# region Simulation ----------------------------------------------------------
+class PneumaticModel:
+    '''
+    A simple model of the air supply, the line from the solenoids to the tire
+    and the tire itself, all as gauge pressure in [PSI]. Flow through an open
+    solenoid goes with the square root of the pressure across it. The tire
+    slowly leaks, the supply regulator droops while air is flowing and the
+    downstream line sits between the supply and the tire while inflating,
+    which is why the tank pressure has to be estimated during a fill.
+    '''
+    def __init__(self, supplyPressure: float, tirePressure: float, inflationFlow: float, deflationFlow: float, leakRate: float, lineDrop: float, supplyDroop: float):
+        self.supplyPressure = supplyPressure  # Regulated supply pressure with no flow
+        self.inflationFlow = inflationFlow  # [PSI/sec] per square root PSI across the inflation solenoid
+        self.deflationFlow = deflationFlow  # [PSI/sec] per square root PSI across the deflation solenoid
+        self.leakRate = leakRate  # Fraction of the tire pressure lost per hour
+        self.lineDrop = lineDrop  # Fraction of the supply to tire difference seen by the downstream transducer while flowing
+        self.supplyDroop = supplyDroop  # Drop in supply pressure per [PSI/sec] of flow
+        self.upstream = supplyPressure
+        self.tire = tirePressure
+        self.downstream = tirePressure
+
+    def step(self, dt: float, inflation: bool, deflation: bool):
+        inflow = 0.0
+        outflow = 0.0
+        if inflation:
+            inflow = self.inflationFlow * math.sqrt(max(self.upstream - self.tire, 0.0))
+        if deflation:
+            outflow = self.deflationFlow * math.sqrt(max(self.tire, 0.0))
+        leak = self.leakRate * self.tire / 3600.0
+        self.tire = max(self.tire + (inflow - outflow - leak) * dt, 0.0)
+        self.upstream = self.supplyPressure - self.supplyDroop * inflow
+        if inflation:
+            self.downstream = self.tire + self.lineDrop * (self.upstream - self.tire)
+        elif deflation:
+            self.downstream = self.tire * (1.0 - self.lineDrop)
+        else:
+            self.downstream = self.tire
+
+
+class SimulatedPhidget:
+    '''
+    Stand-in for a Phidget22 channel. It supports the addressing, open/close
+    and attach/detach calls used by this program and attaches as soon as it
+    is opened.
+    '''
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.serialNumber = None  # The model of the rig with this hub serial number is used
+        self.hubPort = 0
+        self.channel = 0
+        self.attached = False
+        self.attachHandler = None
+        self.detachHandler = None
+
+    def setHubPort(self, hubPort: int):
+        self.hubPort = hubPort
+
+    def getHubPort(self) -> int:
+        return self.hubPort
+
+    def setChannel(self, channel: int):
+        self.channel = channel
+
+    def getChannel(self) -> int:
+        return self.channel
+
+    def setIsHubPortDevice(self, isHubPortDevice: bool):
+        pass
+
+    def setDeviceSerialNumber(self, serialNumber: int):
+        self.serialNumber = serialNumber
+
+    def setOnAttachHandler(self, handler):
+        self.attachHandler = handler
+
+    def setOnDetachHandler(self, handler):
+        self.detachHandler = handler
+
+    def getAttached(self) -> bool:
+        return self.attached
+
+    def open(self):
+        self.attached = True
+        if self.attachHandler is not None:
+            self.attachHandler(self)
+
+    def openWaitForAttachment(self, timeout: int):
+        self.open()
+
+    def close(self):
+        if self.attached:
+            self.attached = False
+            if self.detachHandler is not None:
+                self.detachHandler(self)
+
+    def reset(self):
+        # A real channel loses its settings when it detaches
+        pass
+
+
+class SimulatedVoltageInput(SimulatedPhidget):
+    '''Stand-in for a VoltageInput that reads a pressure from the PneumaticModel'''
+    def __init__(self, simulator):
+        super().__init__(simulator)
+        self.dataInterval = 250
+        self.nextEventTime = 0.0
+        self.voltageChangeHandler = None
+
+    def setOnVoltageChangeHandler(self, handler):
+        self.voltageChangeHandler = handler
+
+    def setDataInterval(self, dataInterval: int):
+        self.dataInterval = dataInterval
+
+    def getDataInterval(self) -> int:
+        return self.dataInterval
+
+    def getMinDataInterval(self) -> int:
+        return SIM_MIN_DATA_INTERVAL
+
+    def getVoltage(self) -> float:
+        return self.simulator.getVoltage(self.serialNumber, self.hubPort)
+
+    def reset(self):
+        self.dataInterval = 250
+        self.nextEventTime = self.simulator.clock.monotonic()
+
+
+class SimulatedDigitalOutput(SimulatedPhidget):
+    '''Stand-in for a DigitalOutput, the model reads the state of the solenoids from it'''
+    def __init__(self, simulator):
+        super().__init__(simulator)
+        self.dutyCycle = 0.0
+
+    def getState(self) -> bool:
+        return self.dutyCycle > 0.0
+
+    def setState(self, state: bool):
+        self.dutyCycle = 1.0 if state else 0.0
+
+    def getDutyCycle(self) -> float:
+        return self.dutyCycle
+
+    def setDutyCycle(self, dutyCycle: float):
+        self.dutyCycle = dutyCycle
+
+    def reset(self):
+        self.dutyCycle = 0.0
+
+
+class Simulator:
+    '''
+    Creates the stand-in channels and runs them against a PneumaticModel on a
+    VirtualClock. Each step moves the clock and the model forward, then fires
+    the voltage change handler of every input whose data interval has passed.
+    The transducers are addressed the same way as the real rig: the upstream
+    and downstream transducers on ports 0 and 1, the actual tank pressure on
+    port 5 and the solenoids on channels 1 and 2 of the relay on port 2. Each
+    rig gets its own model, found by the hub serial number its channels are
+    addressed to, so several rigs can be simulated on the same clock. If a
+    glitchInterval is given a random channel is detached for glitchDuration
+    secounds about that often, like a USB or VINT glitch.
+    '''
+    def __init__(self, clock: VirtualClock, step: float, noise: float, seed: int = None, glitchInterval: float = 0.0, glitchDuration: float = 0.0):
+        self.models = dict()  # Maps the hub serial number of each rig to its PneumaticModel
+        self.clock = clock
+        self.step = step
+        self.noise = noise  # Standard deviation of the transducer noise in [V]
+        self.random = random.Random(seed)
+        self.inputs = list()
+        self.outputs = list()
+        self.glitchInterval = glitchInterval  # Mean secounds of simulated time between glitches, zero for none
+        self.glitchDuration = glitchDuration
+        self.glitches = list()  # The [reattachTime, channel] of every channel that is detached by a glitch
+        self.nextGlitchTime = None
+
+    def createVoltageInput(self) -> SimulatedVoltageInput:
+        voltageInput = SimulatedVoltageInput(self)
+        self.inputs.append(voltageInput)
+        return voltageInput
+
+    def createDigitalOutput(self) -> SimulatedDigitalOutput:
+        digitalOutput = SimulatedDigitalOutput(self)
+        self.outputs.append(digitalOutput)
+        return digitalOutput
+
+    def getModel(self, serialNumber: int) -> PneumaticModel:
+        # The model of a rig is created the first time one of its transducers is read
+        model = self.models.get(serialNumber)
+        if model is None:
+            model = PneumaticModel(SIM_SUPPLY_PRESSURE, SIM_START_PRESSURE, SIM_INFLATION_FLOW, SIM_DEFLATION_FLOW, SIM_LEAK_RATE, SIM_LINE_DROP, SIM_SUPPLY_DROOP)
+            self.models[serialNumber] = model
+        return model
+
+    def getVoltage(self, serialNumber: int, hubPort: int) -> float:
+        # Turn the modeled pressure back into a transducer voltage and add noise
+        model = self.getModel(serialNumber)
+        if hubPort == 0:
+            voltage = (model.upstream - OFFSET_UPSTREAM) / SLOPE_UPSTREAM
+        elif hubPort == 1:
+            voltage = (model.downstream - OFFSET_DOWNSTREAM) / SLOPE_DOWNSTREAM
+        else:
+            voltage = (model.tire - OFFSET_TANK) / SLOPE_TANK
+        return voltage + self.random.gauss(0.0, self.noise)
+
+    def getSolenoidState(self, serialNumber: int, channel: int) -> bool:
+        for output in self.outputs:
+            if output.attached and output.serialNumber == serialNumber and output.hubPort == 2 and output.channel == channel:
+                return output.getState()
+        return False
+
+    def runGlitches(self, now: float):
+        # This detaches a random attached channel when the next glitch is due and reattaches the channels whose glitch is over
+        if self.nextGlitchTime is None:
+            self.nextGlitchTime = now + self.random.expovariate(1.0 / self.glitchInterval)
+        if now >= self.nextGlitchTime:
+            self.nextGlitchTime = now + self.random.expovariate(1.0 / self.glitchInterval)
+            channels = [phidget for phidget in self.inputs + self.outputs if phidget.attached]
+            if channels:
+                phidget = self.random.choice(channels)
+                phidget.close()
+                phidget.reset()
+                self.glitches.append([now + self.glitchDuration, phidget])
+        for glitch in [glitch for glitch in self.glitches if now >= glitch[0]]:
+            self.glitches.remove(glitch)
+            glitch[1].reset()
+            glitch[1].open()
+
+    def stepModels(self, dt: float):
+        # Move the model of every rig forward using the states of its own solenoids
+        for serialNumber, model in self.models.items():
+            model.step(dt, self.getSolenoidState(serialNumber, 1), self.getSolenoidState(serialNumber, 2))
+
+    def run(self, duration: float, controlPeriod: float = 0.0, control = None, latencies: list = None):
+        # This runs the simulation for duration secounds of simulated time
+        # If a latencies list is given the time taken by each voltage change handler is added to it
+        end = self.clock.monotonic() + duration
+        nextControlTime = self.clock.monotonic()
+        for voltageInput in self.inputs:
+            voltageInput.nextEventTime = self.clock.monotonic()
+        while self.clock.monotonic() < end:
+            self.clock.advance(self.step)
+            now = self.clock.monotonic()
+            self.stepModels(self.step)
+            if self.glitchInterval > 0.0:
+                self.runGlitches(now)
+            for voltageInput in self.inputs:
+                # Inputs with a data interval shorter than the step fire more than once per step
+                while voltageInput.attached and now >= voltageInput.nextEventTime:
+                    voltageInput.nextEventTime += voltageInput.dataInterval / 1000.0
+                    if voltageInput.voltageChangeHandler is None:
+                        continue
+                    voltage = voltageInput.getVoltage()
+                    if latencies is None:
+                        voltageInput.voltageChangeHandler(voltageInput, voltage)
+                    else:
+                        eventStart = time.perf_counter()
+                        voltageInput.voltageChangeHandler(voltageInput, voltage)
+                        latencies.append(time.perf_counter() - eventStart)
+            if control is not None and controlPeriod > 0.0 and now >= nextControlTime:
+                nextControlTime += controlPeriod
+                control()
+# endregion Simulation -------------------------------------------------------
+
 # region Global Variables ----------------------------------------------------
-# Input variables
-upstreamVoltage = 0.0  # V_u This will be current voltage of upstream pressure transducer
-downstreamVoltage = 0.0  # V_d This will be current voltage of downstream pressure transducer
-inflationStateTime = datetime.now()  # This variable holds the time when the inflation solenoid was last closed or opened
-deflationStateTime = datetime.now()
-warningLightTime = datetime.now()
-
-# Calculated variables
-upstreamPressure = 0.0  # P_u This will be the calculated upstream pressure in [PSI]
-downstreamPressure = 0.0  # P_d This will be the calculated downstream pressure in [PSI]
-tankPressure = 0.0  # P_t This will be the calculated tank pressure in [PSI]
-tankPressureLastThreeSecounds = list()  # This list of tupels contains the time and values of the last thee secounds of tankPressure
-
-# outputs
-digitalOutputs = list()
+clock = Clock()  # All times used by the control logic come from here, the simulator replaces it with a VirtualClock
+nativeCalls = NativeCallCounter()  # Counts the calls made into the Phidget library
 
 # Constants
 SET_PRESSURE = 103.0  # C_1 This is the desired tire pressure
-SLOPE_UPSTREAM = 37.818  # C_2 This is the calibration slope for the upstream pressure transducer 
+SLOPE_UPSTREAM = 37.818  # C_2 This is the calibration slope for the upstream pressure transducer
 OFFSET_UPSTREAM = -17.695  # C_3 This is the calibration offset for the upstream pressure transducer
 SLOPE_DOWNSTREAM = 37.794  # C_4 This is the calibration slope for the downstream pressure transducer
 OFFSET_DOWNSTREAM = -17.684  # C_5 This is the calibration offset for the downstream pressure transducer
@@ -38,160 +1679,1121 @@ DEF_OPEN_PRESSURE = SET_PRESSURE + 8  # C_6 This should be a min of C_1+4 and a
 DEF_CLOSE_PRESSURE = SET_PRESSURE + 5  # C_7 This should be a min of C_1+1 and a max of C_6-1
 SLOPE_TANK = 37.8
 OFFSET_TANK = -17.69
+PRESSURE_DROP_WINDOW = 3.0  # The number of secounds of tankPressure history that the drop rate is evaluated over
+PRESSURE_DROP_RATE = -0.5  # The warning light is turned on if tankPressure changes at this rate [PSI/sec] or faster (1.5psi / 3sec)
+PRESSURE_HISTORY_SIZE = 8192  # Max number of samples held in the history, this is enough for both transducers at a 1ms data interval
+
+'''
+Since tire pressure is not measured directly, it must be estimated. The tire
+pressure during fill is estimated by the equation:
+P_t = CORRECTION_CONST1*P_d + CORRECTION_CONST2*P_u + CORRECTION_CONST3
+Preliminary testing was done to determine constants for this correction
+equation that work well of a verity of circumstances.
+'''
+CORRECTION_CONST1 = 1
+CORRECTION_CONST2 = 0.0
+CORRECTION_CONST3 = 0.0
+
+'''
+With --estimator rls the correction constants above are only the starting
+point, a TankEstimator fits them while the program runs. It learns from the
+settled downstream pressure ESTIMATOR_SETTLE secounds after each fill closes,
+which must be less than the 3 secound lockout in shouldInflate, and from the
+Actual Tank pressure on every fill sample when the debug channels are used.
+'''
+ESTIMATOR_SETTLE = 2.5  # Secounds after the inflation solenoid closes before the downstream pressure is taken as the tank pressure
+ESTIMATOR_SETTLED_FORGETTING = 0.9  # Forgetting factor for each settled reading, there is only one of these per fill
+ESTIMATOR_TANK_FORGETTING = 0.9999  # Forgetting factor for each Actual Tank sample, there are many of these per fill
+ESTIMATOR_INITIAL_COVARIANCE = 1000.0  # How far the starting constants are trusted, larger learns faster at first
+ESTIMATOR_MAX_COVARIANCE = 3000.0  # The covariance of the fit stops growing once its trace reaches this, so the fit is never less certain than at the start
+ESTIMATOR_MAX_RESIDUAL = 15.0  # A reading this many PSI away from the estimate is not learned from
+CONFIG_MAX_PRESSURE = 125.0  # No pressure in a config profile can be above this [PSI], it is the most the supply and solenoids are rated for
+CONFIG_POLL_INTERVAL = 1.0  # The --config file is checked for changes every this many secounds
+BLINK_COUNT = 10  # Number of times the warning light flashes when a rig starts
+BLINK_ON_TIME = 0.05  # Secounds the warning light is on for each flash
+BLINK_OFF_TIME = 0.05  # Secounds the warning light is off after each flash
+HOLD_OFF_TIMES = (3.0, 60.0, 600.0)  # The hold off timers [sec]: the lockout between fills, the deflation lockouts and warning light minimum, and the longest fill, the EvaluationGate runs the decisions again when one could expire
+FLIGHT_RECORDER_FILE = 'flight-recorder.log'  # The flight recorder of every rig is dumped to this file
+FLIGHT_RECORDER_SIZE = 20000  # Control evaluations kept by the flight recorder of each rig, a little over 20 minutes at the default data interval
+FLIGHT_RECORDER_FAULT_ENTRIES = 2000  # Entries written when the warning light comes on, enough for the pressure drop window that raised it
+FILL_TOLERANCE = 0.5  # A fill has reached the set pressure once the settled tank pressure is within this many PSI of it
+
+DUTY_CYCLE_MIN_CHANGE = 0.0  # The debug outputs are only written when the duty cycle changes by at least this much
+DUTY_CYCLE_MIN_INTERVAL = 0.0  # The debug outputs are written at most once per this many secounds, a value held back is sent once this has passed
+
+TELEMETRY_FILE = 'telemetry.csv'  # Every sample is written to this file by the telemetry thread
+TELEMETRY_MAX_BYTES = 50 * 1024 * 1024  # The telemetry file is rotated once it is this large
+TELEMETRY_BACKUP_COUNT = 20  # Number of rotated telemetry files to keep
+TELEMETRY_QUEUE_SIZE = 10000  # Samples and messages waiting to be written, anything more is dropped
+TELEMETRY_BATCH_SIZE = 500  # Max number of queued items written at once
+TELEMETRY_PRINT_INTERVAL = 1.0  # The latest pressures are printed to the console at most once per this many secounds, unless the dashboard is used
+DASHBOARD_REFRESH_INTERVAL = 0.5  # The dashboard is redrawn every this many secounds when using --dashboard
+DASHBOARD_MESSAGES = 12  # Number of the latest messages shown under the rigs on the dashboard
+
+# Simulation constants, these are only used with --simulate
+SIM_SUPPLY_PRESSURE = 125.0  # Regulated supply pressure [PSI]
+SIM_START_PRESSURE = 90.0  # Tire pressure at the start of the simulation [PSI]
+SIM_INFLATION_FLOW = 0.3  # Fill rate [PSI/sec] per square root PSI across the inflation solenoid
+SIM_DEFLATION_FLOW = 0.15  # Vent rate [PSI/sec] per square root PSI in the tire
+SIM_LEAK_RATE = 0.05  # Fraction of the tire pressure lost per hour
+SIM_LINE_DROP = 0.25  # Fraction of the supply to tire difference seen by the downstream transducer while filling
+SIM_SUPPLY_DROOP = 1.0  # Drop in supply pressure [PSI] per [PSI/sec] of flow
+SIM_NOISE = 0.005  # Standard deviation of the transducer noise [V]
+SIM_STEP = 0.01  # Simulation time step [sec]
+SIM_MIN_DATA_INTERVAL = 1  # Shortest data interval of the simulated transducers [ms]
+SIM_GLITCH_DURATION = 2.0  # Secounds a channel stays detached for each glitch when using --glitch-interval
+
+FILTER_BLOCK_SIZE = 50  # Number of raw samples filtered together when using --filter, one filtered sample is made per block
+FILTER_ALPHA = 0.05  # Smoothing factor of the iir filter, smaller is smoother
+
+REPLAY_MAX_REPORTED = 20  # Number of differences between the recorded and replayed decisions that are listed
+
+ANALYSIS_LOW_PRESSURE = SET_PRESSURE * 0.9  # Time with the tank pressure below this [PSI] is reported by --analyze
+ANALYSIS_LEAK_SETTLE = 10.0  # Secounds after a solenoid closes that are left out of the leak rate, while the pressure settles
+ANALYSIS_LEAK_MIN_DURATION = 60.0  # Secounds the solenoids must stay closed, after settling, for the leak rate to be measured
+ANALYSIS_READ_BLOCK = 64 * 1024 * 1024  # Bytes of a telemetry CSV parsed at once by --analyze
+
+BENCHMARK_DURATION = 1800.0  # Secounds of simulated time used to measure the event latency
+BENCHMARK_ALLOCATION_DURATION = 60.0  # Secounds of simulated time used to measure memory allocations
+BENCHMARK_RATE_DURATION = 1.0  # Real secounds that each event rate is held for
+BENCHMARK_START_RATE = 100  # First event rate tried [events/sec], this is doubled until the control path falls behind
+BENCHMARK_MAX_RATE = 200000  # Highest event rate tried [events/sec]
+BENCHMARK_MAX_LAG = 0.05  # The control path has fallen behind if it finishes more than this many secounds late
+
+METRICS_HOST = '127.0.0.1'  # The metrics endpoint only listens on this address
+METRICS_SNAPSHOT_INTERVAL = 10.0  # The JSON metrics snapshot is written every this many secounds when using --metrics-json
+METRICS_LATENCY_BUCKETS = (10e-6, 25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 100e-3)  # Upper bounds of the callback latency histogram [sec]
+STARTUP_DEADLINE = 2.0  # With --fast-start every channel of a rig must be found and attached within this many secounds
+SAFE_RELAY_STATES = {'Inflation': False, 'Deflation': False, 'LED': True}  # The relays are set to these states while a rig is waiting for a detached channel to come back
+PRESSURE_BAND = 1.0  # The tank pressure is counted as in band when it is within this many PSI of SET_PRESSURE
+STORE_CHUNK_ROWS = 1 << 20  # Samples in each chunk of the telemetry store, about 60MB or 3 days at the default data interval
+STREAM_HOST = '127.0.0.1'  # The binary telemetry stream only listens on this address when given a port
+STREAM_MAX_BACKLOG = 256 * 1024  # Bytes a stream subscriber can fall behind before it is dropped, about 4000 frames
+
+defaultProfile = ConfigProfile('defaults', SET_PRESSURE, DEF_OPEN_PRESSURE, DEF_CLOSE_PRESSURE, \
+                               {'Upstream': (SLOPE_UPSTREAM, OFFSET_UPSTREAM), 'Downstream': (SLOPE_DOWNSTREAM, OFFSET_DOWNSTREAM), 'Actual Tank': (SLOPE_TANK, OFFSET_TANK)}, \
+                               (CORRECTION_CONST1, CORRECTION_CONST2, CORRECTION_CONST3))  # The profile made from the constants above, used when there is no --config
+outputManager = OutputManager(DUTY_CYCLE_MIN_CHANGE, DUTY_CYCLE_MIN_INTERVAL)  # Holds the last known state of every output of every rig
+telemetry = TelemetryWriter(TELEMETRY_FILE, TELEMETRY_MAX_BYTES, TELEMETRY_BACKUP_COUNT, TELEMETRY_QUEUE_SIZE, TELEMETRY_BATCH_SIZE, TELEMETRY_PRINT_INTERVAL)  # Writes samples and messages off the event thread
+
+writeVoltageToOutputs = False  # If true voltages will be output on the extra channels, defaults to true but can be overwrten by passing False as the first arg when this script is called
+USE_CHANNEL_REGISTRY = True  # If false the channel name is looked up from the Phidget library on every event, this is only useful to compare native calls per event
+controlPeriod = 0.0  # If more than zero the control logic runs every this many secounds on its own thread instead of on every sample, this is set by --control-period
+dataInterval = 250  # The transducer data interval in [ms], this is set by --data-interval
+simulationHours = 0.0  # Hours of simulated time to run, this is set by --simulate
+replayFile = None  # The log or telemetry file to replay, this is set by --replay
+analysisSource = None  # The telemetry store directory or CSV to analyze, this is set by --analyze
+cyclesFile = None  # The per cycle table of the analysis is written to this CSV file, this is set by --cycles
+reportFile = None  # The summary of the analysis is written to this JSON file, this is set by --report
+filterMethod = None  # When set to one of BlockFilter.METHODS the transducers are sampled as fast as they can and filtered in blocks, this is set by --filter
+benchmarkFile = None  # The JSON file the benchmark results are written to, this is set by --benchmark
+glitchInterval = 0.0  # Mean secounds between simulated channel glitches, this is set by --glitch-interval
+seed = None  # Random seed for the simulated transducer noise, this is set by --seed
+evaluationDeadband = 0.0  # The decisions are skipped while the pressures stay within this many PSI of the last evaluation and no timer expires, this is set by --deadband
+flightRecorderFile = FLIGHT_RECORDER_FILE  # Each worker process dumps its flight recorder to its own file
+logFileName = 'app.log'  # The file the log is written to, the benchmark moves it out of the working directory
+tankEstimator = 'fixed'  # Either 'fixed' to use the correction constants as they are or 'rls' to fit them online, this is set by --estimator
+serialNumbers = list()  # The VINT hub serial number of each rig, if empty one rig is run on the first hub found, this is set by --serial
+metricsPort = 0  # The metrics are served on this local port if it is more than zero, this is set by --metrics-port
+metricsFile = None  # The metrics are written to this JSON file every METRICS_SNAPSHOT_INTERVAL secounds, this is set by --metrics-json
+storeDirectory = None  # Every sample is also appended to the columnar telemetry store in this directory, this is set by --store
+streamAddress = None  # The port or Unix socket path the binary telemetry stream is published on, this is set by --stream
+fastStart = False  # If true the channels are found with the Phidget Manager and opened all at once, this is set by --fast-start
+workers = 'threads'  # Either 'threads' to run every rig in this process or 'processes' to run each rig in a process pool, this is set by --workers
+simulator = None  # This is the Simulator when running with --simulate, all channels are then stand-ins driven by a pneumatic model
+configFile = None  # The JSON or TOML file the profile of every rig is read from and reloaded from when it changes, this is set by --config
+showDashboard = False  # If true the console shows a live dashboard instead of a line per event, this is set by --dashboard
+dashboard = None  # This is the Dashboard while it is being drawn, the console messages are sent to it instead of printed
+# endregion Global Variables -------------------------------------------------
+
+# region Road Test Rig -------------------------------------------------------
+class RoadTestRig:
+    '''
+    Everything needed to control one road test rig: its channels, calibration,
+    pressure history, solenoid timers and latest samples. The channels of a
+    rig are all addressed to the VINT hub with its serial number, so several
+    rigs can be controlled from one process. The Phidget event handlers are
+    methods of the rig, so a channel only ever changes the state of its own
+    rig.
+    '''
+    def __init__(self, serialNumber: int = None, calibration: dict = None):
+        self.serialNumber = serialNumber  # Serial number of the VINT hub, if None the first hub found is used
+        self.name = 'Rig' if serialNumber is None else f'Rig {serialNumber}'
+        self.logPrefix = '' if serialNumber is None else f'[{serialNumber}] '  # Added to the start of every message from this rig
+        self.calibration = dict() if calibration is None else calibration  # Maps a channel name to a (slope, offset) used instead of the calibration of the profile
+        self.profile = getConfigProfile(serialNumber)  # The set pressures, calibration and correction constants used by the control logic
+        self.pendingProfile = None  # A new ConfigProfile from the ConfigWatcher, it is swapped in by runControl at the next evaluation
+
+        # Input variables
+        self.upstreamVoltage = 0.0  # V_u This will be current voltage of upstream pressure transducer
+        self.downstreamVoltage = 0.0  # V_d This will be current voltage of downstream pressure transducer
+        self.inflationStateTime = clock.now()  # This holds the time when the inflation solenoid was last closed or opened
+        self.deflationStateTime = clock.now()
+        self.warningLightTime = clock.now()
+
+        # Calculated variables
+        self.upstreamPressure = 0.0  # P_u This will be the calculated upstream pressure in [PSI]
+        self.downstreamPressure = 0.0  # P_d This will be the calculated downstream pressure in [PSI]
+        self.tankPressure = 0.0  # P_t This will be the calculated tank pressure in [PSI]
+        self.actualTankPressure = 0.0  # This is the measured tank pressure in [PSI], it is only read when writeVoltageToOutputs is true
+        self.tankPressureLastThreeSecounds = PressureHistory(PRESSURE_HISTORY_SIZE, PRESSURE_DROP_WINDOW)  # This ring buffer contains the time and values of the last thee secounds of tankPressure
+
+        # Latest transducer readings, written by the voltage change handlers and read by the control logic
+        self.latestSamples = SensorSnapshot()
+
+        # Channels
+        self.voltageInputs = list()
+        self.digitalOutputs = list()
+        self.viTank = None  # This will monitor the actual tank pressure for debugging, it is only created if writeVoltageToOutputs is True
+        self.channelRegistry = dict()  # Maps each channel of this rig to its ChannelInfo, this is filled in by onAttach
+        self.blockFilters = dict()  # Maps the Upstream and Downstream channel names to their BlockFilter when filterMethod is set
+        self.controlLoop = None  # This is the ControlLoop thread when controlPeriod is used
+        self.allChannelsAttached = False  # This is set to true when all channels have been attached
+        self.openStartTime = None  # The time.perf_counter() when the channels started opening
+        self.attachTimes = dict()  # Maps each channel name to the secounds it took to attach after the channels started opening
+        self.expectedChannels = 0  # Number of channels being opened at once
+        self.attachedEvent = threading.Event()  # Set once every channel being opened at once has attached
+        self.lightAttachedEvent = threading.Event()
+        self.blinking = False  # True while the start up blink is using the warning light
+
+        # Detach recovery, the state goes starting -> running -> detached -> resuming -> running and finally stopped
+        self.state = 'starting'
+        self.controlLock = threading.RLock()  # Held by each control cycle and by the detach and reattach handlers, so the safe state is never overwritten by a cycle that was already running
+        self.attachedChannels = set()  # Names of the channels that are attached right now
+        self.detachTime = 0.0  # The clock.monotonic() when the first channel detached
+        self.resumeTime = None  # The clock.monotonic() when every channel had reattached, None unless resuming
+
+        self.error = None  # The message of the error that stopped this rig from starting
+        self.evaluations = 0  # Number of times the decision functions have run
+        self.evaluationGate = EvaluationGate(evaluationDeadband, PRESSURE_DROP_WINDOW)  # Skips the decision functions when they can not change
+        self.flightRecorder = FlightRecorder(FLIGHT_RECORDER_SIZE, flightRecorderFile, self.logPrefix)  # Every evaluation in detail, only written out after an incident
+        self.inflations = 0  # Number of times the inflation solenoid has been opened
+        self.metrics = RigMetrics(METRICS_LATENCY_BUCKETS, PRESSURE_BAND)  # Counters read by the metrics endpoint
+
+        # Tank pressure estimation, the fill times are used to measure how well the estimate stops each fill
+        self.estimator = None  # The TankEstimator when tankEstimator is 'rls'
+        if tankEstimator == 'rls':
+            self.estimator = TankEstimator(self.profile.correction, ESTIMATOR_INITIAL_COVARIANCE, ESTIMATOR_MAX_COVARIANCE, ESTIMATOR_MAX_RESIDUAL)
+        self.fillStartTime = None  # The clock.monotonic() when the first inflation of the current fill opened, None if not filling
+        self.fillCycles = 0  # Number of times the inflation solenoid has opened during the current fill
+        self.inflationCloseTime = None  # The clock.monotonic() when the inflation solenoid last closed, None once the settled pressure has been read
+        self.closingPressures = None  # The (downstream, upstream) pressures when the inflation solenoid last closed
+
+    # Event Handlers --------------------------------------------------------
+    def onVoltageChange(self, voltageInput: VoltageInput, voltage):
+        # Only process events if both the upstream and downstream sensors are attached
+        if self.allChannelsAttached:
+            nativeCalls.startEvent()
+            startTime = time.perf_counter()
+            channel = self.getChannelInfo(voltageInput)
+            self.metrics.countSample(channel.name, clock.monotonic())
+            blockFilter = self.blockFilters.get(channel.name)
+            published = True
+            if blockFilter is None:
+                self.publishSample(channel, voltage, channel.slope * voltage + channel.offset)
+            elif blockFilter.add(voltage):
+                # The block is full so the filtered value is passed on
+                self.publishSample(channel, *blockFilter.filter())
+            else:
+                published = False
+            # Without a control period the control logic runs on every sample
+            if published and controlPeriod <= 0.0:
+                self.runControl()
+            self.metrics.observeLatency(time.perf_counter() - startTime)
+            nativeCalls.endEvent()
+
+    def onAttach(self, phidget: Phidget):
+        channel = self.registerChannel(phidget)
+        if channel.isOutput:
+            outputManager.refresh(phidget)
+        if self.openStartTime is not None and channel.name not in self.attachTimes:
+            self.attachTimes[channel.name] = time.perf_counter() - self.openStartTime
+            if len(self.attachTimes) >= self.expectedChannels:
+                self.attachedEvent.set()
+        if channel.name == 'LED':
+            self.lightAttachedEvent.set()
+        self.attachedChannels.add(channel.name)
+        message = f'{self.logPrefix}The {channel.name} channel has successfully attached'
+        showMessage(message)
+        logging.debug(message)
+        # The state is read under the lock, so a detach or the end of open can not change it in between
+        with self.controlLock:
+            if self.state == 'detached':
+                self.recoverChannel(phidget, channel)
+
+    def onDetach(self, phidget: Phidget):
+        # This waits for a control cycle that is running to finish, so the cycle can not undo the safe state
+        with self.controlLock:
+            self.allChannelsAttached = False
+            channel = self.getChannelInfo(phidget)
+            if channel.isOutput:
+                outputManager.forget(phidget)
+            self.attachedChannels.discard(channel.name)
+            message = f'{self.logPrefix}The {channel.name} channel has been detached'
+            showMessage(message)
+            logging.critical(message)
+            self.flightRecorder.record('The {} channel detached', channel.name)
+            if self.state in ('running', 'resuming'):
+                # If control had not resumed yet this is still the same outage
+                if self.state == 'running':
+                    self.detachTime = clock.monotonic()
+                    self.flightRecorder.dump(f'the {channel.name} channel detached')
+                self.state = 'detached'
+                self.resumeTime = None
+                self.enterSafeState()
+                self.publishTransition(TelemetryStream.DETACHED)
+
+    # Detach recovery -------------------------------------------------------
+    def enterSafeState(self):
+        # Set every relay that is still attached to its safe state, the ones that are detached can not be written
+        for do in self.digitalOutputs[:3]:
+            name = self.getChannelInfo(do).name
+            if name in self.attachedChannels:
+                try:
+                    self.solenoidToggle(do, SAFE_RELAY_STATES[name])
+                except PhidgetException as ex:
+                    message = self.logPrefix + "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+                    showMessage(message)
+                    logging.critical(message)
+                    self.dumpPhidgetException(ex)
+        # The outage ends any fill, so the estimator is not taught from pressures read before it and no fill is timed across it
+        self.fillStartTime = None
+        self.fillCycles = 0
+        self.inflationCloseTime = None
+        self.closingPressures = None
+
+    def recoverChannel(self, phidget: Phidget, channel: ChannelInfo):
+        # This is called from onAttach while waiting for detached channels to come back
+        try:
+            self.configureChannel(phidget)
+            if channel.name in SAFE_RELAY_STATES:
+                self.solenoidToggle(phidget, SAFE_RELAY_STATES[channel.name])
+        except PhidgetException as ex:
+            message = self.logPrefix + "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+            showMessage(message)
+            logging.critical(message)
+            self.dumpPhidgetException(ex)
+            return
+        if self.attachedChannels.issuperset(self.getChannelAddresses()):
+            # Control resumes once both transducers have sent a sample since now, see runControl
+            self.resumeTime = clock.monotonic()
+            self.state = 'resuming'
+            self.allChannelsAttached = True
+            message = f'{self.logPrefix}All channels reattached after {self.resumeTime - self.detachTime:.2f} secounds'
+            showMessage(message)
+            logging.warning(message)
+
+    def finishRecovery(self):
+        # Both transducers have fresh samples, so the control logic can take the relays back from the safe state
+        now = clock.monotonic()
+        outage = self.resumeTime - self.detachTime
+        recovery = now - self.resumeTime
+        self.metrics.recordOutage(outage, recovery)
+        self.resumeTime = None
+        self.state = 'running'
+        self.publishTransition(TelemetryStream.RESUMED)
+        message = f'{self.logPrefix}Control resumed: outage = {outage:.2f} secounds, recovery latency = {recovery * 1000.0:.0f}ms'
+        showMessage(message)
+        logging.warning(message)
+
+    # Control ---------------------------------------------------------------
+    def runControl(self):
+        # This is called by onVoltageChange, the control loop or the simulator, the lock keeps a detach from changing the relays part way through a cycle
+        with self.controlLock:
+            self.runControlCycle()
+
+    def runControlCycle(self):
+        # This reads the latest samples and sets the solenoids and warning light
+        # Only process events if both the upstream and downstream sensors are attached
+        if self.allChannelsAttached:
+            if self.resumeTime is not None:
+                # After a detach the samples from before the outage are not used
+                if self.latestSamples.upstream[0] < self.resumeTime or self.latestSamples.downstream[0] < self.resumeTime:
+                    return
+                self.finishRecovery()
+            if self.pendingProfile is not None:
+                self.applyProfile()
+            profile = self.profile
+            nativeCalls.startCycle()
+            inflationSolenoid: DigitalOutput = self.digitalOutputs[0]
+            deflationSolenoid: DigitalOutput = self.digitalOutputs[1]
+            warningLight: DigitalOutput = self.digitalOutputs[2]
+
+            # Update the voltage and pressure vars from the latest samples
+            _, self.upstreamVoltage, self.upstreamPressure = self.latestSamples.upstream
+            _, self.downstreamVoltage, self.downstreamPressure = self.latestSamples.downstream
+            # Update tank, now is taken first since the evaluation gate needs it even if reading a relay fails
+            now = clock.monotonic()
+            try:
+                inflating = outputManager.getState(inflationSolenoid)
+                if inflating and self.estimator is not None:
+                    self.tankPressure = self.estimator.estimate(self.downstreamPressure, self.upstreamPressure)
+                elif inflating:
+                    c1, c2, c3 = profile.correction
+                    self.tankPressure = c1 * self.downstreamPressure + c2 * self.upstreamPressure + c3
+                else:
+                    self.tankPressure = self.downstreamPressure
+                # Add latest value to the list of tankpressures
+                self.tankPressureLastThreeSecounds.append(now, self.tankPressure)
+                self.metrics.updateBand(self.tankPressure, profile.setPressure, now)
+                # Read the actual tank pressure, this is only connected for debugging
+                if writeVoltageToOutputs:
+                    nativeCalls.add()
+                    self.actualTankPressure = self.voltageToPressure(self.viTank, self.viTank.getVoltage())
+                self.updateFill(inflating, outputManager.getState(deflationSolenoid), now)
+            except PhidgetException as ex:
+                if dashboard is None:
+                    traceback.print_exc()
+                msg = self.logPrefix + "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+                showMessage(msg)
+                logging.debug(msg)
+                self.dumpPhidgetException(ex)
+
+            # Check current stat of all solenoids
+            inflationState, deflationState, lightState = False, False, False
+            try:
+                inflationState = outputManager.getState(inflationSolenoid)
+                deflationState = outputManager.getState(deflationSolenoid)
+                lightState = outputManager.getState(warningLight)
+            except PhidgetException as ex:
+                if dashboard is None:
+                    traceback.print_exc()
+                msg = self.logPrefix + "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+                showMessage(msg)
+                logging.debug(msg)
+                self.dumpPhidgetException(ex)
+
+            # Make sure we have meaningful data and that a decision could change
+            states = (inflationState, deflationState, lightState)
+            if (self.downstreamPressure != 0.0) and (self.upstreamPressure != 0.0) and \
+                    self.evaluationGate.check(self.upstreamPressure, self.downstreamPressure, self.tankPressure, states, now):
+                self.evaluations += 1
+                recorder = self.flightRecorder
+                recorder.record('Inputs: upstream = {:.2f}PSI, downstream = {:.2f}PSI, tank = {:.2f}PSI, actual tank = {:.2f}PSI, relays = {}', \
+                                self.upstreamPressure, self.downstreamPressure, self.tankPressure, self.actualTankPressure, states)
+                # Determine if inflation solenoid should be opened
+                inflateNeeded = shouldInflate(\
+                                inflationState=inflationState,\
+                                inflationChangeTime=self.inflationStateTime,\
+                                upstreamPressure=self.upstreamPressure,\
+                                downstreamPressure=self.downstreamPressure,\
+                                tankPressure=self.tankPressure,\
+                                deflation=deflationState,\
+                                recorder=recorder,\
+                                profile=profile
+                                )
+                # Set solenoid per result
+                self.solenoidToggle(inflationSolenoid, inflateNeeded, recorder.last)
+
+                # Determine if the deflation solenoid should be opened
+                deflateNeeded = shouldDeflate(\
+                                    deflationState=deflationState,\
+                                    deflationChangeTime=self.deflationStateTime,\
+                                    inflationState=inflateNeeded,\
+                                    inflationChangeTime=self.inflationStateTime,\
+                                    tankPressure=self.tankPressure,\
+                                    recorder=recorder,\
+                                    profile=profile
+                                    )
+                # Set solenoid per result
+                if not inflateNeeded:  # Note this is probable not needed but is here just to make sure we never try to open them both
+                    self.solenoidToggle(deflationSolenoid, deflateNeeded, recorder.last)
+
+                # Determine if the warning light should be on, the start up blink has it until it is done
+                if not self.blinking:
+                    warningLightNeeded = shouldWarn(warnState=lightState, warnTimeChange=self.warningLightTime, tankPressure=self.tankPressure, pressureHistory=self.tankPressureLastThreeSecounds, recorder=recorder, profile=profile)
+                    self.solenoidToggle(warningLight, warningLightNeeded, recorder.last)
+                    # The warning light coming on is a fault, so the lead up to it is kept
+                    if warningLightNeeded and not lightState:
+                        recorder.dump('the warning light came on', FLIGHT_RECORDER_FAULT_ENTRIES)
+
+                states = (outputManager.getState(inflationSolenoid), outputManager.getState(deflationSolenoid), outputManager.getState(warningLight))
+                self.evaluationGate.update(self.upstreamPressure, self.downstreamPressure, self.tankPressure, states, self.getNextDeadline(*states, now), \
+                                           self.tankPressureLastThreeSecounds.getRate() <= PRESSURE_DROP_RATE / 2.0 or self.blinking, now)
+
+                # Output pressure values to match the read to the extra VINT ports
+                if writeVoltageToOutputs:
+                    self.writeOutputs(self.upstreamPressure, self.downstreamPressure, self.tankPressure)
+
+            # Send the debug output values held back by DUTY_CYCLE_MIN_INTERVAL, the decisions above may be skipped for a long time
+            if writeVoltageToOutputs and outputManager.pendingDutyCycles:
+                self.flushOutputs()
+
+            # Queue the sample to be written by the telemetry thread
+            telemetry.record(self.upstreamVoltage, self.downstreamVoltage, self.upstreamPressure, self.downstreamPressure, self.tankPressure, self.actualTankPressure, \
+                             outputManager.getState(inflationSolenoid), outputManager.getState(deflationSolenoid), outputManager.getState(warningLight), self.serialNumber)
+            nativeCalls.endCycle()
+
+    def publishSample(self, channel: ChannelInfo, voltage: float, pressure: float):
+        # This saves the latest voltage and pressure of a transducer for the control logic
+        sample = (clock.monotonic(), voltage, pressure)
+        if channel.name == 'Upstream':
+            self.latestSamples.upstream = sample
+        elif channel.name == 'Downstream':
+            self.latestSamples.downstream = sample
+
+    def dumpPhidgetException(self, ex: PhidgetException):
+        self.flightRecorder.record('PhidgetException {} ({}): {}', ex.code, ex.description, ex.details)
+        self.flightRecorder.dump(f'of PhidgetException {ex.code}')
+
+    def getNextDeadline(self, inflationState: bool, deflationState: bool, lightState: bool, now: float) -> float:
+        '''
+        This returns the clock.monotonic() when the next hold off timer of
+        the decision functions expires, given the relay states. A timer that
+        has expired already can not change a decision again, so it is left
+        out. The timers are compared with <= since the decision functions
+        need them to be passed, not just reached.
+        '''
+        currentTime = clock.now()
+        inflationElapsed = (currentTime - self.inflationStateTime).total_seconds()
+        timers = list()
+        if inflationState:
+            timers.append(HOLD_OFF_TIMES[2] - inflationElapsed)  # Longest fill
+        else:
+            timers.append(HOLD_OFF_TIMES[0] - inflationElapsed)  # Lockout between fills
+            timers.append(HOLD_OFF_TIMES[1] - inflationElapsed)  # No deflation right after a fill
+        if not deflationState:
+            timers.append(HOLD_OFF_TIMES[1] - (currentTime - self.deflationStateTime).total_seconds())
+        if lightState:
+            timers.append(HOLD_OFF_TIMES[1] - (currentTime - self.warningLightTime).total_seconds())
+        remaining = [timer for timer in timers if timer >= 0.0]
+        return now + min(remaining) if remaining else math.inf
+
+    def applyProfile(self):
+        '''
+        This swaps in the profile handed over by the ConfigWatcher. It is
+        called from runControl, so the new set pressures are used from this
+        evaluation on. The calibrated channels get new ChannelInfo entries
+        and the latest samples are converted again from their voltages, the
+        pressure history, timers and relay states are all kept. Channels
+        given their own calibration when the rig was made keep it.
+        '''
+        profile, self.pendingProfile = self.pendingProfile, None
+        previous = self.profile
+        for phidget, channel in list(self.channelRegistry.items()):
+            if channel.name in ConfigProfile.CALIBRATED_CHANNELS and channel.name not in self.calibration:
+                slope, offset = profile.getCalibration(channel.name)
+                self.channelRegistry[phidget] = ChannelInfo(channel.name, slope, offset)
+                blockFilter = self.blockFilters.get(channel.name)
+                if blockFilter is not None:
+                    blockFilter.calibration = (slope, offset)
+        for name in ('upstream', 'downstream'):
+            sampleTime, voltage, _ = getattr(self.latestSamples, name)
+            if sampleTime > 0.0 and name.capitalize() not in self.calibration:
+                slope, offset = profile.getCalibration(name.capitalize())
+                setattr(self.latestSamples, name, (sampleTime, voltage, slope * voltage + offset))
+        if self.estimator is not None and profile.correction != previous.correction:
+            # New correction constants are a new starting point for the fit
+            self.estimator = TankEstimator(profile.correction, ESTIMATOR_INITIAL_COVARIANCE, ESTIMATOR_MAX_COVARIANCE, ESTIMATOR_MAX_RESIDUAL)
+        self.profile = profile
+        # The thresholds have moved, so the decisions must run even if the pressures have not
+        self.evaluationGate.reference = None
+        self.flightRecorder.record('Profile {}', profile.describe())
+        message = f'{self.logPrefix}Profile {profile.describe()}'
+        showMessage(message)
+        logging.warning(message)
+
+    def getHoldOffs(self, inflationState: bool, deflationState: bool, lightState: bool) -> list:
+        # This returns the (name, secounds left) of the hold off timers that are running, for the dashboard
+        currentTime = clock.now()
+        inflationElapsed = (currentTime - self.inflationStateTime).total_seconds()
+        timers = list()
+        if inflationState:
+            timers.append(('fill limit', HOLD_OFF_TIMES[2] - inflationElapsed))
+        else:
+            timers.append(('inflation lockout', HOLD_OFF_TIMES[0] - inflationElapsed))
+            if not deflationState:
+                timers.append(('deflation after fill', HOLD_OFF_TIMES[1] - inflationElapsed))
+        if not deflationState:
+            timers.append(('deflation lockout', HOLD_OFF_TIMES[1] - (currentTime - self.deflationStateTime).total_seconds()))
+        if lightState:
+            timers.append(('light minimum', HOLD_OFF_TIMES[1] - (currentTime - self.warningLightTime).total_seconds()))
+        return [(name, remaining) for name, remaining in timers if remaining > 0.0]
+
+    def updateFill(self, inflating: bool, deflating: bool, now: float):
+        '''
+        This teaches the estimator and times the fills. While inflating the
+        Actual Tank pressure is learned from if it is connected. Once the
+        inflation solenoid has been closed for ESTIMATOR_SETTLE secounds the
+        downstream pressure is the tank pressure, so it is learned from along
+        with the pressures at closing, and if it is at the set pressure the
+        fill is finished and its time and number of cycles are recorded.
+        '''
+        if inflating:
+            if self.estimator is not None and writeVoltageToOutputs and self.actualTankPressure > 0.0:
+                self.estimator.update(self.downstreamPressure, self.upstreamPressure, self.actualTankPressure, ESTIMATOR_TANK_FORGETTING)
+            return
+        if self.inflationCloseTime is None or deflating or now - self.inflationCloseTime < ESTIMATOR_SETTLE:
+            return
+        settledPressure = self.downstreamPressure
+        if self.estimator is not None and self.closingPressures is not None:
+            self.estimator.update(*self.closingPressures, settledPressure, ESTIMATOR_SETTLED_FORGETTING)
+        if self.fillStartTime is not None and settledPressure >= self.profile.setPressure - FILL_TOLERANCE:
+            self.metrics.recordFill(self.inflationCloseTime - self.fillStartTime, self.fillCycles)
+            self.fillStartTime = None
+            self.fillCycles = 0
+        self.inflationCloseTime = None
+        self.closingPressures = None
+
+    def solenoidToggle(self, do: DigitalOutput, state: bool = None, reason: tuple = None):
+        # The reason is the FlightRecorder entry of the evaluation that made the decision, it is only logged if the relay changes
+        name = self.getChannelInfo(do).name
+        # If no value is given, then just switch the value
+        if state == None:
+            state = not outputManager.getState(do)
+        if outputManager.setState(do, state):
+            if reason is not None:
+                telemetry.log(logging.DEBUG, self.logPrefix + 'Set {} to {} : [tankPressure = {:.2f}, upstreamPressure = {:.2f}, downstreamPressure = {:.2f}] {}', name, state, self.tankPressure, self.upstreamPressure, self.downstreamPressure, FlightRecorder.formatEntry(reason))
+            else:
+                telemetry.log(logging.DEBUG, self.logPrefix + 'Set {} to {} : [tankPressure = {:.2f}, upstreamPressure = {:.2f}, downstreamPressure = {:.2f}]', name, state, self.tankPressure, self.upstreamPressure, self.downstreamPressure)
+            self.metrics.setSolenoid(name, state, clock.monotonic())
+            if name == 'Inflation':
+                self.inflationStateTime = clock.now()
+                if state:
+                    self.inflations += 1
+                    self.fillCycles += 1
+                    self.inflationCloseTime = None
+                    if self.fillStartTime is None:
+                        self.fillStartTime = clock.monotonic()
+                else:
+                    self.inflationCloseTime = clock.monotonic()
+                    self.closingPressures = (self.downstreamPressure, self.upstreamPressure)
+            elif name == 'Deflation':
+                self.deflationStateTime = clock.now()
+            elif name == 'LED':
+                self.warningLightTime = clock.now()
+            self.publishTransition(TelemetryStream.RELAY)
+
+    def publishTransition(self, kind: int):
+        # This queues a stream frame with the current relay states, so subscribers see state changes between samples
+        stream = telemetry.stream
+        if stream is None:
+            return
+        inflation, deflation, light = (outputManager.peekState(do) for do in self.digitalOutputs[:3])
+        telemetry.put(stream.FRAME.pack(kind, stream.getRelayBits(inflation, deflation, light), self.serialNumber or 0, clock.monotonic(), \
+                                        self.upstreamVoltage, self.downstreamVoltage, self.upstreamPressure, self.downstreamPressure, self.tankPressure, self.actualTankPressure))
+
+    def writeOutputs(self, upstream: float, downstream: float, tank: float):
+        # Only outputs whose duty cycle has changed are written
+        try:
+            outUp = self.digitalOutputs[3]
+            outDown = self.digitalOutputs[4]
+            if upstream > 0.0:
+                outputManager.setDutyCycle(outUp, upstream / 150.0)
+            else:
+                outputManager.setDutyCycle(outUp, 0.0)
+            if downstream > 0.0:
+                outputManager.setDutyCycle(outDown, downstream / 150.0)
+            else:
+                outputManager.setDutyCycle(outDown, 0.0)
+            # There is only a tank output if one has been added to the list
+            if len(self.digitalOutputs) > 5:
+                outTank = self.digitalOutputs[5]
+                if tank > 0.0:
+                    outputManager.setDutyCycle(outTank, tank / 150.0)
+                else:
+                    outputManager.setDutyCycle(outTank, 0.0)
+        except:
+            pass
+
+    def flushOutputs(self):
+        # Like writeOutputs a failed write to a debug output is ignored
+        try:
+            outputManager.flushDutyCycles(self.digitalOutputs[3:])
+        except:
+            pass
+
+    # Channels --------------------------------------------------------------
+    def voltageToPressure(self, voltageInput: VoltageInput, voltage) -> float:
+        channel = self.getChannelInfo(voltageInput)
+        return channel.slope * voltage + channel.offset
+
+    def registerChannel(self, phidget: Phidget) -> ChannelInfo:
+        # This works out the role and calibration of a channel and saves it so it does not need to be looked up again
+        name = getPhidgetName(phidget)
+        slope, offset = self.calibration.get(name) or self.profile.getCalibration(name)
+        channel = ChannelInfo(name, slope, offset)
+        self.channelRegistry[phidget] = channel
+        return channel
+
+    def getChannelInfo(self, phidget: Phidget) -> ChannelInfo:
+        # This returns the saved ChannelInfo, only calling into the Phidget library if the channel has not been registered yet
+        if USE_CHANNEL_REGISTRY:
+            channel = self.channelRegistry.get(phidget)
+            if channel is not None:
+                return channel
+        return self.registerChannel(phidget)
+
+    def createChannels(self):
+        # This creates and addresses every channel of the rig and assigns the event handlers, nothing is opened yet
+        # Initiate the Phidgets code object
+        viUpstream = createVoltageInput()
+        viDownstream = createVoltageInput()
+        doInflation = createDigitalOutput()
+        doDeflation = createDigitalOutput()
+        doLight = createDigitalOutput()
+
+        # Add inputs and outputs to the lists of channels
+        self.voltageInputs.append(viUpstream)
+        self.voltageInputs.append(viDownstream)
+        self.digitalOutputs.append(doInflation)
+        self.digitalOutputs.append(doDeflation)
+        self.digitalOutputs.append(doLight)
+
+        # Set Phidgets addressing parameters
+        viUpstream.setHubPort(0)  # Set to VINT port for upstream pressure transducer
+        viUpstream.setIsHubPortDevice(True)
+        viDownstream.setHubPort(1)  # Set to VINT port for downstream pressure transducer
+        viDownstream.setIsHubPortDevice(True)
+        doInflation.setHubPort(2)  # Set the VINT port that the relay is connected to
+        doInflation.setChannel(1)  # Set the channel on the relay module that the Inflation solenoid is connected to
+        doDeflation.setHubPort(2)  # Set the VINT port that the relay is connected to
+        doDeflation.setChannel(2)  # Set the channel on the relay module that the Deflation solenoid is connected to
+        doLight.setHubPort(2)  # Set the VINT port that the relay is connected to
+        doLight.setChannel(0)  # Set the channel on the relay module that the Warning Light is connected to
+
+        # Assign attach/detach handlers
+        viDownstream.setOnAttachHandler(self.onAttach)
+        viUpstream.setOnAttachHandler(self.onAttach)
+        doInflation.setOnAttachHandler(self.onAttach)
+        doDeflation.setOnAttachHandler(self.onAttach)
+        doLight.setOnAttachHandler(self.onAttach)
+
+        viDownstream.setOnDetachHandler(self.onDetach)
+        viUpstream.setOnDetachHandler(self.onDetach)
+        doInflation.setOnDetachHandler(self.onDetach)
+        doDeflation.setOnDetachHandler(self.onDetach)
+        doLight.setOnDetachHandler(self.onDetach)
+
+        # Assign the event handlers to react to input changes
+        viUpstream.setOnVoltageChangeHandler(self.onVoltageChange)
+        viDownstream.setOnVoltageChangeHandler(self.onVoltageChange)
+
+        # Create the output voltages. These are for debuging
+        if writeVoltageToOutputs:
+            # Create channels
+            outUpstream = createDigitalOutput()
+            outDownstream = createDigitalOutput()
+            # Add them to the output list
+            self.digitalOutputs.append(outUpstream)
+            self.digitalOutputs.append(outDownstream)
+            # Address
+            outUpstream.setHubPort(3)
+            outDownstream.setHubPort(4)
+            outUpstream.setIsHubPortDevice(True)
+            outDownstream.setIsHubPortDevice(True)
+            outUpstream.setOnAttachHandler(self.onAttach)
+            outDownstream.setOnAttachHandler(self.onAttach)
+            outUpstream.setOnDetachHandler(self.onDetach)
+            outDownstream.setOnDetachHandler(self.onDetach)
+
+            # Set up port five for the actual tank pressure
+            self.viTank = createVoltageInput()
+            self.viTank.setHubPort(5)
+            self.viTank.setIsHubPortDevice(True)
+            self.viTank.setOnAttachHandler(self.onAttach)
+            self.viTank.setOnDetachHandler(self.onDetach)
+
+        # Only match channels on the hub of this rig
+        if self.serialNumber is not None:
+            for phidget in self.getChannels():
+                phidget.setDeviceSerialNumber(self.serialNumber)
+
+    def getChannels(self) -> list:
+        # This returns every channel of the rig, including the debug channels
+        channels = self.voltageInputs + self.digitalOutputs
+        if self.viTank is not None:
+            channels.append(self.viTank)
+        return channels
+
+    def getChannelAddresses(self) -> dict:
+        # This maps the name of each channel to its (serialNumber, hubPort, isHubPortDevice, channel), these must match createChannels
+        addresses = {
+            'Upstream': (self.serialNumber, 0, True, 0),
+            'Downstream': (self.serialNumber, 1, True, 0),
+            'LED': (self.serialNumber, 2, False, 0),
+            'Inflation': (self.serialNumber, 2, False, 1),
+            'Deflation': (self.serialNumber, 2, False, 2),
+        }
+        if writeVoltageToOutputs:
+            addresses['Upstream Output'] = (self.serialNumber, 3, True, 0)
+            addresses['Downstream Output'] = (self.serialNumber, 4, True, 0)
+            addresses['Actual Tank'] = (self.serialNumber, 5, True, 0)
+        return addresses
+
+    def blink(self, doLight: DigitalOutput):
+        # Flash light to let user know that the program has started, the control logic leaves the light alone until this is done
+        # The control logic gets the light back even if the blink fails, so a light that detaches can not stay blinking forever
+        self.blinking = True
+        try:
+            for n in range(0,BLINK_COUNT):
+                outputManager.setState(doLight, True)  # Turn on
+                clock.sleep(BLINK_ON_TIME)  # Wait on
+                outputManager.setState(doLight, False)  # Turn off
+                if n < BLINK_COUNT:
+                    clock.sleep(BLINK_OFF_TIME)  # Wait off
+        finally:
+            self.blinking = False
+
+    def openChannels(self):
+        # This opens the channels one at a time, waiting up to five secounds for each to attach
+        doInflation, doDeflation, doLight = self.digitalOutputs[:3]
+        viUpstream, viDownstream = self.voltageInputs
+
+        # Attach the light
+        doLight.openWaitForAttachment(5000)
+        self.blink(doLight)
+
+        # Open the debug channels
+        if writeVoltageToOutputs:
+            for phidget in self.digitalOutputs[3:] + [self.viTank]:
+                phidget.openWaitForAttachment(5000)
+
+        # Open channels and wait for attachment
+        doDeflation.openWaitForAttachment(5000)
+        doInflation.openWaitForAttachment(5000)
+        viDownstream.openWaitForAttachment(5000)
+        viUpstream.openWaitForAttachment(5000)
+
+    def openChannelsConcurrently(self, deadline: float):
+        '''
+        This opens every channel at once and waits until the deadline, a
+        time.monotonic() time, for them all to attach instead of up to five
+        secounds for each channel in turn. The start up blink runs on its own thread as
+        soon as the light attaches. A RuntimeError naming the channels that
+        did not attach is raised if the deadline passes.
+        '''
+        channels = self.getChannels()
+        self.expectedChannels = len(channels)
+        for phidget in channels:
+            phidget.open()
+        doLight = self.digitalOutputs[2]
+        if simulator is not None:
+            # The blink would move the virtual clock under the simulator, so it is run before the simulation starts
+            self.blink(doLight)
+        else:
+            threading.Thread(target=self.blinkWhenAttached, args=(doLight, max(deadline - time.monotonic(), 0.0)), name=f'{self.name} blink', daemon=True).start()
+        if not self.attachedEvent.wait(max(deadline - time.monotonic(), 0.0)):
+            missing = [getPhidgetName(phidget) for phidget in channels if not phidget.getAttached()]
+            raise RuntimeError(f'{", ".join(missing)} did not attach within {STARTUP_DEADLINE:g} secounds of starting')
+
+    def blinkWhenAttached(self, doLight: DigitalOutput, timeout: float):
+        # This runs on its own thread, so an error in the blink is logged here or it would be lost
+        if self.lightAttachedEvent.wait(timeout):
+            try:
+                self.blink(doLight)
+            except PhidgetException as ex:
+                msg = self.logPrefix + "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+                showMessage(msg)
+                logging.critical(msg)
+            except Exception as ex:
+                msg = f'{self.logPrefix}The start up blink failed: {type(ex).__name__}: {ex}'
+                showMessage(msg)
+                logging.exception(msg)
+
+    def open(self, startupDeadline: float = None):
+        '''
+        This creates and opens the channels of the rig, flashes the warning
+        light and closes all of the solenoids. The channels are opened one at
+        a time unless --fast-start is used, then they must all attach before
+        startupDeadline, a time.monotonic() time. A PhidgetException is raised
+        if a channel can not be opened.
+        '''
+        self.createChannels()
+        self.openStartTime = time.perf_counter()
+        if fastStart:
+            if startupDeadline is None:
+                startupDeadline = time.monotonic() + STARTUP_DEADLINE
+            self.openChannelsConcurrently(startupDeadline)
+        else:
+            self.openChannels()
+        message = f'{self.logPrefix}All channels attached in {(time.perf_counter() - self.openStartTime) * 1000.0:.0f}ms: ' + \
+            ', '.join(f'{name} = {attachTime * 1000.0:.0f}ms' for name, attachTime in sorted(self.attachTimes.items(), key=lambda item: item[1]))
+        print(message)
+        logging.info(message)
 
-'''
-Since tire pressure is not measured directly, it must be estimated. The tire
-pressure during fill is estimated by the equation:
-P_t = CORRECTION_CONST1*P_d + CORRECTION_CONST2*P_u + CORRECTION_CONST3
-Preliminary testing was done to determine constants for this correction
-equation that work well of a verity of circumstances. 
-'''
-CORRECTION_CONST1 = 1
-CORRECTION_CONST2 = 0.0
-CORRECTION_CONST3 = 0.0
+        # Set the data sampling intervals and the debug outputs
+        for phidget in self.getChannels():
+            self.configureChannel(phidget)
+        if filterMethod is not None:
+            message = f'{self.logPrefix}Filtering {filterMethod} over blocks of {FILTER_BLOCK_SIZE} samples at a data interval of {self.voltageInputs[0].getDataInterval()}ms'
+            print(message)
+            logging.info(message)
 
-allChannelsAttached = False  # This is set to true when all channels have been attached
-writeVoltageToOutputs = False  # If true voltages will be output on the extra channels, defaults to true but can be overwrten by passing False as the first arg when this script is called
-viTank = VoltageInput()  # This will monitor the actual tank pressure for debugging, it will only attach if the above var is Trues
-# endregion Global Variables -------------------------------------------------
+        # If we make it to this point in the code, then all channels will have been attached
+        # A channel may have detached again while starting, onDetach leaves that to here, so control waits for it like any other outage
+        with self.controlLock:
+            missing = [name for name in self.getChannelAddresses() if name not in self.attachedChannels]
+            if missing:
+                self.detachTime = clock.monotonic()
+                self.state = 'detached'
+                self.resumeTime = None
+                self.enterSafeState()
+                self.publishTransition(TelemetryStream.DETACHED)
+                message = f'{self.logPrefix}Detached while starting: {", ".join(missing)}, control starts once all channels reattach'
+                showMessage(message)
+                logging.critical(message)
+            else:
+                self.allChannelsAttached = True
+                self.state = 'running'
+                doInflation, doDeflation, doLight = self.digitalOutputs[:3]
 
-# region Event Handlers ------------------------------------------------------
-def onVoltageChange(self: VoltageInput, voltage):
-    voltageInput = self
-    global upstreamVoltage
-    global upstreamPressure
-    global downstreamVoltage
-    global downstreamPressure
-    global tankPressure
-    global digitalOutputs
-    global inflationStateTime
-    global deflationStateTime
-    global allChannelsAttached
-
-    # Only process events if both the upstream and downstream sensors are attached
-    if allChannelsAttached:
-        inflationSolenoid: DigitalOutput = digitalOutputs[0]
-        deflationSolenoid: DigitalOutput = digitalOutputs[1]
-        warningLight: DigitalOutput = digitalOutputs[2]
-
-        if getPhidgetName(voltageInput) == 'Upstream':
-            # Update upstreamVoltage var
-            upstreamVoltage = voltage
-            # Update upstreamPressure var
-            upstreamPressure = voltageToPressure(voltageInput, voltage)
-        elif getPhidgetName(voltageInput) == 'Downstream':
-                # Update downstreamVoltage var
-            downstreamVoltage = voltage
-            # Update downstreamPressure var
-            downstreamPressure = voltageToPressure(voltageInput, voltage)
-        # Update tank
-        try:
-            if inflationSolenoid.getState():
-                tankPressure = CORRECTION_CONST1 * downstreamPressure + \
-                    CORRECTION_CONST2 * upstreamPressure + CORRECTION_CONST3
+                # Make sure program starts with all solenoids closed
+                self.solenoidToggle(doDeflation, False)
+                self.solenoidToggle(doInflation, False)
+                if not self.blinking:
+                    self.solenoidToggle(doLight, False)
+
+        # Start the fixed rate control loop, without it the control logic runs on every sample
+        # When simulating, the simulator calls the control logic on the virtual clock instead
+        if controlPeriod > 0.0 and simulator is None:
+            self.controlLoop = ControlLoop(controlPeriod, self.runControl)
+            self.controlLoop.start()
+
+    def configureChannel(self, phidget: Phidget):
+        # Channels lose their settings when they detach, so this is called when they are opened and again each time they reattach
+        channel = self.getChannelInfo(phidget)
+        if channel.name in ('Upstream', 'Downstream'):
+            if filterMethod is not None:
+                # Sample as fast as the transducers allow, the control logic only sees one filtered value per block
+                # A new filter is made so a block is never split across a detach
+                phidget.setDataInterval(phidget.getMinDataInterval())
+                self.blockFilters[channel.name] = BlockFilter(FILTER_BLOCK_SIZE, filterMethod, FILTER_ALPHA, channel.slope, channel.offset)
             else:
-                tankPressure = downstreamPressure
-            # Add latest value to the list of tankpressures
-            tankPressureLastThreeSecounds.append([datetime.now(), tankPressure])
-        except PhidgetException as ex:
-            traceback.print_exc()
-            msg = "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
-            print(msg)
-            logging.debug(msg)
-        
-        # Check current stat of all solenoids
-        inflationState, deflationState, lightState = False, False, False
+                phidget.setDataInterval(dataInterval)
+        elif channel.name == 'Actual Tank':
+            phidget.setDataInterval(dataInterval)
+        elif channel.name in ('Upstream Output', 'Downstream Output'):
+            outputManager.setDutyCycle(phidget, 0.0)
+
+    def start(self, startupDeadline: float = None) -> bool:
+        # This opens the rig and keeps the error instead of raising it, so one rig that fails does not stop the others
         try:
-            inflationState = inflationSolenoid.getState()
-            deflationState = deflationSolenoid.getState()
-            lightState = warningLight.getState()
+            self.open(startupDeadline)
+            return True
         except PhidgetException as ex:
             traceback.print_exc()
-            msg = "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
-            print(msg)
-            logging.debug(msg)
-
-        # Make sure we have meaningful data
-        if (downstreamPressure != 0.0) and (upstreamPressure != 0.0):
-            # Determine if inflation solenoid should be opened
-            inflateNeeded = shouldInflate(\
-                            inflationState=inflationState,\
-                            inflationChangeTime=inflationStateTime,\
-                            upstreamPressure=upstreamPressure,\
-                            downstreamPressure=downstreamPressure,\
-                            tankPressure=tankPressure,\
-                            deflation=deflationState
-                            )
-            # Set solenoid per result
-            solenoidToggle(inflationSolenoid, inflateNeeded)
-            
-            # Determine if the deflation solenoid should be opened
-            deflateNeeded = shouldDeflate(\
-                                deflationState=deflationState,\
-                                deflationChangeTime=deflationStateTime,\
-                                inflationState=inflateNeeded,\
-                                inflationChangeTime=inflationStateTime,\
-                                tankPressure=tankPressure
-                                )
-            # Set solenoid per result
-            if not inflateNeeded:  # Note this is probable not needed but is here just to make sure we never try to open them both
-                solenoidToggle(deflationSolenoid, deflateNeeded)
-            
-            
-            # Determine if the warning light should be on
-            warningLightNeeded = shouldWarn(warnState=lightState, warnTimeChange=warningLightTime, tankPressure=tankPressure)
-            solenoidToggle(warningLight, warningLightNeeded)
-
-            # Output pressure values to match the read to the extra VINT ports
-            if writeVoltageToOutputs:
-                writeOutputs(upstreamPressure, downstreamPressure, tankPressure)
-        
-
-
-def onAttach(self):
-    name = getPhidgetName(self)
-    message = f'The {name} channel has successfully attached'
+            self.error = "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+        except Exception as ex:
+            traceback.print_exc()
+            self.error = f'{type(ex).__name__}: {ex}'
+        message = self.logPrefix + self.error
+        print(message)
+        logging.critical(message)
+        return False
+
+    def close(self):
+        self.state = 'stopped'
+        if self.controlLoop is not None:
+            self.controlLoop.stop()
+            message = self.logPrefix + self.controlLoop.getStats()
+            print(message)
+            logging.info(message)
+        for phidget in reversed(self.voltageInputs + self.digitalOutputs[:3]):
+            try:
+                phidget.close()
+            except PhidgetException as ex:
+                message = self.logPrefix + "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+                print(message)
+                logging.critical(message)
+
+    def getSummary(self) -> dict:
+        # This returns the results of the rig in a form that can be sent back from a worker process
+        return {
+            'name': self.name,
+            'serialNumber': self.serialNumber,
+            'error': self.error,
+            'evaluations': self.evaluations,
+            'skippedEvaluations': self.evaluationGate.skipped,
+            'inflations': self.inflations,
+            'tankPressure': self.tankPressure,
+            'outages': self.metrics.outages,
+            'outageSeconds': self.metrics.outageSeconds,
+            'fills': self.metrics.fills,
+            'fillSeconds': self.metrics.fillSeconds,
+            'fillCycles': self.metrics.fillCycles,
+            'coefficients': self.estimator.getCoefficients() if self.estimator is not None else self.profile.correction,
+        }
+
+    def reportFills(self):
+        # This prints how long the fills took to reach the set pressure and the correction constants that were used
+        fills = self.metrics.fills
+        c1, c2, c3 = self.getSummary()['coefficients']
+        message = f'{self.logPrefix}Fills to {self.profile.setPressure:g}PSI = {fills}, mean time to set pressure = {self.metrics.fillSeconds / fills if fills else 0.0:.2f} secounds, ' + \
+            f'mean inflation cycles per fill = {self.metrics.fillCycles / fills if fills else 0.0:.2f}, {tankEstimator} estimator: P_t = {c1:.4f}*P_d + {c2:.4f}*P_u + {c3:.3f}'
+        if self.estimator is not None:
+            message += f' (learned from {self.estimator.updates} readings, {self.estimator.rejected} rejected)'
+        print(message)
+        logging.info(message)
+# endregion Road Test Rig ----------------------------------------------------
+
+# region Helper Functions ----------------------------------------------------
+def readRecording(fileName: str, sampleInterval: float, serialNumber: int = None):
+    '''
+    This reads a telemetry CSV or an app.log one line at a time and yields
+    each sample as a tuple laid out like the TelemetryWriter samples, without
+    the rig. Logs do not have times, so their samples are spaced
+    sampleInterval secounds apart and the voltages are zero. The relay states
+    of a log sample come from the "Set ... to ..." lines that follow it. If a
+    serialNumber is given only the samples of that rig are read from a
+    telemetry CSV.
+    '''
+    with open(fileName, newline='') as file:
+        firstLine = file.readline()
+        if firstLine.startswith('time,'):
+            # Telemetry CSV written by TelemetryWriter, files from before the rig column was added have one less column
+            for row in csv.reader(file):
+                if len(row) not in (len(TelemetryWriter.HEADER) - 1, len(TelemetryWriter.HEADER)):
+                    continue
+                if serialNumber is not None and row[10:] != [str(serialNumber)]:
+                    continue
+                yield (float(row[0]), float(row[1]), float(row[2]), float(row[3]), float(row[4]), float(row[5]), float(row[6]), \
+                       row[7] == 'True', row[8] == 'True', row[9] == 'True')
+        else:
+            # app.log, the pressure lines look like 'root - DEBUG - ,upstream, downstream, tank, actual tank'
+            states = {'Inflation': False, 'Deflation': False, 'LED': False}
+            sample = None
+            sampleTime = 0.0
+            for line in itertools.chain([firstLine], file):
+                message = line.split(' - ', 2)[-1].strip()
+                if message.startswith(','):
+                    if sample is not None:
+                        yield sample + (states['Inflation'], states['Deflation'], states['LED'])
+                    try:
+                        upstream, downstream, tank, actualTank = [float(value) for value in message[1:].split(',')]
+                    except ValueError:
+                        continue
+                    sample = (sampleTime, 0.0, 0.0, upstream, downstream, tank, actualTank)
+                    sampleTime += sampleInterval
+                elif message.startswith('Set '):
+                    # Set Inflation to True : [tankPressure = ...]
+                    words = message.split(' ')
+                    if len(words) > 3 and words[1] in states:
+                        states[words[1]] = words[3] == 'True'
+            if sample is not None:
+                yield sample + (states['Inflation'], states['Deflation'], states['LED'])
+
+
+def readConfigProfile(fileName: str, serialNumber: int = None) -> ConfigProfile:
+    '''
+    This reads the profile of one rig from a JSON or TOML config file. The
+    top level keys are used for every rig and a table under rigs named by the
+    hub serial number overrides them for that rig, so one file can hold a
+    tire type and the calibration of each rig's transducers:
+
+        {"name": "truck 103", "setPressure": 103,
+         "rigs": {"12345": {"calibration": {"Upstream": [37.818, -17.695]}}}}
+
+    The keys are name, setPressure, deflationOpenPressure,
+    deflationClosePressure, calibration and correction. Anything left out
+    keeps its default and the deflation pressures follow the set pressure
+    unless they are given. An OSError or ValueError is raised if the file
+    can not be read or the profile is not valid.
+    '''
+    with open(fileName, 'rb') as file:
+        if fileName.lower().endswith('.toml'):
+            if tomllib is None:
+                raise ValueError('TOML config files need Python 3.11 or later, use JSON instead')
+            values = tomllib.load(file)
+        else:
+            values = json.load(file)
+    if not isinstance(values, dict):
+        raise ValueError(f'{fileName} must hold a table of settings')
+    rigs = values.get('rigs', dict())
+    if not isinstance(rigs, dict):
+        raise ValueError(f'rigs in {fileName} must be a table named by serial number')
+    settings = {key: value for key, value in values.items() if key != 'rigs'}
+    rigSettings = rigs.get(str(serialNumber), dict()) if serialNumber is not None else dict()
+    if not isinstance(rigSettings, dict):
+        raise ValueError(f'rigs.{serialNumber} in {fileName} must be a table of settings')
+    calibration = dict(defaultProfile.calibration)
+    for table in (settings.pop('calibration', dict()), rigSettings.get('calibration', dict())):
+        if not isinstance(table, dict):
+            raise ValueError(f'calibration in {fileName} must be a table of channel names')
+        calibration.update(table)
+    settings.update((key, value) for key, value in rigSettings.items() if key != 'calibration')
+    unknown = set(settings) - {'name', 'setPressure', 'deflationOpenPressure', 'deflationClosePressure', 'correction'}
+    if unknown:
+        raise ValueError(f'{fileName} has unknown settings: {", ".join(sorted(unknown))}')
+
+    setPressure = settings.get('setPressure', defaultProfile.setPressure)
+    deflationOpenPressure = settings.get('deflationOpenPressure')
+    deflationClosePressure = settings.get('deflationClosePressure')
+    if isinstance(setPressure, (int, float)):
+        # The deflation pressures keep the same margins above the set pressure as DEF_OPEN_PRESSURE and DEF_CLOSE_PRESSURE
+        if deflationOpenPressure is None:
+            deflationOpenPressure = setPressure + DEF_OPEN_PRESSURE - SET_PRESSURE
+        if deflationClosePressure is None:
+            deflationClosePressure = setPressure + DEF_CLOSE_PRESSURE - SET_PRESSURE
+    name = str(settings.get('name', os.path.basename(fileName)))
+    if rigSettings:
+        name += f' for rig {serialNumber}'
+    return ConfigProfile(name, setPressure, deflationOpenPressure, deflationClosePressure, calibration, settings.get('correction', defaultProfile.correction))
+
+
+def getConfigProfile(serialNumber: int = None) -> ConfigProfile:
+    # This returns the profile a rig starts with, the file was checked when the program started
+    if configFile is None:
+        return defaultProfile
+    return readConfigProfile(configFile, serialNumber)
+
+
+def startConfigWatcher(rigs: list) -> ConfigWatcher:
+    # This returns None if there is no --config file to watch
+    if configFile is None:
+        return None
+    configWatcher = ConfigWatcher(configFile, rigs, CONFIG_POLL_INTERVAL)
+    configWatcher.start()
+    for rig in rigs:
+        message = f'{rig.logPrefix}Profile {rig.profile.describe()}'
+        print(message)
+        logging.info(message)
+    message = f'{configFile} is checked for changes every {CONFIG_POLL_INTERVAL:g} secounds'
     print(message)
-    logging.debug(message)
+    logging.info(message)
+    return configWatcher
 
-def onDetach(self):
-    global allChannelsAttached
-    allChannelsAttached = False
-    name = getPhidgetName(self)
-    message = f'The {name} channel has been detached'
+
+def stopConfigWatcher(configWatcher: ConfigWatcher):
+    if configWatcher is None:
+        return
+    configWatcher.stop()
+    message = f'Config: reloads = {configWatcher.reloads}, rejected = {configWatcher.failures}'
     print(message)
-    logging.critical(message)
-# endregion Event Handlers ---------------------------------------------------
+    logging.info(message)
 
-# region Helper Functions ----------------------------------------------------
-def voltageToPressure(self: VoltageInput, voltage) -> float:
-    if getPhidgetName(self) == 'Upstream':
-        return SLOPE_UPSTREAM * voltage + OFFSET_UPSTREAM
-    elif getPhidgetName(self) == 'Downstream':
-        return SLOPE_DOWNSTREAM * voltage + OFFSET_DOWNSTREAM
-    elif getPhidgetName(self) == 'Actual Tank':
-        return SLOPE_TANK * voltage + OFFSET_TANK
-    else:
-        slop_ave = (SLOPE_UPSTREAM + SLOPE_DOWNSTREAM) / 2.0
-        offset_ave = (OFFSET_UPSTREAM + OFFSET_DOWNSTREAM) / 2.0
-        return slop_ave * voltage + offset_ave
+
+def createVoltageInput() -> VoltageInput:
+    # This returns a stand-in channel when simulating, otherwise a real Phidget22 channel
+    if simulator is not None:
+        return simulator.createVoltageInput()
+    return VoltageInput()
+
+
+def createDigitalOutput() -> DigitalOutput:
+    if simulator is not None:
+        return simulator.createDigitalOutput()
+    return DigitalOutput()
 
 
 def getPhidgetName(phidget: Phidget) -> str:
-    id =  phidget.getChannel()
     # This method identifies the phidget and returns its name
-    if phidget.getHubPort() != 2:
-        if phidget.getHubPort() == 0:
+    nativeCalls.add()
+    port = phidget.getHubPort()
+    if port != 2:
+        if port == 0:
             return 'Upstream'
-        elif phidget.getHubPort() == 1:
+        elif port == 1:
             return 'Downstream'
-        elif phidget.getHubPort == 3:
+        elif port == 3:
             return 'Upstream Output'
-        elif phidget.getHubPort == 4:
+        elif port == 4:
             return 'Downstream Output'
-        elif phidget.getHubPort == 5:
+        elif port == 5:
             return 'Actual Tank'
     else:
+        nativeCalls.add()
+        id = phidget.getChannel()
         if id == 1:
             return 'Inflation'
         elif id == 2:
@@ -200,36 +2802,178 @@ def getPhidgetName(phidget: Phidget) -> str:
             return 'LED'
 
 
-def solenoidToggle(do: DigitalOutput, state: bool = None):
-    global inflationStateTime
-    global deflationStateTime
-    global warningLightTime
-    # If no value is given, then just switch the value
-    name = getPhidgetName(do)
-    if state == None:
-        do.setState(not do.getState())
-        message = f'Set {name} to {not do.getState()} : [tankPressure = {tankPressure:.2f}, upstreamPressure = {upstreamPressure:.2f}, downstreamPressure = {downstreamPressure:.2f}]'
-        print(message)
-        logging.debug(message)
-    elif do.getState() != state:
-        do.setState(state)
-        message = f'Set {name} to {state} : [tankPressure = {tankPressure:.2f}, upstreamPressure = {upstreamPressure:.2f}, downstreamPressure = {downstreamPressure:.2f}]'
+def getRigFileName(fileName: str, serialNumber: int) -> str:
+    # Each worker process writes its own files, telemetry.csv becomes telemetry-<serial>.csv
+    root, extension = os.path.splitext(fileName)
+    return f'{root}-{serialNumber}{extension}'
+
+
+def startMetrics(rigs: list, port: int, snapshotFile: str) -> MetricsServer:
+    # This returns None if neither the endpoint nor the snapshots were asked for
+    if port <= 0 and snapshotFile is None:
+        return None
+    metricsServer = MetricsServer(rigs, METRICS_HOST, port, snapshotFile, METRICS_SNAPSHOT_INTERVAL)
+    metricsServer.start()
+    if port > 0:
+        message = f'Metrics are served at http://{METRICS_HOST}:{port}/metrics'
         print(message)
-        logging.debug(message)
-        if name == 'Inflation':
-            inflationStateTime = datetime.now()
-        elif name == 'Deflation':
-            deflationStateTime = datetime.now()
-        elif name == 'LED':
-            warningLightTime = datetime.now()
+        logging.info(message)
+    return metricsServer
+
+
+def startDashboard(rigs: list, prompt: str) -> Dashboard:
+    # This returns None if the dashboard was not asked for, otherwise the console messages go to it until stopDashboard
+    global dashboard
+    if not showDashboard:
+        return None
+    dashboard = Dashboard(rigs, DASHBOARD_REFRESH_INTERVAL, DASHBOARD_MESSAGES, prompt)
+    dashboard.start()
+    logging.info(f'Dashboard started, refreshing every {DASHBOARD_REFRESH_INTERVAL:g} secounds')
+    return dashboard
+
+
+def stopDashboard():
+    # The console messages are printed again once the dashboard has stopped
+    global dashboard
+    if dashboard is None:
+        return
+    dashboard.stop()
+    message = f'Dashboard: redraws = {dashboard.redraws}'
+    dashboard = None
+    print(message)
+    logging.info(message)
+
+
+def showMessage(message: str):
+    # This prints a message from the control path or the telemetry thread, or adds it to the dashboard while it is drawn
+    if dashboard is not None:
+        dashboard.addMessage(message)
     else:
-        pass
+        print(message)
+
+
+def startStream(address: str) -> TelemetryStream:
+    # This returns None if the stream was not asked for, otherwise every sample written by telemetry is also published
+    if address is None:
+        return None
+    stream = TelemetryStream(address, STREAM_HOST, STREAM_MAX_BACKLOG)
+    telemetry.stream = stream
+    stream.start()
+    message = f'Telemetry is streamed on {stream.description}, read it with ecb-stream-client.py'
+    print(message)
+    logging.info(message)
+    return stream
+
+
+def stopStream(stream: TelemetryStream):
+    # This is called after telemetry has stopped, so nothing is published any more
+    if stream is None:
+        return
+    stream.stop()
+    message = f'Telemetry stream: subscribers = {stream.subscribed}, dropped for falling behind = {stream.slowDropped}, frames sent = {stream.framesSent}'
+    print(message)
+    logging.info(message)
+
+
+def startStore(directory: str) -> TelemetryStore:
+    # This returns None if the store was not asked for, otherwise every sample written by telemetry is also appended to it
+    if directory is None:
+        return None
+    store = TelemetryStore(directory, STORE_CHUNK_ROWS)
+    telemetry.store = store
+    message = f'Telemetry is stored in {directory} in chunks of {STORE_CHUNK_ROWS} samples'
+    print(message)
+    logging.info(message)
+    return store
+
+
+def getStoreChunks(directory: str) -> list:
+    # The chunk files of a TelemetryStore in the order they were written
+    return sorted(glob.glob(os.path.join(directory, TelemetryStore.CHUNK_PATTERN.replace('{:06d}', '[0-9]' * 6))))
+
+
+def readStoreIndex(directory: str) -> list:
+    '''
+    This returns the (fileName, chunkRows, count, firstTime, lastTime) of
+    every chunk of a TelemetryStore from the chunk headers. A ValueError is
+    raised if a file is not a chunk this program can read.
+    '''
+    index = list()
+    for fileName in getStoreChunks(directory):
+        with open(fileName, 'rb') as file:
+            magic, version, chunkRows, count, firstTime, lastTime = TelemetryStore.HEADER.unpack(file.read(TelemetryStore.HEADER.size))
+        if magic != TelemetryStore.MAGIC or version != TelemetryStore.VERSION:
+            raise ValueError(f'{fileName} is not a version {TelemetryStore.VERSION} telemetry store chunk')
+        index.append((fileName, chunkRows, count, firstTime, lastTime))
+    return index
+
+
+def readStoreChunks(directory: str, startTime: float = None, endTime: float = None):
+    '''
+    This yields a dictionary of NumPy arrays, one for each of
+    TelemetryStore.COLUMNS, for every chunk that has samples between
+    startTime and endTime. The arrays are read only views of the memory
+    mapped chunk, nothing is copied or parsed. Chunks outside of the range
+    are skipped using the time index in their headers, and the range within
+    a chunk is found with a binary search of its time column.
+    '''
+    for fileName, chunkRows, count, firstTime, lastTime in readStoreIndex(directory):
+        if count == 0 or (startTime is not None and lastTime < startTime) or (endTime is not None and firstTime > endTime):
+            continue
+        chunk = np.memmap(fileName, dtype=np.uint8, mode='r')
+        columns = dict()
+        for (name, typeCode), offset in zip(TelemetryStore.COLUMNS, TelemetryStore.getColumnOffsets(chunkRows)):
+            dtype = np.dtype(typeCode)
+            columns[name] = chunk[offset:offset + dtype.itemsize * count].view(dtype)
+        first = 0 if startTime is None else int(np.searchsorted(columns['time'], startTime, 'left'))
+        last = count if endTime is None else int(np.searchsorted(columns['time'], endTime, 'right'))
+        if first < last:
+            yield {name: column[first:last] for name, column in columns.items()}
+
+
+def loadTelemetryStore(directory: str, startTime: float = None, endTime: float = None) -> dict:
+    # This returns every column between startTime and endTime, the arrays are only copied if the range spans several chunks
+    chunks = list(readStoreChunks(directory, startTime, endTime))
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return {name: np.empty(0, np.dtype(typeCode)) for name, typeCode in TelemetryStore.COLUMNS}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name, _ in TelemetryStore.COLUMNS}
+
+
+def handleDumpSignal(rigs: list):
+    # Sending SIGUSR1 to the program dumps the flight recorder of every rig, this is only on POSIX systems
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+
+    def dumpFlightRecorders(signalNumber, frame):
+        for rig in rigs:
+            rig.flightRecorder.dump('the operator asked for it')
+
+    signal.signal(signal.SIGUSR1, dumpFlightRecorders)
+
+
+def startLogging(fileName: str = 'app.log'):
+    # Calling this again moves the log to fileName
+    global logFileName
+    logFileName = fileName
+    logging.basicConfig(filename=fileName, filemode='a', format='%(name)s - %(levelname)s - %(message)s', level=logging.DEBUG, force=True)
 
 
-def shouldInflate(inflationState:bool, inflationChangeTime:datetime, upstreamPressure:float, downstreamPressure:float, tankPressure:float, deflation:bool) -> bool:
+def startSimulation(seed: int, glitchInterval: float = 0.0):
+    # All channels become stand-ins driven by the simulator on a virtual clock
+    # The telemetry waits for room in its queue instead of dropping, since the simulation does not run in real time
+    global clock
+    global simulator
+    clock = VirtualClock()
+    simulator = Simulator(clock, SIM_STEP, SIM_NOISE, seed, glitchInterval, SIM_GLITCH_DURATION)
+    telemetry.blocking = True
+
+
+def shouldInflate(inflationState:bool, inflationChangeTime:datetime, upstreamPressure:float, downstreamPressure:float, tankPressure:float, deflation:bool, recorder:FlightRecorder=None, profile:ConfigProfile=None) -> bool:
     # This method determine if the inflation should be opened
     '''
-    For inflation the 
+    For inflation, the set pressure comes from the profile, which is defaultProfile if none is given
     If not inflating, following conditions must be met to start inflation:
         1) tankPressure is less then SET_PRESSURE - 1psi
         2) Inflation has been closed for more then three seconds
@@ -240,49 +2984,31 @@ def shouldInflate(inflationState:bool, inflationChangeTime:datetime, upstreamPre
         2) tankPressure >= SET_PRESSURE
         3) upstreamPressure < downstreamPressure + 1
     '''
+    if profile is None:
+        profile = defaultProfile
     if not inflationState:
-        condition1 = tankPressure < SET_PRESSURE - 1.0
-        condition2 = (datetime.now() - inflationChangeTime).total_seconds() > 3.0
+        condition1 = tankPressure < profile.inflationStartPressure
+        condition2 = (clock.now() - inflationChangeTime).total_seconds() > HOLD_OFF_TIMES[0]
         condition3 = not deflation
         condition4 = upstreamPressure > downstreamPressure + 5.0
-        
-        # Print and Log Data
-        if writeVoltageToOutputs:
-            vTank = viTank.getVoltage()
-            psiTank = voltageToPressure(viTank, vTank) 
-            message = f'Upstream = [{upstreamVoltage}Volt, {upstreamPressure}PSI], Downstream = [{downstreamVoltage}Volt, {downstreamPressure}PSI], Tank = [{vTank}Volts, {psiTank}PSI], Calculatede Tank = {tankPressure}'
-            print(message)
-            logMessage = f',{upstreamPressure}, {downstreamPressure}, {tankPressure}, {psiTank}'
-            logging.debug(logMessage)
-        else:
-            message = f'Upstream {upstreamPressure:.2f}, Downstream = {downstreamPressure:.2f}'
-            print(message)
 
+        if recorder is not None:
+            recorder.record('Evaluation to start inflation: (C1 = {} and C2 = {} and C3 = {} and C4 = {}) = {}', condition1, condition2, condition3, condition4, (condition1 and condition2 and condition3 and condition4))
         return condition1 and condition2 and condition3 and condition4
     else:
-        condition1 = (datetime.now() - inflationChangeTime).total_seconds() > 600.0
-        condition2 = tankPressure >= SET_PRESSURE
+        condition1 = (clock.now() - inflationChangeTime).total_seconds() > HOLD_OFF_TIMES[2]
+        condition2 = tankPressure >= profile.setPressure
         condition3 = upstreamPressure < downstreamPressure + 1.0
-        
-        # Print and Log Data
-        if writeVoltageToOutputs:
-            vTank = viTank.getVoltage()
-            psiTank = voltageToPressure(viTank, vTank) 
-            message = f'Upstream = [{upstreamVoltage}Volt, {upstreamPressure}PSI], Downstream = [{downstreamVoltage}Volt, {downstreamPressure}PSI], Tank = [{vTank}Volts, {psiTank}PSI], Calculatede Tank = {tankPressure}'
-            print(message)
-            logMessage = f',{upstreamPressure}, {downstreamPressure}, {tankPressure}, {psiTank}'
-            logging.debug(logMessage)
-        else:
-            message = f'Upstream {upstreamPressure:.2f}, Downstream = {downstreamPressure:.2f}'
-            print(message)
 
+        if recorder is not None:
+            recorder.record('Evaluation to end inflation: (C1 = {} or C2 = {} or C3 = {}) = {}', condition1, condition2, condition3, (condition1 or condition2 or condition3))
         return not (condition1 or condition2 or condition3)
 
 
-def shouldDeflate(deflationState:bool, inflationState:bool, deflationChangeTime:datetime, inflationChangeTime:datetime, tankPressure:float) -> bool:
+def shouldDeflate(deflationState:bool, inflationState:bool, deflationChangeTime:datetime, inflationChangeTime:datetime, tankPressure:float, recorder:FlightRecorder=None, profile:ConfigProfile=None) -> bool:
     # This method determine if the inflation should be opened
     '''
-    For deflation
+    For deflation, the deflation pressures come from the profile, which is defaultProfile if none is given
     If not deflating, the following conditions must be met to start deflation:
         1) tankPressure is greater than DEF_OPEN_PRESSURE
         2) Has been closed for more then 60 seconds
@@ -291,27 +3017,25 @@ def shouldDeflate(deflationState:bool, inflationState:bool, deflationChangeTime:
     Else stop deflating if:
         1) tankPressure <= DEF_CLOSE_PRESSURE
     '''
+    if profile is None:
+        profile = defaultProfile
     if not deflationState:
-        condition1 = tankPressure > DEF_OPEN_PRESSURE
-        condition2 = (datetime.now() - deflationChangeTime).total_seconds() > 60 
+        condition1 = tankPressure > profile.deflationOpenPressure
+        condition2 = (clock.now() - deflationChangeTime).total_seconds() > HOLD_OFF_TIMES[1]
         condition3 = not inflationState
-        condition4 = (datetime.now() - inflationChangeTime).total_seconds() > 60
-        if writeVoltageToOutputs:
-            message = f'Evaluation to start deflation: (C1 = {condition1} and C2 = {condition2} and C3 = {condition3} and C4 = {condition4}) = {(condition1 and condition2 and condition3 and condition4)}'
-            print(message)
-            logging.debug(message)
+        condition4 = (clock.now() - inflationChangeTime).total_seconds() > HOLD_OFF_TIMES[1]
+        if recorder is not None:
+            recorder.record('Evaluation to start deflation: (C1 = {} and C2 = {} and C3 = {} and C4 = {}) = {}', condition1, condition2, condition3, condition4, (condition1 and condition2 and condition3 and condition4))
         return condition1 and condition2 and condition3 and condition4
     else:
-        if writeVoltageToOutputs:
-            message = f'Evaluation to end deflation: (tankPressure({tankPressure}) <= DEF_CLOSE_PRESSURE({DEF_CLOSE_PRESSURE})) = {(tankPressure <= DEF_CLOSE_PRESSURE)}'
-            print(message)
-            logging.debug(message)
-        return not (tankPressure <= DEF_CLOSE_PRESSURE)
+        if recorder is not None:
+            recorder.record('Evaluation to end deflation: (tankPressure({}) <= DEF_CLOSE_PRESSURE({})) = {}', tankPressure, profile.deflationClosePressure, (tankPressure <= profile.deflationClosePressure))
+        return not (tankPressure <= profile.deflationClosePressure)
 
 
-def shouldWarn(warnState:bool, warnTimeChange:datetime, tankPressure:float) -> bool:
+def shouldWarn(warnState:bool, warnTimeChange:datetime, tankPressure:float, pressureHistory:PressureHistory, recorder:FlightRecorder=None, profile:ConfigProfile=None) -> bool:
     '''
-    For warning
+    For warning, the set pressure comes from the profile, which is defaultProfile if none is given
     If not warning, any of the following conditions must be met to start warning:
         1) pressureTank is less then SET_PRESSURE * 0.9
         2) pressureTank has dropped by 1.5psi or more in the last 3sec
@@ -320,208 +3044,878 @@ def shouldWarn(warnState:bool, warnTimeChange:datetime, tankPressure:float) -> b
         2) pressureTank has not dropped by 1.5psi or more in the last 3sec
         3) The warning light has been on for more then 60 sec
     '''
+    if profile is None:
+        profile = defaultProfile
     if not warnState:
-        condition1 = tankPressure < SET_PRESSURE * 0.9
-        condition2 = evaluatePressureDropRate()
+        condition1 = tankPressure < profile.warningPressure
+        condition2 = evaluatePressureDropRate(pressureHistory)
 
-        message = f'Evaluation to start warning (C1({condition1}) or C2({condition2}) = {condition1 or condition2})'
-        print(message)
-        logging.debug(message)
+        if recorder is not None:
+            recorder.record('Evaluation to start warning (C1({}) or C2({}) = {})', condition1, condition2, condition1 or condition2)
         return condition1 or condition2
     else:
-        condition1 = tankPressure > SET_PRESSURE * 0.9
-        condition2 = not evaluatePressureDropRate()
-        condition3 = (datetime.now() - warnTimeChange).total_seconds() > 60
-        
-        message = f'Evaluation to end warning (C1({condition1}) and C2({condition2}) and C3({condition3}) = {condition1 and condition2 and condition3})'
-        print(message)
-        logging.debug(message)
-        return condition1 and condition2 and condition3
+        condition1 = tankPressure > profile.warningPressure
+        condition2 = not evaluatePressureDropRate(pressureHistory)
+        condition3 = (clock.now() - warnTimeChange).total_seconds() > HOLD_OFF_TIMES[1]
 
-
-def writeOutputs(upstream:float, downstream:float, tank:float):
-    try:
-        outUp = digitalOutputs[3]
-        outDown = digitalOutputs[4]
-        outTank = digitalOutputs[5]
-        if upstream > 0.0:
-            outUp.setDutyCycle(upstream / 150.0)
-        else:
-            outUp.setDutyCycle(0.0)
-        if downstream > 0.0:
-            outDown.setDutyCycle(downstream / 150.0)
-        else: 
-            outDown.setDutyCycle(0.0)
-        if outTank > 0.0:
-            outTank.setDutyCycle(tank / 150.0)
-        else:
-            outTank.setDutyCycle(0.0)
-    except:
-        pass
+        if recorder is not None:
+            recorder.record('Evaluation to end warning (C1({}) and C2({}) and C3({}) = {})', condition1, condition2, condition3, condition1 and condition2 and condition3)
+        return not (condition1 and condition2 and condition3)
 
 
-def evaluatePressureDropRate() -> bool:
+def evaluatePressureDropRate(pressureHistory: PressureHistory) -> bool:
     # This returns true if the pressureTank has dropped by 1.5psi or more in the last 3sec
-    global tankPressureLastThreeSecounds
-    global tankPressure
-    # Get current time
-    time = datetime.now()
-    # Find all indexes that are older then three secounds
-    rmvn = list()  # This is the list of indxest that need to be removed
-    n = 0
-    for recordedPressure in tankPressureLastThreeSecounds:
-        if (time - recordedPressure[0]) > 3:
-            rmvn.append(n)
-        n += 1
-    # Remove all indexes that have been identivied
-    for i in sorted(rmvn, reverse=True):
-        del tankPressureLastThreeSecounds[i]
-    # Pull the oldest value
-    oldestPressure = tankPressureLastThreeSecounds[0]
-
     # Return true if the slope of pressure is less then -1.5psi / 3sec
-    actualSlope = (tankPressure - oldestPressure[1]) / (time - oldestPressure[0])
-    return (actualSlope <= -0.5)
+    return pressureHistory.getRate() <= PRESSURE_DROP_RATE
 # endregion Helper Functions -------------------------------------------------
 
 # region Programing Routines -------------------------------------------------
 def main():
-    '''This is the main programing loop that runs continually'''
+    '''
+    This is the main programing loop that runs continually. Every rig is
+    opened on its own worker thread so a rig that does not attach does not
+    hold up the others, then the rigs run until Enter is pressed. With
+    --workers processes each rig is run in a process pool instead.
+    '''
     print(f'Main program has started with arguments: {sys.argv}')
     logging.info(f'Program started at: {datetime.now()} with args: {str(sys.argv)}')
-    
-    try:
-        # Initiate the Phidgets code object
-        viUpstream = VoltageInput()
-        viDownstream = VoltageInput()
-        doInflation = DigitalOutput()
-        doDeflation = DigitalOutput()
-        doLight = DigitalOutput()
 
-        # Add outputs to the list of outputs
-        digitalOutputs.append(doInflation)
-        digitalOutputs.append(doDeflation)
-        digitalOutputs.append(doLight)    
+    if workers == 'processes':
+        runRigPool()
+        print('The main program has been exited')
+        logging.info('Program ended at: ' + str(datetime.now()))
+        return
 
-        # Set Phidgets addressing parameters
-        viUpstream.setHubPort(0)  # Set to VINT port for upstream pressure transducer
-        viUpstream.setIsHubPortDevice(True)
-        viDownstream.setHubPort(1)  # Set to VINT port for downstream pressure transducer
-        viDownstream.setIsHubPortDevice(True)
-        doInflation.setHubPort(2)  # Set the VINT port that the relay is connected to
-        doInflation.setChannel(1)  # Set the channel on the relay module that the Inflation solenoid is connected to
-        doDeflation.setHubPort(2)  # Set the VINT port that the relay is connected to
-        doDeflation.setChannel(2)  # Set the channel on the relay module that the Deflation solenoid is connected to
-        doLight.setHubPort(2)  # Set the VINT port that the relay is connected to
-        doLight.setChannel(0)  # Set the channel on the relay module that the Warning Light is connected to
+    # Start writing telemetry in the background
+    stream = startStream(streamAddress)
+    store = startStore(storeDirectory)
+    telemetry.start()
 
-        # Assign attach/detach handlers
-        viDownstream.setOnAttachHandler(onAttach)
-        viUpstream.setOnAttachHandler(onAttach)
-        doInflation.setOnAttachHandler(onAttach)
-        doDeflation.setOnAttachHandler(onAttach)
-        doLight.setOnAttachHandler(onAttach)
-
-        viDownstream.setOnDetachHandler(onDetach)
-        viUpstream.setOnDetachHandler(onDetach)
-        doInflation.setOnDetachHandler(onDetach)
-        doDeflation.setOnDetachHandler(onDetach)
-        doLight.setOnDetachHandler(onDetach)
-        
-        # Attach the light 
-        doLight.openWaitForAttachment(5000)
-        # Flash light to let user know that the program has started
-        onTimeSec = 0.05
-        offTimeSec = 0.05
-        blinkNumber = 10
-        for n in range(0,blinkNumber):
-            doLight.setState(True)  # Turn on
-            time.sleep(onTimeSec)  # Wait on
-            doLight.setState(False)  # Turn off
-            if n < blinkNumber:
-                time.sleep(offTimeSec)  # Wait off
-
-
-        
-        # Assign the event handlers to react to input changes
-        viUpstream.setOnVoltageChangeHandler(onVoltageChange)
-        viDownstream.setOnVoltageChangeHandler(onVoltageChange)
+    if serialNumbers:
+        rigs = [RoadTestRig(serialNumber) for serialNumber in serialNumbers]
+    else:
+        rigs = [RoadTestRig()]
+    metricsServer = startMetrics(rigs, metricsPort, metricsFile)
+    startRigs(rigs)
+    runningRigs = [rig for rig in rigs if rig.error is None]
+    configWatcher = startConfigWatcher(runningRigs)
 
-        # Create the output voltages. These are for debuging
-        if writeVoltageToOutputs:
-            # Create channels
-            outUpstream = DigitalOutput()
-            outDownstream = DigitalOutput()
-            # Add them to the output list
-            digitalOutputs.append(outUpstream)
-            digitalOutputs.append(outDownstream)
-            # Address
-            outUpstream.setHubPort(3)
-            outDownstream.setHubPort(4)
-            outUpstream.setIsHubPortDevice(True)
-            outDownstream.setIsHubPortDevice(True)
-            # Open
-            outUpstream.openWaitForAttachment(5000)
-            outDownstream.openWaitForAttachment(5000)
+    if runningRigs:
+        prompt = 'Press Enter to Stop, or type dump to save the flight recorders or reload to reload the config and press Enter'
+        # When simulating, run the model for the requested time and then close
+        if benchmarkFile is not None:
+            runBenchmark(runningRigs[0])
+        elif simulator is not None:
+            runSimulation(runningRigs)
+        else:
+            # Program will stall here until the Enter key is pressed on an empty line to close, typing dump saves the flight recorders and reload reloads the config instead
+            handleDumpSignal(runningRigs)
+            if startDashboard(rigs, prompt) is not None:
+                # The dashboard shows the prompt, so input does not print it again
+                prompt = ''
+            else:
+                prompt += '\n'
+            try:
+                while True:
+                    command = input(prompt).strip().lower()
+                    if command == 'dump':
+                        for rig in runningRigs:
+                            rig.flightRecorder.dump('the operator asked for it')
+                    elif command == 'reload':
+                        if configWatcher is not None:
+                            configWatcher.reload()
+                        else:
+                            showMessage('There is no config to reload, use --config to give one')
+                    elif command == '':
+                        break
+                    else:
+                        # A mistyped command must not stop the test
+                        showMessage(f'Unknown command "{command}", press Enter to stop, or type dump or reload')
+            except (Exception, KeyboardInterrupt):
+                stopDashboard()
+                while True:
+                    pass
+            stopDashboard()
 
-            outUpstream.setDutyCycle(0.0)
-            outDownstream.setDutyCycle(0.0)
+    stopConfigWatcher(configWatcher)
+    for rig in rigs:
+        rig.close()
+    for rig in runningRigs:
+        rig.reportFills()
+    if metricsServer is not None:
+        metricsServer.stop()
+    message = f'Native calls per voltage event: average = {nativeCalls.getAveragePerEvent():.2f}, last = {nativeCalls.lastEventCalls}, events = {nativeCalls.events}, channel registry = {USE_CHANNEL_REGISTRY}'
+    print(message)
+    logging.info(message)
+    message = f'Native calls per control cycle: average = {nativeCalls.getAveragePerCycle():.2f}, last = {nativeCalls.lastCycleCalls}, cycles = {nativeCalls.cycles}'
+    print(message)
+    logging.info(message)
+    message = f'Output writes: sent = {outputManager.writes}, skipped = {outputManager.skippedWrites}'
+    print(message)
+    logging.info(message)
+    telemetry.stop()
+    message = f'Telemetry: samples written = {telemetry.written}, dropped = {telemetry.dropped}'
+    print(message)
+    logging.info(message)
+    if store is not None:
+        message = f'Telemetry store: samples written = {store.written}, chunks = {store.chunks}'
+        print(message)
+        logging.info(message)
+    stopStream(stream)
+    if len(rigs) > 1:
+        reportRigs([rig.getSummary() for rig in rigs])
+    print('The main program has been exited')
+    logging.info('Program ended at: ' + str(datetime.now()))
 
-            # Set up port five for the actual tank pressure
-            viTank.setHubPort(5)
-            viTank.setIsHubPortDevice(True)
-            viTank.openWaitForAttachment(5000)
-            viTank.setDataInterval(250)
 
-        # Open channels and wait for attachment
-        doDeflation.openWaitForAttachment(5000)
-        doInflation.openWaitForAttachment(5000)
-        viDownstream.openWaitForAttachment(5000)
-        viUpstream.openWaitForAttachment(5000)
+def startRigs(rigs: list):
+    '''
+    This opens every rig on its own worker thread so a rig that does not
+    attach does not hold up the others. With --fast-start the Phidget
+    Manager is asked which channels are plugged in first, so a rig with a
+    missing device fails at once, and every rig shares one start up deadline.
+    '''
+    startupDeadline = time.monotonic() + STARTUP_DEADLINE
+    if fastStart and simulator is None:
+        for rig, missing in discoverChannels(rigs, startupDeadline).items():
+            if missing:
+                rig.error = f'{", ".join(missing)} not found'
+                message = rig.logPrefix + rig.error
+                print(message)
+                logging.critical(message)
+    threads = [threading.Thread(target=rig.start, args=(startupDeadline,), name=rig.name) for rig in rigs if rig.error is None]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
-        # Set the data sampling interval
-        viUpstream.setDataInterval(250)
-        viDownstream.setDataInterval(250)
 
-        # If we make it to this point in the code, then all channels will have been attached
-        global allChannelsAttached 
-        allChannelsAttached = True
+def discoverChannels(rigs: list, deadline: float) -> dict:
+    '''
+    This uses the Phidget Manager to find the channels that are plugged in
+    without opening any of them. It waits until the channels of every rig
+    have been seen or the deadline, a time.monotonic() time, has passed and
+    returns the names of the channels that were not found for each rig.
+    '''
+    found = set()  # The (serialNumber, hubPort, isHubPortDevice, channel) of every channel the Manager has seen
+    allFound = threading.Event()
+    expected = {rig: rig.getChannelAddresses() for rig in rigs}
 
-        # Make sure program starts with all solenoids closed 
-        solenoidToggle(doDeflation, False)
-        solenoidToggle(doInflation, False)
-        solenoidToggle(doLight, False)
+    def isFound(address: tuple) -> bool:
+        # A serial number of None matches any hub
+        return any(key[1:] == address[1:] and address[0] in (None, key[0]) for key in list(found))
 
-        # Program will stall here until the Enter key is pressed to close
+    def getMissing() -> dict:
+        return {rig: [name for name, address in addresses.items() if not isFound(address)] for rig, addresses in expected.items()}
+
+    def onManagerAttach(manager: Manager, channel: Phidget):
         try:
-            input('Press Enter to Stop\n')
-        except (Exception, KeyboardInterrupt):
-            while True:
-                pass
-    except PhidgetException as ex:
-        traceback.print_exc()
-        message = "PhidgetException " + str(ex.code) + " (" + ex.description + "): " + ex.details
+            found.add((channel.getDeviceSerialNumber(), channel.getHubPort(), channel.getIsHubPortDevice(), channel.getChannel()))
+        except PhidgetException:
+            return
+        if not any(getMissing().values()):
+            allFound.set()
+
+    startTime = time.perf_counter()
+    manager = Manager()
+    manager.setOnAttachHandler(onManagerAttach)
+    manager.open()
+    allFound.wait(max(deadline - time.monotonic(), 0.0))
+    manager.close()
+    message = f'Phidget Manager found {len(found)} channels in {(time.perf_counter() - startTime) * 1000.0:.0f}ms'
+    print(message)
+    logging.info(message)
+    return getMissing()
+
+
+def runRigPool():
+    '''
+    This runs each rig in its own process of a process pool, so a rig that
+    crashes the interpreter or holds the GIL does not effect the others. The
+    processes are spawned, so every worker starts with fresh globals and is
+    given the options it needs. Each rig writes its own telemetry file and
+    sends its summary back when it stops.
+    '''
+    options = {
+        'writeVoltageToOutputs': writeVoltageToOutputs,
+        'controlPeriod': controlPeriod,
+        'dataInterval': dataInterval,
+        'filterMethod': filterMethod,
+        'fastStart': fastStart,
+        'simulationHours': simulationHours,
+        'seed': seed,
+        'tankEstimator': tankEstimator,
+        'evaluationDeadband': evaluationDeadband,
+        'glitchInterval': glitchInterval,
+        'metricsPort': metricsPort,
+        'metricsFile': metricsFile,
+        'streamAddress': streamAddress,
+        'storeDirectory': storeDirectory,
+        'configFile': configFile,
+    }
+    context = multiprocessing.get_context('spawn')
+    summaries = list()
+    with context.Manager() as manager:
+        stopEvent = manager.Event()
+        with concurrent.futures.ProcessPoolExecutor(len(serialNumbers), mp_context=context) as pool:
+            futures = [pool.submit(runRigProcess, serialNumber, index, options, stopEvent) for index, serialNumber in enumerate(serialNumbers)]
+            if simulationHours <= 0.0:
+                # Program will stall here until the Enter key is pressed to close
+                try:
+                    input('Press Enter to Stop\n')
+                except (Exception, KeyboardInterrupt):
+                    pass
+                stopEvent.set()
+            for serialNumber, future in zip(serialNumbers, futures):
+                try:
+                    summaries.append(future.result())
+                except Exception as ex:
+                    # The worker process died, the other rigs are not effected
+                    summaries.append({'name': f'Rig {serialNumber}', 'serialNumber': serialNumber, 'error': f'{type(ex).__name__}: {ex}', 'evaluations': 0, 'inflations': 0, 'tankPressure': 0.0, 'outages': 0, 'outageSeconds': 0.0})
+    reportRigs(summaries)
+
+
+def runRigProcess(serialNumber: int, index: int, options: dict, stopEvent) -> dict:
+    # This runs one rig in a worker process of the pool and returns its summary
+    # The metrics and stream of each worker are served on their own port, counting up from --metrics-port and --stream
+    global telemetry
+    global writeVoltageToOutputs
+    global controlPeriod
+    global dataInterval
+    global filterMethod
+    global fastStart
+    global simulationHours
+    global tankEstimator
+    global evaluationDeadband
+    global flightRecorderFile
+    global configFile
+    startLogging()
+    writeVoltageToOutputs = options['writeVoltageToOutputs']
+    controlPeriod = options['controlPeriod']
+    dataInterval = options['dataInterval']
+    filterMethod = options['filterMethod']
+    fastStart = options['fastStart']
+    simulationHours = options['simulationHours']
+    tankEstimator = options['tankEstimator']
+    evaluationDeadband = options['evaluationDeadband']
+    flightRecorderFile = getRigFileName(FLIGHT_RECORDER_FILE, serialNumber)
+    configFile = options['configFile']
+    telemetry = TelemetryWriter(getRigFileName(TELEMETRY_FILE, serialNumber), TELEMETRY_MAX_BYTES, TELEMETRY_BACKUP_COUNT, TELEMETRY_QUEUE_SIZE, TELEMETRY_BATCH_SIZE, TELEMETRY_PRINT_INTERVAL)
+    if simulationHours > 0.0:
+        # Each worker has its own simulator, so the seed is offset by the rig index or every rig would get the same noise and glitches
+        rigSeed = options['seed'] + index if options['seed'] is not None else None
+        startSimulation(rigSeed, options['glitchInterval'])
+    streamAddress = options['streamAddress']
+    if streamAddress is not None:
+        streamAddress = str(int(streamAddress) + index) if streamAddress.isdigit() else getRigFileName(streamAddress, serialNumber)
+    stream = startStream(streamAddress)
+    startStore(getRigFileName(options['storeDirectory'], serialNumber) if options['storeDirectory'] is not None else None)
+    telemetry.start()
+
+    rig = RoadTestRig(serialNumber)
+    metricsPort = options['metricsPort'] + index if options['metricsPort'] > 0 else 0
+    metricsFile = getRigFileName(options['metricsFile'], serialNumber) if options['metricsFile'] is not None else None
+    metricsServer = startMetrics([rig], metricsPort, metricsFile)
+    startRigs([rig])
+    configWatcher = startConfigWatcher([rig]) if rig.error is None else None
+    if rig.error is None:
+        if simulator is not None:
+            runSimulation([rig])
+        else:
+            # SIGUSR1 sent to a worker process dumps the flight recorder of its rig
+            handleDumpSignal([rig])
+            stopEvent.wait()
+    stopConfigWatcher(configWatcher)
+    rig.close()
+    if rig.error is None:
+        rig.reportFills()
+    if metricsServer is not None:
+        metricsServer.stop()
+    telemetry.stop()
+    stopStream(stream)
+    summary = rig.getSummary()
+    summary['telemetryWritten'] = telemetry.written
+    summary['telemetryDropped'] = telemetry.dropped
+    return summary
+
+
+def reportRigs(summaries: list):
+    # This prints the results of every rig and the totals across all of them
+    for summary in summaries:
+        if summary['error'] is not None:
+            message = f'{summary["name"]}: failed, {summary["error"]}'
+        else:
+            message = f'{summary["name"]}: control evaluations = {summary["evaluations"]} (skipped = {summary["skippedEvaluations"]}), inflations = {summary["inflations"]}, tank pressure = {summary["tankPressure"]:.2f}PSI, outages = {summary["outages"]} ({summary["outageSeconds"]:.1f} secounds)'
+            if 'telemetryWritten' in summary:
+                message += f', telemetry samples written = {summary["telemetryWritten"]}, dropped = {summary["telemetryDropped"]}'
         print(message)
-        logging.critical(message)
-    
-    doLight.close()
-    doDeflation.close()
-    doInflation.close()
-    viDownstream.close()
-    viUpstream.close()
-    print('The main program has been exited')
-    logging.info('Program ended at: ' + str(datetime.now()))
+        logging.info(message)
+    failed = sum(1 for summary in summaries if summary['error'] is not None)
+    message = f'Rigs: ran = {len(summaries) - failed}, failed = {failed}, control evaluations = {sum(summary["evaluations"] for summary in summaries)}, inflations = {sum(summary["inflations"] for summary in summaries)}'
+    print(message)
+    logging.info(message)
+
+
+def runSimulation(rigs: list):
+    # This runs the control logic of every rig against its own pneumatic model for simulationHours of simulated time
+    def runControl():
+        for rig in rigs:
+            rig.runControl()
+
+    for rig in rigs:
+        message = f'{rig.logPrefix}Simulating {simulationHours} hours starting at {simulator.getModel(rig.serialNumber).tire:.2f}PSI'
+        print(message)
+        logging.info(message)
+    startDashboard(rigs, f'Simulating {simulationHours} hours, press Ctrl+C to stop')
+    startTime = time.perf_counter()
+    try:
+        simulator.run(simulationHours * 3600.0, controlPeriod, runControl)
+    finally:
+        stopDashboard()
+    realTime = time.perf_counter() - startTime
+    for rig in rigs:
+        message = f'{rig.logPrefix}Simulated {simulationHours} hours in {realTime:.1f} secounds ({simulationHours * 3600.0 / realTime:.0f}x real time), final tire pressure = {simulator.getModel(rig.serialNumber).tire:.2f}PSI, output writes = {outputManager.writes}'
+        print(message)
+        logging.info(message)
+
+
+def readTelemetryColumns(fileName: str) -> dict:
+    '''
+    This reads a telemetry CSV into NumPy arrays named like the columns of
+    TelemetryStore, so it can be analyzed the same way as a store. The file
+    is parsed in blocks of ANALYSIS_READ_BLOCK bytes by NumPy instead of one
+    row at a time in Python. Files from before the rig column was added are
+    read with a rig of zero.
+    '''
+    blocks = list()
+    with open(fileName, 'rb') as file:
+        file.readline()
+        while True:
+            lines = file.readlines(ANALYSIS_READ_BLOCK)
+            if not lines:
+                break
+            # The relays become numbers and samples without a rig get a rig of zero
+            text = b''.join(lines).replace(b'True', b'1').replace(b'False', b'0').replace(b',\r\n', b',0\r\n')
+            block = np.loadtxt(text.decode('ascii').splitlines(), delimiter=',', ndmin=2)
+            if block.shape[1] == len(TelemetryWriter.HEADER) - 1:
+                block = np.column_stack((block, np.zeros(len(block))))
+            blocks.append(block)
+    values = np.concatenate(blocks) if blocks else np.empty((0, len(TelemetryWriter.HEADER)))
+    columns = {name: values[:, n] for n, name in enumerate(TelemetryWriter.HEADER[:7])}
+    columns['rig'] = values[:, 10].astype(np.uint32)
+    columns['relays'] = (values[:, 7].astype(np.uint8) | (values[:, 8].astype(np.uint8) << 1) | (values[:, 9].astype(np.uint8) << 2))
+    return columns
+
+
+def findEpisodes(active):
+    # This returns the index of the first sample and the index after the last sample of every run of True in active
+    edges = np.diff(active.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def getEpisodeTable(kind: str, times, tankPressure, starts, ends) -> list:
+    # This returns a row of the per cycle table for every episode, an episode still running at the end of the recording ends at the last sample
+    last = np.minimum(ends, len(times) - 1)
+    durations = times[last] - times[starts]
+    return [(kind, float(start), float(end), float(duration), float(startPressure), float(endPressure)) \
+            for start, end, duration, startPressure, endPressure in zip(times[starts], times[last], durations, tankPressure[starts], tankPressure[last])]
+
+
+def getEpisodeSummary(table: list) -> dict:
+    durations = np.array([row[3] for row in table])
+    return {
+        'count': len(table),
+        'totalSeconds': float(durations.sum()) if len(durations) else 0.0,
+        'meanSeconds': float(durations.mean()) if len(durations) else 0.0,
+        'maxSeconds': float(durations.max()) if len(durations) else 0.0,
+    }
+
+
+def getLeakRate(times, tankPressure, relays) -> tuple:
+    '''
+    This returns the leak rate in [PSI/hour] and the number of periods it
+    was measured over. A straight line is fit to the tank pressure of every
+    period where both solenoids stayed closed for ANALYSIS_LEAK_MIN_DURATION
+    secounds after settling, all of them at once with np.add.reduceat, and
+    the slopes are averaged weighted by the length of each period. The times
+    of each period are measured from its own start and summed on their own,
+    so the fit does not lose precision as the recording gets longer.
+    '''
+    starts, ends = findEpisodes((relays & 3) == 0)
+    starts = np.searchsorted(times, times[starts] + ANALYSIS_LEAK_SETTLE)
+    keep = (ends - starts > 2) & (times[np.minimum(ends, len(times)) - 1] - times[np.minimum(starts, len(times) - 1)] >= ANALYSIS_LEAK_MIN_DURATION)
+    starts = starts[keep]
+    ends = ends[keep]
+    if len(starts) == 0:
+        return 0.0, 0
+    # Gather the samples of every period one after another, each timed from the start of its period
+    counts = ends - starts
+    offsets = np.cumsum(counts) - counts  # Where each period starts in the gathered samples
+    periods = np.repeat(np.arange(len(starts)), counts)
+    samples = np.arange(counts.sum()) - offsets[periods] + starts[periods]
+    x = times[samples] - times[starts][periods]
+    y = tankPressure[samples]
+    sumX, sumY, sumXX, sumXY = [np.add.reduceat(values, offsets) for values in (x, y, x * x, x * y)]
+    slopes = (counts * sumXY - sumX * sumY) / (counts * sumXX - sumX * sumX)
+    durations = times[ends - 1] - times[starts]
+    return float(-np.average(slopes, weights=durations) * 3600.0), len(starts)
+
+
+def analyzeTelemetry(columns: dict) -> tuple:
+    '''
+    This returns the summary and the per cycle table of one rig from its
+    telemetry columns. Every result is worked out with whole array NumPy
+    operations, there is no Python loop over the samples. Samples where
+    either pressure is zero are left out, like the control path does, and
+    (None, []) is returned if no samples are left.
+    '''
+    # Samples from before both transducers report would count as time at zero pressure
+    valid = (columns['upstreamPressure'] != 0.0) & (columns['downstreamPressure'] != 0.0)
+    if not valid.any():
+        return None, list()
+    if not valid.all():
+        columns = {name: values[valid] for name, values in columns.items()}
+    times = columns['time']
+    tankPressure = columns['tankPressure']
+    actualTankPressure = columns['actualTankPressure']
+    relays = columns['relays']
+    intervals = np.diff(times)
+    summary = {
+        'samples': len(times),
+        'start': float(times[0]),
+        'hours': float(times[-1] - times[0]) / 3600.0,
+        'meanTankPressure': float(tankPressure.mean()),
+        'minTankPressure': float(tankPressure.min()),
+        'maxTankPressure': float(tankPressure.max()),
+    }
+    lowSeconds = float(intervals[tankPressure[:-1] < ANALYSIS_LOW_PRESSURE].sum())
+    summary['lowPressureThreshold'] = ANALYSIS_LOW_PRESSURE
+    summary['lowPressureSeconds'] = lowSeconds
+    summary['lowPressurePercent'] = 100.0 * lowSeconds / max(float(times[-1] - times[0]), 1e-9)
+    summary['leakRate'], summary['leakPeriods'] = getLeakRate(times, tankPressure, relays)
+
+    # The actual tank pressure is only recorded when the debug channels are used
+    measured = actualTankPressure != 0.0
+    if measured.any():
+        error = tankPressure[measured] - actualTankPressure[measured]
+        absoluteError = np.abs(error)
+        summary['estimateError'] = {
+            'samples': int(measured.sum()),
+            'mean': float(error.mean()),
+            'rms': float(np.sqrt(np.mean(error * error))),
+            'p95': float(np.percentile(absoluteError, 95.0)),
+            'max': float(absoluteError.max()),
+        }
+    else:
+        summary['estimateError'] = None
+
+    cycles = list()
+    for kind, bit in (('inflation', 1), ('deflation', 2), ('light', 4)):
+        starts, ends = findEpisodes((relays & bit) != 0)
+        table = getEpisodeTable(kind, times, tankPressure, starts, ends)
+        summary[kind] = getEpisodeSummary(table)
+        cycles.extend(table)
+    cycles.sort(key=lambda row: row[1])
+    return summary, cycles
+
+
+def formatAnalysis(name: str, summary: dict) -> list:
+    # This returns the lines of the printed report of one rig
+    lines = [
+        f'{name}: {summary["samples"]} samples over {summary["hours"]:.2f} hours, tank pressure mean = {summary["meanTankPressure"]:.2f}PSI, min = {summary["minTankPressure"]:.2f}PSI, max = {summary["maxTankPressure"]:.2f}PSI',
+        f'{name}: leak rate = {summary["leakRate"]:.3f}PSI/hour over {summary["leakPeriods"]} periods with the solenoids closed',
+        f'{name}: below {summary["lowPressureThreshold"]:.1f}PSI for {summary["lowPressureSeconds"]:.0f} secounds ({summary["lowPressurePercent"]:.2f}% of the test)',
+    ]
+    for kind in ('inflation', 'deflation', 'light'):
+        episodes = summary[kind]
+        label = 'warning light episodes' if kind == 'light' else f'{kind} cycles'
+        lines.append(f'{name}: {label} = {episodes["count"]}, total = {episodes["totalSeconds"]:.0f} secounds, mean = {episodes["meanSeconds"]:.2f} secounds, longest = {episodes["maxSeconds"]:.2f} secounds')
+    error = summary['estimateError']
+    if error is None:
+        lines.append(f'{name}: tank pressure estimate error = not recorded, run with the debug channels to measure the actual tank pressure')
+    else:
+        lines.append(f'{name}: tank pressure estimate error over {error["samples"]} samples: mean = {error["mean"]:.3f}PSI, rms = {error["rms"]:.3f}PSI, p95 = {error["p95"]:.3f}PSI, max = {error["max"]:.3f}PSI')
+    return lines
+
+
+def getPercentile(sortedValues: list, percent: float) -> float:
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(int(len(sortedValues) * percent / 100.0), len(sortedValues) - 1)]
+
+
+def getLogBytes() -> int:
+    # This returns the number of bytes in the log and the telemetry file
+    total = 0
+    for fileName in (logFileName, telemetry.fileName):
+        if os.path.exists(fileName):
+            total += os.path.getsize(fileName)
+    return total
+
+
+def measureEventRate(rig: RoadTestRig, rate: int) -> dict:
+    # This fires voltage change events at the given real time rate and checks if the control path keeps up
+    period = 1.0 / rate
+    inputs = [voltageInput for voltageInput in simulator.inputs if voltageInput.attached and voltageInput.voltageChangeHandler is not None]
+    count = max(int(rate * BENCHMARK_RATE_DURATION), len(inputs))
+    nextControlTime = clock.monotonic()
+    dropped = telemetry.dropped
+    startTime = time.perf_counter()
+    for n in range(count):
+        scheduledTime = startTime + n * period
+        delay = scheduledTime - time.perf_counter()
+        if delay > 0.002:
+            time.sleep(delay - 0.001)
+        while time.perf_counter() < scheduledTime:
+            pass
+        clock.advance(period)
+        simulator.stepModels(period)
+        voltageInput = inputs[n % len(inputs)]
+        voltageInput.voltageChangeHandler(voltageInput, voltageInput.getVoltage())
+        if controlPeriod > 0.0 and clock.monotonic() >= nextControlTime:
+            nextControlTime += controlPeriod
+            rig.runControl()
+    endTime = time.perf_counter()
+    lag = endTime - (startTime + count * period)
+    telemetry.flush()
+    dropped = telemetry.dropped - dropped
+    return {
+        'rate': rate,
+        'achievedRate': count / (endTime - startTime),
+        'lagSec': max(lag, 0.0),
+        'telemetryDropped': dropped,
+        'sustained': lag <= BENCHMARK_MAX_LAG and dropped == 0,
+    }
+
+
+def runBenchmark(rig: RoadTestRig):
+    '''
+    This measures the control path of the rig against the simulated channels
+    and writes the results to benchmarkFile as JSON. If the file already has
+    results from an earlier run the change in each measurement is printed
+    first.
+    '''
+    message = f'Benchmark started: data interval = {dataInterval}ms, control period = {controlPeriod}sec'
+    print(message)
+    logging.info(message)
+    results = {
+        'time': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataInterval': dataInterval,
+        'controlPeriod': controlPeriod,
+        'minDataInterval': min(voltageInput.getMinDataInterval() for voltageInput in simulator.inputs),
+    }
+
+    # Latency of each voltage change event and the log bytes written for it
+    latencies = list()
+    nativeCallsBefore = nativeCalls.calls
+    logBytes = getLogBytes()
+    simulator.run(BENCHMARK_DURATION, controlPeriod, rig.runControl, latencies)
+    telemetry.flush()
+    logBytes = getLogBytes() - logBytes
+    latencies.sort()
+    events = len(latencies)
+    results['events'] = events
+    results['latencyUs'] = {
+        'mean': sum(latencies) / events * 1e6 if events else 0.0,
+        'p50': getPercentile(latencies, 50.0) * 1e6,
+        'p99': getPercentile(latencies, 99.0) * 1e6,
+        'max': latencies[-1] * 1e6 if events else 0.0,
+    }
+    results['logBytesPerEvent'] = logBytes / events if events else 0.0
+    results['nativeCallsPerEvent'] = (nativeCalls.calls - nativeCallsBefore) / events if events else 0.0
+
+    # Memory allocated by the control path, the telemetry is flushed first so queued samples are not counted
+    latencies = list()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    simulator.run(BENCHMARK_ALLOCATION_DURATION, controlPeriod, rig.runControl, latencies)
+    telemetry.flush()
+    tracedBytes, tracedPeakBytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    events = len(latencies)
+    results['netAllocatedBlocksPerEvent'] = (sys.getallocatedblocks() - blocks) / events if events else 0.0
+    results['tracedBytesPerEvent'] = tracedBytes / events if events else 0.0
+    results['tracedPeakBytes'] = tracedPeakBytes
+
+    # Highest real time event rate the control path keeps up with
+    telemetry.blocking = False
+    sweep = list()
+    rate = BENCHMARK_START_RATE
+    maxSustainedRate = 0
+    while rate <= BENCHMARK_MAX_RATE:
+        result = measureEventRate(rig, rate)
+        sweep.append(result)
+        print(f'Event rate {rate}/sec: achieved = {result["achievedRate"]:.0f}/sec, lag = {result["lagSec"]:.3f}sec, dropped = {result["telemetryDropped"]}')
+        if not result['sustained']:
+            break
+        maxSustainedRate = rate
+        rate *= 2
+    telemetry.blocking = True
+    results['rateSweep'] = sweep
+    results['maxSustainedRate'] = maxSustainedRate
+
+    # Compare with the last results before they are overwritten
+    if os.path.exists(benchmarkFile):
+        try:
+            with open(benchmarkFile) as file:
+                previous = json.load(file)
+            for name, value, old in [
+                    ('p50 latency [us]', results['latencyUs']['p50'], previous['latencyUs']['p50']),
+                    ('p99 latency [us]', results['latencyUs']['p99'], previous['latencyUs']['p99']),
+                    ('max latency [us]', results['latencyUs']['max'], previous['latencyUs']['max']),
+                    ('log bytes per event', results['logBytesPerEvent'], previous['logBytesPerEvent']),
+                    ('max sustained rate [events/sec]', results['maxSustainedRate'], previous['maxSustainedRate'])]:
+                print(f'{name}: {old:.1f} -> {value:.1f}')
+        except (ValueError, KeyError) as ex:
+            print(f'Could not compare with the previous results in {benchmarkFile}: {ex}')
+    with open(benchmarkFile, 'w') as file:
+        json.dump(results, file, indent=2)
+    message = f'Benchmark: p50 = {results["latencyUs"]["p50"]:.1f}us, p99 = {results["latencyUs"]["p99"]:.1f}us, max = {results["latencyUs"]["max"]:.1f}us, log bytes per event = {results["logBytesPerEvent"]:.1f}, max sustained rate = {maxSustainedRate}/sec, results written to {benchmarkFile}'
+    print(message)
+    logging.info(message)
+
+
+def runReplay():
+    '''
+    This streams a recorded telemetry file or log through runControl as fast
+    as possible and reports where the replayed decisions differ from the
+    recorded ones. The relays are stand-ins, and after each sample they are
+    set back to the recorded states so every decision is judged from the
+    same starting point as the original run. The hold off timers only follow
+    the recorded relay changes, so one decision that differs does not move
+    the timers of all the ones after it. The recorded times are not precise
+    enough to tell if a sample exactly PRESSURE_DROP_WINDOW old was still in
+    the drop rate window, so the warning light can differ there. This only
+    happens in simulated recordings, where the samples fall on an exact grid.
+    If a --serial is given only that rig is replayed from a telemetry file
+    holding several rigs.
+    '''
+    global clock
+    print(f'Replaying {replayFile}')
+    logging.info(f'Replay of {replayFile} started at: {datetime.now()}')
+    serialNumber = serialNumbers[0] if serialNumbers else None
+    sampleInterval = dataInterval / 2000.0  # The old program logged on both transducer events
+    records = readRecording(replayFile, sampleInterval, serialNumber)
+    first = next(records, None)
+    if first is None:
+        print('No samples were found to replay')
+        return
+
+    # The timers of the original run started when its rig was made, a start up blink and part of a data interval before its first sample
+    clock = VirtualClock(first[0] - BLINK_COUNT * (BLINK_ON_TIME + BLINK_OFF_TIME) - sampleInterval)
+    rig = RoadTestRig(serialNumber)
+
+    # Create stand-in relays addressed like the real ones
+    outputs = list()
+    for channel in (1, 2, 0):
+        do = SimulatedDigitalOutput(None)
+        do.setHubPort(2)
+        do.setChannel(channel)
+        do.setOnAttachHandler(rig.onAttach)
+        do.open()
+        outputs.append(do)
+        rig.digitalOutputs.append(do)
+    names = [rig.getChannelInfo(do).name for do in outputs]
+    for do, state in zip(outputs, first[7:10]):
+        outputManager.setState(do, state)
+    telemetry.enabled = False
+    rig.allChannelsAttached = True
+
+    events = 0
+    differences = [0, 0, 0]
+    reported = 0
+    previous = first[7:10]  # The recorded relay states of the sample before
+    startTime = time.perf_counter()
+    for record in itertools.chain([first], records):
+        clock.setTime(record[0])
+        rig.latestSamples.upstream = (clock.monotonic(), record[1], record[3])
+        rig.latestSamples.downstream = (clock.monotonic(), record[2], record[4])
+        timers = (rig.inflationStateTime, rig.deflationStateTime, rig.warningLightTime)
+        rig.runControl()
+        events += 1
+        # Each timer restarts only where the recorded relay changed, whatever the replayed decision was
+        rig.inflationStateTime, rig.deflationStateTime, rig.warningLightTime = \
+            (clock.now() if record[7 + n] != previous[n] else timers[n] for n in range(3))
+        previous = record[7:10]
+        # Compare the replayed decisions to the recorded ones, then put the relays back to the recorded states
+        for n in range(3):
+            recorded = record[7 + n]
+            if outputManager.getState(outputs[n]) != recorded:
+                differences[n] += 1
+                if reported < REPLAY_MAX_REPORTED:
+                    reported += 1
+                    message = f'Difference at {record[0] - first[0]:.2f}sec: {names[n]} recorded = {recorded}, replayed = {not recorded} : [tankPressure = {rig.tankPressure:.2f}, upstreamPressure = {record[3]:.2f}, downstreamPressure = {record[4]:.2f}]'
+                    print(message)
+                    logging.info(message)
+                # This goes around solenoidToggle so the timers and counters are not changed
+                outputManager.setState(outputs[n], recorded)
+    realTime = time.perf_counter() - startTime
+
+    message = f'Replayed {events} samples in {realTime:.2f} secounds ({events / realTime if realTime > 0.0 else 0.0:.0f} events/sec), ' + \
+        ', '.join(f'{name} differences = {count}' for name, count in zip(names, differences))
+    print(message)
+    logging.info(message)
+
+
+def runAnalysis():
+    '''
+    This analyzes a recorded test, either a --store directory or a telemetry
+    CSV, and prints a report for every rig in it. A store is loaded without
+    copying, so even gigabytes of samples are analyzed in secounds. With
+    --cycles every inflation, deflation and warning light episode is written
+    to a CSV table and with --report the summaries are written to JSON. If
+    a --serial is given only that rig is analyzed.
+    '''
+    print(f'Analyzing {analysisSource}')
+    logging.info(f'Analysis of {analysisSource} started at: {datetime.now()}')
+    startTime = time.perf_counter()
+    if os.path.isdir(analysisSource):
+        columns = loadTelemetryStore(analysisSource)
+    else:
+        columns = readTelemetryColumns(analysisSource)
+    loadTime = time.perf_counter() - startTime
+    if len(columns['time']) == 0:
+        print('No samples were found to analyze')
+        return
+
+    report = dict()
+    cycles = list()
+    rigs = np.unique(columns['rig'])
+    for rigNumber in rigs:
+        rigNumber = int(rigNumber)
+        if serialNumbers and rigNumber not in serialNumbers:
+            continue
+        if len(rigs) > 1:
+            rigColumns = {name: values[columns['rig'] == rigNumber] for name, values in columns.items()}
+        else:
+            rigColumns = columns
+        name = f'Rig {rigNumber}' if rigNumber else 'Rig'
+        summary, rigCycles = analyzeTelemetry(rigColumns)
+        if summary is None:
+            message = f'{name}: no samples with both pressures to analyze'
+            print(message)
+            logging.info(message)
+            continue
+        report[name] = summary
+        cycles.extend((rigNumber,) + row for row in rigCycles)
+        for message in formatAnalysis(name, summary):
+            print(message)
+            logging.info(message)
+    analysisTime = time.perf_counter() - startTime - loadTime
+    message = f'Analyzed {len(columns["time"])} samples: loaded in {loadTime:.2f} secounds, analyzed in {analysisTime:.2f} secounds'
+    print(message)
+    logging.info(message)
+
+    if cyclesFile is not None:
+        with open(cyclesFile, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['rig', 'kind', 'start', 'end', 'duration', 'startTankPressure', 'endTankPressure'])
+            writer.writerows(cycles)
+        print(f'{len(cycles)} cycles written to {cyclesFile}')
+    if reportFile is not None:
+        with open(reportFile, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Report written to {reportFile}')
 # endregion Programing Routines ----------------------------------------------
 
 
 
 # Program Start Point
-logging.basicConfig(filename='app.log', filemode='a', format='%(name)s - %(levelname)s - %(message)s', level=logging.DEBUG)
+if __name__ == '__main__':
+    startLogging()
 
-if len(sys.argv) > 1:
-    writeVoltageToOutputs = sys.argv[1]
-    print(writeVoltageToOutputs)
+    parser = argparse.ArgumentParser(description='Controls the tire pressure of an ECB road test rig')
+    parser.add_argument('writeVoltageToOutputs', nargs='?', default=None, help='pass True to write the pressures to the extra VINT ports and monitor the actual tank pressure')
+    parser.add_argument('--control-period', type=float, default=0.0, help='run the control logic every this many secounds on its own thread instead of on every sample')
+    parser.add_argument('--data-interval', type=int, default=250, help='transducer data interval in [ms]')
+    parser.add_argument('--simulate', type=float, default=0.0, metavar='HOURS', help='run against simulated channels and a pneumatic tire model for this many hours of simulated time')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for the simulated transducer noise, with --workers processes each rig adds its index to it')
+    parser.add_argument('--glitch-interval', type=float, default=0.0, metavar='SECONDS', help=f'when simulating, detach a random channel for {SIM_GLITCH_DURATION:g} secounds about this often to test the detach recovery')
+    parser.add_argument('--deadband', type=float, default=0.0, metavar='PSI', help='skip the decisions while the pressures stay within this many PSI of the last evaluation and no hold off timer expires')
+    parser.add_argument('--estimator', choices=('fixed', 'rls'), default='fixed', help='estimate the tank pressure during a fill with the fixed correction constants or fit them online with recursive least squares')
+    parser.add_argument('--replay', metavar='FILE', default=None, help='replay a telemetry CSV or app.log through the control logic and compare the decisions')
+    parser.add_argument('--analyze', metavar='SOURCE', default=None, help='analyze a --store directory or telemetry CSV with NumPy and print a report for every rig')
+    parser.add_argument('--cycles', metavar='FILE', default=None, help='with --analyze, write every inflation, deflation and warning light episode to this CSV file')
+    parser.add_argument('--report', metavar='FILE', default=None, help='with --analyze, write the summary of every rig to this JSON file')
+    parser.add_argument('--filter', choices=BlockFilter.METHODS, default=None, help='sample the transducers at their fastest data interval and filter them in blocks with NumPy')
+    parser.add_argument('--benchmark', metavar='FILE', default=None, help='measure the control path against simulated channels and write the results to this JSON file')
+    parser.add_argument('--serial', type=int, action='append', default=list(), metavar='SERIAL', help='serial number of the VINT hub of a rig, repeat to run several rigs')
+    parser.add_argument('--metrics-port', type=int, default=0, metavar='PORT', help='serve the metrics of every rig in the Prometheus text format on this local port')
+    parser.add_argument('--metrics-json', metavar='FILE', default=None, help=f'write the metrics of every rig to this JSON file every {METRICS_SNAPSHOT_INTERVAL:g} secounds')
+    parser.add_argument('--store', metavar='DIRECTORY', default=None, help='also append every sample to a memory mapped columnar store in this directory, it can be loaded with loadTelemetryStore')
+    parser.add_argument('--stream', metavar='ADDRESS', default=None, help='publish every sample and relay change as binary frames on this local port or Unix socket path')
+    parser.add_argument('--fast-start', action='store_true', help=f'find the channels with the Phidget Manager and open them all at once, every rig must attach within {STARTUP_DEADLINE:g} secounds')
+    parser.add_argument('--workers', choices=('threads', 'processes'), default='threads', help='run every rig in this process or each rig in its own process of a pool')
+    parser.add_argument('--config', metavar='FILE', default=None, help='read the set pressures, calibration and correction constants of every rig from this JSON or TOML file and reload them whenever it changes')
+    parser.add_argument('--dashboard', action='store_true', help=f'show a live dashboard of every rig, redrawn every {DASHBOARD_REFRESH_INTERVAL:g} secounds, instead of printing a line per event')
+    args = parser.parse_args()
+    writeVoltageToOutputs = args.writeVoltageToOutputs is not None and args.writeVoltageToOutputs.lower() not in ('false', '0', 'no')
+    controlPeriod = args.control_period
+    dataInterval = args.data_interval
+    replayFile = args.replay
+    analysisSource = args.analyze
+    cyclesFile = args.cycles
+    reportFile = args.report
+    benchmarkFile = args.benchmark
+    filterMethod = args.filter
+    simulationHours = args.simulate
+    seed = args.seed
+    tankEstimator = args.estimator
+    evaluationDeadband = args.deadband
+    glitchInterval = args.glitch_interval
+    serialNumbers = args.serial
+    workers = args.workers
+    fastStart = args.fast_start
+    showDashboard = args.dashboard
+    configFile = args.config
+    metricsPort = args.metrics_port
+    metricsFile = args.metrics_json
+    streamAddress = args.stream
+    storeDirectory = args.store
+    if filterMethod is not None and np is None:
+        parser.error('--filter needs NumPy, install it with: pip install numpy')
+    if analysisSource is not None and np is None:
+        parser.error('--analyze needs NumPy, install it with: pip install numpy')
+    if (cyclesFile is not None or reportFile is not None) and analysisSource is None:
+        parser.error('--cycles and --report can only be used with --analyze')
+    if len(set(serialNumbers)) != len(serialNumbers):
+        parser.error('each --serial can only be given once')
+    if configFile is not None:
+        # Every rig must start with a valid profile, a bad file later on is only reported
+        try:
+            for serialNumber in serialNumbers or [None]:
+                readConfigProfile(configFile, serialNumber)
+        except (OSError, ValueError) as ex:
+            parser.error(f'--config {configFile}: {ex}')
+    if replayFile is not None and len(serialNumbers) > 1:
+        parser.error('--replay can only replay one rig')
+    if workers == 'processes':
+        # The worker processes start their own simulations
+        if not serialNumbers:
+            parser.error('--workers processes needs the --serial of every rig')
+        if benchmarkFile is not None:
+            parser.error('--benchmark can not be used with --workers processes')
+        if showDashboard:
+            parser.error('--dashboard can not be used with --workers processes, the rigs are in other processes')
+    elif simulationHours > 0.0 or benchmarkFile is not None:
+        if benchmarkFile is not None:
+            # The synthetic events of the benchmark are kept out of the logs and telemetry of real tests in the working directory
+            benchmarkDirectory = tempfile.mkdtemp(prefix='ecb-benchmark-')
+            startLogging(os.path.join(benchmarkDirectory, 'app.log'))
+            telemetry = TelemetryWriter(os.path.join(benchmarkDirectory, TELEMETRY_FILE), TELEMETRY_MAX_BYTES, TELEMETRY_BACKUP_COUNT, TELEMETRY_QUEUE_SIZE, TELEMETRY_BATCH_SIZE, TELEMETRY_PRINT_INTERVAL)
+            flightRecorderFile = os.path.join(benchmarkDirectory, FLIGHT_RECORDER_FILE)
+            print(f'The benchmark log, telemetry and flight recorder are written to {benchmarkDirectory}')
+        startSimulation(seed, glitchInterval)
+    if args.writeVoltageToOutputs is not None:
+        print(writeVoltageToOutputs)
 
-# Call the main program
-main()
-# Program End
\ No newline at end of file
+    # Call the main program
+    if replayFile is not None:
+        runReplay()
+    elif analysisSource is not None:
+        runAnalysis()
+    else:
+        main()
+# Program End
@@ -0,0 +1,115 @@
+#!usr/bin/python3
+
+# region Imports -------------------------------------------------------------
+import socket
+import struct
+import sys
+import argparse
+import csv
+# endregion End Imports ------------------------------------------------------
+
+# region Global Variables ----------------------------------------------------
+# These must match TelemetryStream in ecb-road-test.py
+MAGIC = b'ECBT'
+VERSION = 1
+HEADER = struct.Struct('<4sBH')
+FRAME = struct.Struct('<BBxxIddddddd')
+KINDS = ('sample', 'relay', 'detached', 'resumed')  # The name of each frame kind
+STREAM_HOST = '127.0.0.1'  # The road test program only listens on this address
+
+CSV_HEADER = ('kind', 'rig', 'monotonic', 'upstreamVoltage', 'downstreamVoltage', 'upstreamPressure', 'downstreamPressure', 'tankPressure', 'actualTankPressure', 'inflation', 'deflation', 'light')
+# endregion Global Variables -------------------------------------------------
+
+# region Helper Functions ----------------------------------------------------
+def connect(address: str) -> socket.socket:
+    # A digit string is a port on STREAM_HOST, anything else is the path of a Unix socket
+    if address.isdigit():
+        return socket.create_connection((STREAM_HOST, int(address)))
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(address)
+    return connection
+
+
+def readExactly(connection: socket.socket, size: int) -> bytes:
+    # This returns fewer than size bytes only if the road test program closed the stream
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+def readHeader(connection: socket.socket):
+    # This raises a ValueError if the other end is not a telemetry stream this client can read
+    data = readExactly(connection, HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError('the stream closed before its header was sent')
+    magic, version, frameSize = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError(f'not a telemetry stream, the header starts with {magic!r}')
+    if version != VERSION or frameSize != FRAME.size:
+        raise ValueError(f'stream version {version} with {frameSize} byte frames is not supported, expected version {VERSION} with {FRAME.size} byte frames')
+
+
+def decodeFrame(data: bytes) -> tuple:
+    # This returns a row in the order of CSV_HEADER
+    kind, relays, serialNumber, monotonic, *values = FRAME.unpack(data)
+    kindName = KINDS[kind] if kind < len(KINDS) else str(kind)
+    return (kindName, serialNumber, monotonic, *values, bool(relays & 1), bool(relays & 2), bool(relays & 4))
+
+
+def formatFrame(row: tuple) -> str:
+    kind, serialNumber, monotonic, upstreamVoltage, downstreamVoltage, upstreamPressure, downstreamPressure, tankPressure, actualTankPressure, inflation, deflation, light = row
+    rig = f'[{serialNumber}] ' if serialNumber else ''
+    return f'{rig}{monotonic:.3f} {kind}: upstream = {upstreamPressure:.2f}PSI ({upstreamVoltage:.3f}V), downstream = {downstreamPressure:.2f}PSI ({downstreamVoltage:.3f}V), ' + \
+        f'tank = {tankPressure:.2f}PSI, actual tank = {actualTankPressure:.2f}PSI, inflation = {inflation}, deflation = {deflation}, light = {light}'
+# endregion Helper Functions -------------------------------------------------
+
+# region Programing Routines -------------------------------------------------
+def main(address: str, writeCsv: bool, kinds: set):
+    '''
+    This connects to the telemetry stream of a running ecb-road-test.py and
+    prints every frame until the stream closes. The road test program drops
+    a client that falls too far behind, so the output should be redirected
+    to a file instead of scrolled through when the rig runs at a high rate.
+    '''
+    connection = connect(address)
+    readHeader(connection)
+    writer = None
+    if writeCsv:
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(CSV_HEADER)
+    while True:
+        data = readExactly(connection, FRAME.size)
+        if len(data) < FRAME.size:
+            break
+        row = decodeFrame(data)
+        if kinds and row[0] not in kinds:
+            continue
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            print(formatFrame(row))
+    connection.close()
+    print('The telemetry stream has closed', file=sys.stderr)
+# endregion Programing Routines ----------------------------------------------
+
+
+
+# Program Start Point
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read the binary telemetry stream of ecb-road-test.py --stream')
+    parser.add_argument('address', help='the port or Unix socket path given to --stream')
+    parser.add_argument('--csv', action='store_true', help='write the frames to stdout as CSV')
+    parser.add_argument('--kind', choices=KINDS, action='append', default=list(), help='only show frames of this kind, repeat to show several kinds')
+    args = parser.parse_args()
+    try:
+        main(args.address, args.csv, set(args.kind))
+    except (OSError, ValueError) as ex:
+        print(f'Could not read the telemetry stream at {args.address}: {ex}', file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+# Program End
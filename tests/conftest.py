@@ -0,0 +1,41 @@
+import importlib.util
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loadScript(fileName: str, moduleName: str):
+    # The scripts have dashes in their names, so they are loaded from their paths instead of imported
+    spec = importlib.util.spec_from_file_location(moduleName, os.path.join(ROOT, fileName))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def ecb():
+    return loadScript('ecb-road-test.py', 'ecb_road_test')
+
+
+@pytest.fixture(scope='session')
+def streamClient():
+    return loadScript('ecb-stream-client.py', 'ecb_stream_client')
+
+
+@pytest.fixture
+def simulation(ecb, monkeypatch, tmp_path):
+    '''
+    Starts a simulation like --simulate does, with its own outputs, no
+    telemetry and the flight recorder in tmp_path. The globals of the
+    program are put back when the test is done.
+    '''
+    for name in ('clock', 'simulator', 'telemetry'):
+        monkeypatch.setattr(ecb, name, getattr(ecb, name))
+    monkeypatch.setattr(ecb, 'outputManager', ecb.OutputManager())
+    monkeypatch.setattr(ecb, 'flightRecorderFile', str(tmp_path / ecb.FLIGHT_RECORDER_FILE))
+    ecb.telemetry = ecb.TelemetryWriter(str(tmp_path / ecb.TELEMETRY_FILE), ecb.TELEMETRY_MAX_BYTES, ecb.TELEMETRY_BACKUP_COUNT, ecb.TELEMETRY_QUEUE_SIZE, ecb.TELEMETRY_BATCH_SIZE, ecb.TELEMETRY_PRINT_INTERVAL)
+    ecb.telemetry.enabled = False
+    ecb.startSimulation(1)
+    return ecb.simulator
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+
+def makeColumns(times, tankPressure, relays) -> dict:
+    count = len(times)
+    return {
+        'time': np.asarray(times, dtype=float),
+        'upstreamVoltage': np.full(count, 3.7),
+        'downstreamVoltage': np.full(count, 2.8),
+        'upstreamPressure': np.full(count, 125.0),
+        'downstreamPressure': np.asarray(tankPressure, dtype=float),
+        'tankPressure': np.asarray(tankPressure, dtype=float),
+        'actualTankPressure': np.zeros(count),
+        'rig': np.zeros(count, dtype=np.int32),
+        'relays': np.asarray(relays, dtype=np.uint8),
+    }
+
+
+def testLeakRateOfOnePeriod(ecb):
+    times = np.arange(0.0, 600.0, 0.25)
+    # The pressure after the settling time falls by 2PSI/hour
+    tankPressure = 103.0 - 2.0 * times / 3600.0
+    tankPressure[times < ecb.ANALYSIS_LEAK_SETTLE] += 0.5
+    rate, periods = ecb.getLeakRate(times, tankPressure, np.zeros(len(times), dtype=np.uint8))
+    assert periods == 1
+    assert rate == pytest.approx(2.0)
+
+
+def testLeakRateIsWeightedByDuration(ecb):
+    times = np.arange(0.0, 900.0, 1.0)
+    relays = np.zeros(len(times), dtype=np.uint8)
+    relays[300:320] = 1  # A fill splits the recording into periods of 290 and 570 secounds after settling
+    tankPressure = np.where(times < 300.0, 103.0 - 4.0 * times / 3600.0, 103.0 - 1.0 * (times - 320.0) / 3600.0)
+    rate, periods = ecb.getLeakRate(times, tankPressure, relays)
+    assert periods == 2
+    assert rate == pytest.approx((4.0 * 289.0 + 1.0 * 569.0) / (289.0 + 569.0))
+
+
+def testShortPeriodsAreNotMeasured(ecb):
+    times = np.arange(0.0, 200.0, 1.0)
+    relays = np.zeros(len(times), dtype=np.uint8)
+    relays[::50] = 2  # The solenoids never stay closed for ANALYSIS_LEAK_MIN_DURATION
+    rate, periods = ecb.getLeakRate(times, np.full(len(times), 103.0), relays)
+    assert (rate, periods) == (0.0, 0)
+
+
+def testLeakRateKeepsPrecisionOverLongRecordings(ecb):
+    # A week at 1Hz with epoch times, where summing the raw times would lose the slope
+    times = 1800000000.0 + np.arange(0.0, 7 * 24 * 3600.0, 1.0)
+    relays = np.zeros(len(times), dtype=np.uint8)
+    relays[::3600] = 1
+    tankPressure = 103.0 - 5.0 * ((times - times[0]) % 3600.0) / 3600.0
+    rate, periods = ecb.getLeakRate(times, tankPressure, relays)
+    assert periods == 7 * 24
+    assert rate == pytest.approx(5.0, abs=1e-6)
+
+
+def testAnalysisLeavesOutZeroPressures(ecb):
+    times = np.arange(0.0, 100.0, 1.0)
+    tankPressure = np.full(len(times), 103.0)
+    columns = makeColumns(times, tankPressure, np.zeros(len(times)))
+    # Before the transducers report both pressures read zero, so would count as time at low pressure
+    columns['upstreamPressure'][:20] = 0.0
+    columns['tankPressure'][:20] = 0.0
+    summary, cycles = ecb.analyzeTelemetry(columns)
+    assert summary['samples'] == 80
+    assert summary['start'] == 20.0
+    assert summary['minTankPressure'] == 103.0
+    assert summary['lowPressureSeconds'] == 0.0
+    assert cycles == []
+
+
+def testAnalysisWithoutPressures(ecb):
+    columns = makeColumns(np.arange(10.0), np.zeros(10), np.zeros(10))
+    assert ecb.analyzeTelemetry(columns) == (None, [])
+
+
+def testAnalysisFindsCycles(ecb):
+    times = np.arange(0.0, 100.0, 1.0)
+    relays = np.zeros(len(times), dtype=np.uint8)
+    relays[10:20] = 1
+    relays[50:55] = 2
+    relays[50:60] |= 4
+    summary, cycles = ecb.analyzeTelemetry(makeColumns(times, np.full(len(times), 103.0), relays))
+    assert [row[0] for row in cycles] == ['inflation', 'deflation', 'light']
+    assert summary['inflation']['count'] == 1
+    assert summary['deflation']['count'] == 1
+    assert summary['light']['count'] == 1
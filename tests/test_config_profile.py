@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+
+def writeConfig(tmp_path, values, fileName: str = 'profile.json') -> str:
+    path = tmp_path / fileName
+    path.write_text(values if isinstance(values, str) else json.dumps(values))
+    return str(path)
+
+
+def testDefaultsFollowSetPressure(ecb, tmp_path):
+    profile = ecb.readConfigProfile(writeConfig(tmp_path, {'name': 'truck 103', 'setPressure': 103}))
+    assert profile.name == 'truck 103'
+    assert profile.setPressure == 103
+    assert profile.deflationOpenPressure == 103 + ecb.DEF_OPEN_PRESSURE - ecb.SET_PRESSURE
+    assert profile.deflationClosePressure == 103 + ecb.DEF_CLOSE_PRESSURE - ecb.SET_PRESSURE
+    assert profile.calibration == ecb.defaultProfile.calibration
+    assert profile.correction == ecb.defaultProfile.correction
+
+
+def testRigOverride(ecb, tmp_path):
+    fileName = writeConfig(tmp_path, {'name': 'truck', 'setPressure': 103, 'calibration': {'Downstream': [37.0, -17.0]},
+                                      'rigs': {'12345': {'setPressure': 100, 'calibration': {'Upstream': [38.0, -18.0]}}}})
+    profile = ecb.readConfigProfile(fileName, 12345)
+    assert profile.name == 'truck for rig 12345'
+    assert profile.setPressure == 100
+    assert profile.getCalibration('Upstream') == (38.0, -18.0)
+    assert profile.getCalibration('Downstream') == (37.0, -17.0)
+    # Other rigs only get the top level settings
+    profile = ecb.readConfigProfile(fileName, 54321)
+    assert profile.name == 'truck'
+    assert profile.setPressure == 103
+    assert profile.getCalibration('Upstream') == ecb.defaultProfile.getCalibration('Upstream')
+
+
+@pytest.mark.parametrize('values', [
+    '[1, 2]',
+    {'rigs': [1]},
+    {'rigs': {'12345': 103}},
+    {'calibration': [37.0, -17.0]},
+    {'setPoint': 103},
+    {'setPressure': 0},
+    {'setPressure': 130},
+    {'setPressure': '103'},
+    {'setPressure': 103, 'deflationOpenPressure': 105},
+    {'setPressure': 103, 'deflationClosePressure': 103.5},
+    {'setPressure': 103, 'deflationOpenPressure': 110, 'deflationClosePressure': 109.5},
+    {'calibration': {'Tank': [37.0, -17.0]}},
+    {'calibration': {'Upstream': [-37.0, -17.0]}},
+    {'calibration': {'Upstream': [37.0]}},
+    {'correction': [1.0, 2.0]},
+])
+def testInvalidProfileIsRejected(ecb, tmp_path, values):
+    with pytest.raises(ValueError):
+        ecb.readConfigProfile(writeConfig(tmp_path, values), 12345)
+
+
+def testTomlProfile(ecb, tmp_path):
+    if ecb.tomllib is None:
+        pytest.skip('TOML needs Python 3.11 or later')
+    fileName = writeConfig(tmp_path, 'setPressure = 100\n\n[rigs.12345.calibration]\nUpstream = [38.0, -18.0]\n', 'profile.toml')
+    profile = ecb.readConfigProfile(fileName, 12345)
+    assert profile.setPressure == 100
+    assert profile.getCalibration('Upstream') == (38.0, -18.0)
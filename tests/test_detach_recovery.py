@@ -0,0 +1,69 @@
+def getChannel(rig, name: str):
+    return next(phidget for phidget in rig.voltageInputs + rig.digitalOutputs if rig.getChannelInfo(phidget).name == name)
+
+
+def detach(phidget):
+    # Like Simulator.runGlitches, a channel loses its settings when it detaches
+    phidget.close()
+    phidget.reset()
+
+
+def reattach(phidget):
+    phidget.reset()
+    phidget.open()
+
+
+def assertSafeState(ecb, rig):
+    for name, state in ecb.SAFE_RELAY_STATES.items():
+        assert ecb.outputManager.peekState(getChannel(rig, name)) == state
+
+
+def testDetachEntersSafeStateAndRecovers(ecb, simulation):
+    rig = ecb.RoadTestRig()
+    assert rig.start()
+    simulation.run(120.0, 0.0, rig.runControl)
+    assert rig.state == 'running'
+
+    upstream = getChannel(rig, 'Upstream')
+    detach(upstream)
+    assert rig.state == 'detached'
+    assert not rig.allChannelsAttached
+    assertSafeState(ecb, rig)
+    evaluations = rig.evaluations
+    simulation.run(5.0, 0.0, rig.runControl)
+    # Nothing is decided while a transducer is missing
+    assert rig.evaluations == evaluations
+    assertSafeState(ecb, rig)
+
+    reattach(upstream)
+    assert rig.state == 'resuming'
+    assert upstream.getDataInterval() == ecb.dataInterval
+    simulation.run(5.0, 0.0, rig.runControl)
+    assert rig.state == 'running'
+    assert rig.evaluations > evaluations
+    assert rig.metrics.outages == 1
+    assert rig.metrics.outageSeconds >= 5.0
+    rig.close()
+
+
+def testDetachWhileStarting(ecb, simulation, monkeypatch):
+    rig = ecb.RoadTestRig()
+    openChannels = rig.openChannels
+
+    def openThenDetach():
+        openChannels()
+        detach(getChannel(rig, 'Downstream'))
+
+    monkeypatch.setattr(rig, 'openChannels', openThenDetach)
+    assert rig.start()
+    assert rig.state == 'detached'
+    assert not rig.allChannelsAttached
+    simulation.run(5.0, 0.0, rig.runControl)
+    assert rig.evaluations == 0
+
+    reattach(getChannel(rig, 'Downstream'))
+    simulation.run(5.0, 0.0, rig.runControl)
+    assert rig.state == 'running'
+    assert rig.evaluations > 0
+    assert rig.metrics.outages == 1
+    rig.close()
@@ -0,0 +1,63 @@
+import math
+
+import pytest
+
+STATES = (False, False, False)
+
+
+def testFirstSampleIsEvaluated(ecb):
+    gate = ecb.EvaluationGate(0.5, 3.0)
+    assert gate.check(125.0, 100.0, 100.0, STATES, 0.0)
+
+
+def testPressuresWithinDeadbandAreSkipped(ecb):
+    gate = ecb.EvaluationGate(0.5, 3.0)
+    assert gate.check(125.0, 100.0, 100.0, STATES, 0.0)
+    gate.update(125.0, 100.0, 100.0, STATES, math.inf, False, 0.0)
+    assert not gate.check(125.4, 100.4, 99.6, STATES, 1.0)
+    assert gate.skipped == 1
+    assert gate.check(125.0, 100.6, 100.0, STATES, 1.0)
+
+
+def testRelayChangeIsEvaluated(ecb):
+    gate = ecb.EvaluationGate(0.5, 3.0)
+    gate.check(125.0, 100.0, 100.0, STATES, 0.0)
+    gate.update(125.0, 100.0, 100.0, STATES, math.inf, False, 0.0)
+    assert gate.check(125.0, 100.0, 100.0, (True, False, False), 1.0)
+
+
+def testDropRateWindowAfterMove(ecb):
+    # The drop rate can change for a window after the pressures last moved, even if they hold still
+    gate = ecb.EvaluationGate(0.5, 3.0)
+    gate.check(125.0, 100.0, 100.0, STATES, 10.0)
+    gate.update(125.0, 100.0, 100.0, STATES, math.inf, False, 10.0)
+    assert not gate.check(125.0, 100.0, 100.0, STATES, 12.9)
+    assert gate.check(125.0, 100.0, 100.0, STATES, 13.0)
+    gate.update(125.0, 100.0, 100.0, STATES, math.inf, False, 13.0)
+    # The pressures have not moved since, so nothing is left that could change a decision
+    assert not gate.check(125.0, 100.0, 100.0, STATES, 1000.0)
+
+
+def testTimerDeadline(ecb):
+    gate = ecb.EvaluationGate(0.5, 3.0)
+    gate.check(125.0, 100.0, 100.0, STATES, 0.0)
+    gate.update(125.0, 100.0, 100.0, STATES, 2.0, False, 0.0)
+    assert not gate.check(125.0, 100.0, 100.0, STATES, 1.9)
+    assert gate.check(125.0, 100.0, 100.0, STATES, 2.0)
+
+
+def testActiveRateKeepsGateOpen(ecb):
+    gate = ecb.EvaluationGate(0.5, 3.0)
+    gate.check(125.0, 100.0, 100.0, STATES, 0.0)
+    gate.update(125.0, 100.0, 100.0, STATES, math.inf, True, 0.0)
+    assert gate.check(125.0, 100.0, 100.0, STATES, 0.1)
+
+
+def testRigDeadlinesFollowHoldOffTimes(ecb, simulation):
+    rig = ecb.RoadTestRig()
+    now = ecb.clock.monotonic()
+    # Every timer starts when the rig is made, so the inflation lockout is the first to expire
+    assert rig.getNextDeadline(False, False, False, now) == pytest.approx(now + ecb.HOLD_OFF_TIMES[0])
+    assert rig.getNextDeadline(True, True, False, now) == pytest.approx(now + ecb.HOLD_OFF_TIMES[2])
+    ecb.clock.advance(ecb.HOLD_OFF_TIMES[0] + 1.0)
+    assert rig.getNextDeadline(False, False, False, ecb.clock.monotonic()) == pytest.approx(now + ecb.HOLD_OFF_TIMES[1])
@@ -0,0 +1,56 @@
+import pytest
+
+
+def testRateOfSteadyDrop(ecb):
+    history = ecb.PressureHistory(64, 3.0)
+    for n in range(13):
+        history.append(n * 0.25, 100.0 - n * 0.25)
+    assert history.count == 13
+    assert history.getRate() == pytest.approx(-1.0)
+
+
+def testRateNeedsTwoSamples(ecb):
+    history = ecb.PressureHistory(64, 3.0)
+    assert history.getRate() == 0.0
+    history.append(0.0, 100.0)
+    assert history.getRate() == 0.0
+    history.append(0.0, 90.0)
+    assert history.getRate() == 0.0  # No time has passed
+
+
+def testSamplesOlderThanWindowExpire(ecb):
+    history = ecb.PressureHistory(64, 3.0)
+    history.append(0.0, 100.0)
+    history.append(1.0, 99.0)
+    history.append(3.0, 97.0)
+    assert history.count == 3  # Exactly a window old is kept
+    history.append(3.5, 96.0)
+    assert history.count == 3
+    assert history.getRate() == pytest.approx((96.0 - 99.0) / 2.5)
+
+
+def testNewestSampleIsAlwaysKept(ecb):
+    history = ecb.PressureHistory(64, 3.0)
+    history.append(0.0, 100.0)
+    history.append(1.0, 99.0)
+    history.append(10.0, 50.0)
+    assert history.count == 1
+    assert history.getRate() == 0.0
+
+
+def testFullBufferOverwritesOldest(ecb):
+    history = ecb.PressureHistory(4, 100.0)
+    for n in range(6):
+        history.append(float(n), 100.0 - 2.0 * n * n)
+    assert history.count == 4
+    # The oldest sample left is n = 2
+    assert history.getRate() == pytest.approx(((100.0 - 50.0) - (100.0 - 8.0)) / 3.0)
+
+
+def testClear(ecb):
+    history = ecb.PressureHistory(8, 3.0)
+    history.append(0.0, 100.0)
+    history.append(1.0, 90.0)
+    history.clear()
+    assert history.count == 0
+    assert history.getRate() == 0.0
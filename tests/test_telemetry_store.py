@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+
+def makeSamples(count: int, startTime: float = 1800000000.0) -> list:
+    # TelemetryWriter sample tuples, the last field is the clock.monotonic() used by the stream
+    return [(startTime + n * 0.25, 3.7 + n * 0.001, 2.8 - n * 0.001, 125.0 + n, 100.0 - n, 100.5 - n, 0.0, n % 2 == 0, n % 3 == 0, n % 5 == 0, 12345, n * 0.25) \
+            for n in range(count)]
+
+
+def testRoundTrip(ecb, tmp_path):
+    samples = makeSamples(10)
+    store = ecb.TelemetryStore(str(tmp_path), 4)
+    store.append(samples[:3])
+    store.append(samples[3:])
+    store.close()
+    assert len(ecb.getStoreChunks(str(tmp_path))) == 3
+
+    columns = ecb.loadTelemetryStore(str(tmp_path))
+    for n, (name, _) in enumerate(ecb.TelemetryStore.COLUMNS[:7]):
+        assert list(columns[name]) == [sample[n] for sample in samples]
+    assert list(columns['rig']) == [12345] * len(samples)
+    assert list(columns['relays']) == [(1 if s[7] else 0) | (2 if s[8] else 0) | (4 if s[9] else 0) for s in samples]
+
+
+def testTimeRange(ecb, tmp_path):
+    samples = makeSamples(10)
+    store = ecb.TelemetryStore(str(tmp_path), 4)
+    store.append(samples)
+    store.close()
+    columns = ecb.loadTelemetryStore(str(tmp_path), samples[2][0], samples[5][0])
+    assert list(columns['time']) == [sample[0] for sample in samples[2:6]]
+    columns = ecb.loadTelemetryStore(str(tmp_path), samples[-1][0] + 1.0)
+    assert len(columns['time']) == 0
+
+
+def testStoreIsReadableWhileOpen(ecb, tmp_path):
+    samples = makeSamples(3)
+    store = ecb.TelemetryStore(str(tmp_path), 8)
+    store.append(samples)
+    columns = ecb.loadTelemetryStore(str(tmp_path))
+    assert list(columns['time']) == [sample[0] for sample in samples]
+    store.close()
+
+
+def testReopenedStoreContinuesAfterHighestChunk(ecb, tmp_path):
+    for samples in (makeSamples(2), makeSamples(2, 1800000010.0), makeSamples(2, 1800000020.0)):
+        store = ecb.TelemetryStore(str(tmp_path), 4)
+        store.append(samples)
+        store.close()
+    os.remove(tmp_path / ecb.TelemetryStore.CHUNK_PATTERN.format(1))
+    store = ecb.TelemetryStore(str(tmp_path), 4)
+    store.append(makeSamples(2, 1800000030.0))
+    store.close()
+    columns = ecb.loadTelemetryStore(str(tmp_path))
+    assert [time - 1800000000.0 for time in columns['time']] == pytest.approx([0.0, 0.25, 20.0, 20.25, 30.0, 30.25])
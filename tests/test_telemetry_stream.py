@@ -0,0 +1,63 @@
+import socket
+import time
+
+import pytest
+
+
+@pytest.fixture
+def stream(ecb):
+    # Port 0 lets the system pick a free port
+    stream = ecb.TelemetryStream('0', ecb.STREAM_HOST, ecb.STREAM_MAX_BACKLOG)
+    stream.start()
+    yield stream
+    stream.stop()
+
+
+def subscribe(stream, streamClient) -> socket.socket:
+    connection = streamClient.connect(str(stream.server.getsockname()[1]))
+    deadline = time.monotonic() + 5.0
+    while stream.subscribed == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stream.subscribed == 1
+    return connection
+
+
+def testClientMatchesProtocol(ecb, streamClient):
+    assert streamClient.MAGIC == ecb.TelemetryStream.MAGIC
+    assert streamClient.VERSION == ecb.TelemetryStream.VERSION
+    assert streamClient.HEADER.format == ecb.TelemetryStream.HEADER.format
+    assert streamClient.FRAME.format == ecb.TelemetryStream.FRAME.format
+    for kind, name in ((ecb.TelemetryStream.SAMPLE, 'sample'), (ecb.TelemetryStream.RELAY, 'relay'), \
+                       (ecb.TelemetryStream.DETACHED, 'detached'), (ecb.TelemetryStream.RESUMED, 'resumed')):
+        assert streamClient.KINDS[kind] == name
+
+
+def testFramesDecodeInClient(ecb, streamClient, stream):
+    connection = subscribe(stream, streamClient)
+    sample = (1800000000.0, 3.77, 2.84, 125.1, 89.8, 90.2, 89.9, True, False, True, 12345, 42.5)
+    relay = ecb.TelemetryStream.FRAME.pack(ecb.TelemetryStream.DETACHED, ecb.TelemetryStream.getRelayBits(False, False, True), 12345, 43.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    stream.publish(stream.packSample(sample) + relay)
+    connection.settimeout(5.0)
+    streamClient.readHeader(connection)
+    row = streamClient.decodeFrame(streamClient.readExactly(connection, streamClient.FRAME.size))
+    assert row == ('sample', 12345, 42.5, 3.77, 2.84, 125.1, 89.8, 90.2, 89.9, True, False, True)
+    row = streamClient.decodeFrame(streamClient.readExactly(connection, streamClient.FRAME.size))
+    assert row[:3] == ('detached', 12345, 43.0)
+    assert row[-3:] == (False, False, True)
+    connection.close()
+
+
+def testSampleWithoutRigIsZero(ecb, streamClient, stream):
+    sample = (1800000000.0, 3.77, 2.84, 125.1, 89.8, 90.2, 0.0, False, True, False, None, 1.0)
+    row = streamClient.decodeFrame(stream.packSample(sample))
+    assert row[1] == 0
+    assert row[-3:] == (False, True, False)
+
+
+def testClientRejectsOtherStreams(streamClient):
+    server, client = socket.socketpair()
+    server.sendall(b'HTTP/1.1')
+    with pytest.raises(ValueError):
+        streamClient.readHeader(client)
+    server.close()
+    client.close()